@@ -0,0 +1,575 @@
+"""
+benchmarks for the remote ratBerryPi interface and position input
+
+five suites are available. the clients suite compares the throughput and
+latency of the blocking ratBerryPi client, which allows one request in
+flight per channel, with the pipelined QtAsyncClient. the widgets suite
+replays the call patterns of the remote reward widgets (lick and pump
+position polling through a shared StatePoller and commands on the 'run'
+channel) with both clients for an increasing number of modules and reports
+latency per call and throughput per channel. the rewards suite measures the
+time from triggering a reward to fluid starting to flow, with and without
+arming the reward first (the stand-in only adds an assumed setup cost to
+unarmed rewards, so this is a simulation), and the tones suite measures the
+delay and jitter of tone onsets with and without preloading the tone
+(likewise simulated from an assumed rendering cost). both use the times
+recorded by an in-process stand-in server, so they cannot be run against a
+pi. the positions suite compares the time PositionThread takes to handle
+binary and legacy text position packets for increasing numbers of keypoints
+and needs no server. by default the benchmarks run against a local stand-in
+server. results may be saved as json so runs can be compared.
+"""
+
+import argparse
+import json
+import platform
+import socket
+import threading
+import time
+import typing
+from datetime import datetime
+import numpy as np
+from pyBehavior.interfaces.rpi import wire
+
+
+class BlockingClient:
+    """
+    minimal blocking client with one request in flight per channel, used
+    as a reference when ratBerryPi.remote.client.Client is not installed
+    """
+
+    def __init__(self, host:str, port:int):
+        self.host = host
+        self.port = port
+        self.channels = {}
+        self.new_channel(None)
+
+    def new_channel(self, name:str) -> None:
+        sock = socket.create_connection((self.host, self.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.channels[name] = (sock, sock.makefile('rb'), threading.Lock())
+
+    def run_command(self, command:str, args:dict = None, channel:str = None) -> str:
+        sock, rfile, lock = self.channels[channel]
+        with lock:
+            sock.sendall(wire.encode_request(command, args))
+            return wire.decode_reply(rfile.readline())[1]
+
+    def get(self, req:str, channel:str = None):
+        return wire.parse_value(self.run_command('GET', {'req': req}, channel))
+
+    def close(self) -> None:
+        for sock, rfile, _ in self.channels.values():
+            rfile.close()
+            sock.close()
+
+
+def summarize(latencies:typing.List[float], elapsed:float) -> dict:
+    """
+    summarize a set of request latencies measured over a period of time
+
+    Args:
+        latencies: typing.List[float]
+            latency of each request in seconds
+        elapsed: float
+            wall time over which the requests were made in seconds
+    """
+
+    lat = np.array(latencies) * 1e3
+    res = {'n': int(lat.size),
+           'throughput_hz': lat.size / elapsed if elapsed > 0 else float('nan')}
+    if lat.size == 0:
+        return {**res, **{k: float('nan') for k in ('mean_ms', 'p50_ms', 'p99_ms', 'p999_ms', 'max_ms')}}
+    p50, p99, p999 = np.percentile(lat, [50, 99, 99.9])
+    return {**res,
+            'mean_ms': float(lat.mean()),
+            'p50_ms': float(p50),
+            'p99_ms': float(p99),
+            'p999_ms': float(p999),
+            'max_ms': float(lat.max())}
+
+
+def bench_blocking(client, req:str, n:int) -> dict:
+    """
+    issue n sequential reads through a blocking client
+    """
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(n):
+        t = time.perf_counter()
+        client.get(req)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def bench_pipelined(client, req:str, n:int, window:int = 32) -> dict:
+    """
+    issue n reads through a QtAsyncClient keeping up to window requests in flight
+    """
+
+    latencies = []
+    sem = threading.Semaphore(window)
+    done = threading.Event()
+
+    def on_done(t0):
+        latencies.append(time.perf_counter() - t0)
+        sem.release()
+        if len(latencies) == n:
+            done.set()
+
+    start = time.perf_counter()
+    for _ in range(n):
+        sem.acquire()
+        t0 = time.perf_counter()
+        client.submit_get(req).add_done_callback(lambda f, t0 = t0: on_done(t0))
+    done.wait()
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def blocking_client(host:str, port:int):
+    """
+    connect to an endpoint with the ratBerryPi client if it is
+    installed, falling back to BlockingClient otherwise
+    """
+
+    try:
+        from ratBerryPi.remote.client import Client
+        return Client(host, port)
+    except ImportError:
+        return BlockingClient(host, port)
+
+
+def compare_clients(host:str, port:int, req:str, n:int = 2000, window:int = 32) -> dict:
+    """
+    benchmark the blocking client against the pipelined client on the same endpoint
+    """
+
+    from pyBehavior.interfaces.rpi.aio import QtAsyncClient
+    blocking = blocking_client(host, port)
+    pipelined = QtAsyncClient(host, port)
+    try:
+        return {'blocking': bench_blocking(blocking, req, n),
+                'pipelined': bench_pipelined(pipelined, req, n, window)}
+    finally:
+        pipelined.close()
+        if hasattr(blocking, 'close'):
+            blocking.close()
+
+
+class _Recorder:
+    """
+    thread-safe store of request latencies keyed by call and by channel
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.channels = {}
+        self._lock = threading.Lock()
+
+    def time(self, call:str, channel:str, fn:typing.Callable, /, *args, **kwargs):
+        t = time.perf_counter()
+        res = fn(*args, **kwargs)
+        dt = time.perf_counter() - t
+        with self._lock:
+            self.calls.setdefault(call, []).append(dt)
+            self.channels.setdefault(channel, []).append(dt)
+        return res
+
+
+def _run_widget_calls(client, rec:_Recorder, modules:typing.List[str], interval:float,
+                      stop:threading.Event) -> None:
+    # commands issued on the 'run' channel by RPIRewardControl and PumpConfig
+    i = 0
+    while not stop.is_set():
+        module = modules[i % len(modules)]
+        on = bool(i % 2)
+        rec.time('trigger_reward', 'run', client.run_command, 'trigger_reward',
+                 {'module': module, 'amount': 0.001, 'force': False, 'enqueue': False}, channel = 'run')
+        rec.time('toggle_LED', 'run', client.run_command, 'toggle_LED',
+                 {'module': module, 'on': on}, channel = 'run')
+        rec.time('get_LED', 'run', client.get, f"modules['{module}'].LED.on", channel = 'run')
+        rec.time('toggle_valve', 'run', client.run_command, 'toggle_valve',
+                 {'module': module, 'open_valve': on}, channel = 'run')
+        rec.time('play_tone', 'run', client.run_command, 'play_tone',
+                 {'module': module, 'freq': 1000., 'dur': 0.1, 'volume': 1.}, channel = 'run')
+        i += 1
+        stop.wait(interval)
+
+
+class _TimedClient:
+    """
+    wrapper recording the latency of every read a StatePoller makes through a client
+    """
+
+    def __init__(self, client, rec:_Recorder):
+        self.client = client
+        self.rec = rec
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def get(self, req:str, channel:str = None):
+        return self.rec.time('poll_get', channel, self.client.get, req, channel = channel)
+
+    def get_many(self, reqs:typing.List[str], channel:str = None) -> list:
+        return self.rec.time('poll_batch', channel, self.client.get_many, reqs, channel = channel)
+
+
+def bench_widgets(client, modules:typing.List[str], pumps:typing.List[str], duration:float = 5.,
+                  lick_interval:float = 0.005, pos_interval:float = 0.1,
+                  command_interval:float = 0.1) -> dict:
+    """
+    replay the call patterns of the remote reward widgets against a client.
+    the lick count of every module and the position of every pump are
+    watched on a StatePoller as in the GUI, while another thread issues
+    widget commands on the 'run' channel
+
+    Args:
+        client:
+            client to benchmark. must support new_channel, get and run_command
+        modules: typing.List[str]
+            reward modules to poll licks from
+        pumps: typing.List[str]
+            pumps to poll positions from
+        duration: float (optional)
+            how long to run the benchmark for in seconds
+        lick_interval: float (optional)
+            time between lick polls of each module in seconds
+        pos_interval: float (optional)
+            time between position polls of each pump in seconds
+        command_interval: float (optional)
+            time between rounds of widget commands in seconds
+
+    Returns:
+        res: dict
+            whether the poller read in batches, the number of batches
+            read per second and latency summaries per call type and per channel
+    """
+
+    from pyBehavior.interfaces.rpi.poller import StatePoller
+    rec = _Recorder()
+    stop = threading.Event()
+    poller = StatePoller(_TimedClient(client, rec))
+    client.new_channel('run')
+    commands = threading.Thread(target = _run_widget_calls,
+                                args = (client, rec, modules, command_interval, stop))
+
+    start = time.perf_counter()
+    for m in modules:
+        poller.watch(f"modules['{m}'].lickometer.licks", lick_interval)
+    for p in pumps:
+        poller.watch(f"pumps['{p}'].position", pos_interval)
+    commands.start()
+    time.sleep(duration)
+    stop.set()
+    poller.stop()
+    commands.join()
+    elapsed = time.perf_counter() - start
+    return {'batched': poller.batched,
+            'batches_per_s': poller.n_batches / elapsed,
+            'calls': {k: summarize(v, elapsed) for k, v in rec.calls.items()},
+            'channels': {k: summarize(v, elapsed) for k, v in rec.channels.items()}}
+
+
+def scale_widgets(connect:typing.Callable, module_counts:typing.List[int], n_pumps:int = 1,
+                  **kwargs) -> dict:
+    """
+    run bench_widgets for an increasing number of modules to see how
+    latency degrades as more attributes are polled from the endpoint
+
+    Args:
+        connect: typing.Callable
+            function returning a new client connected to the endpoint
+        module_counts: typing.List[int]
+            numbers of modules to benchmark
+        n_pumps: int (optional)
+            number of pumps to poll
+        **kwargs:
+            passed to bench_widgets
+    """
+
+    res = {}
+    pumps = [f"pump{i+1}" for i in range(n_pumps)]
+    for n in module_counts:
+        client = connect()
+        try:
+            res[str(n)] = bench_widgets(client, [f"module{i+1}" for i in range(n)], pumps, **kwargs)
+        finally:
+            if hasattr(client, 'close'):
+                client.close()
+    return res
+
+
+def bench_rewards(server, module:str = 'module1', n:int = 50, amount:float = 0.01,
+                  interval:float = 0.05) -> dict:
+    """
+    measure the time from triggering a reward to the stand-in server starting
+    to dispense it, for rewards sent as usual and rewards armed with
+    arm_reward and sent as a prepared command. the server and the benchmark
+    share a clock so the flow times it records can be compared directly
+
+    this is a simulation: the stand-in server waits reward_setup seconds
+    before unarmed rewards only, so the difference between the two kinds is
+    that assumed setup cost plus what is saved by sending a prepared command.
+    it says nothing about the setup cost of real hardware
+
+    Args:
+        server: StandInServer
+            running in-process stand-in server
+        module: str (optional)
+            module to deliver rewards to
+        n: int (optional)
+            number of rewards of each kind
+        amount: float (optional)
+            amount of each reward in mL
+        interval: float (optional)
+            time between arming a reward and triggering it in seconds
+    """
+
+    from pyBehavior.interfaces.rpi.aio import QtAsyncClient
+    client = QtAsyncClient(server.host, server.port)
+    args = {'module': module, 'amount': amount, 'force': True, 'enqueue': False}
+    res = {}
+    try:
+        for kind in ('unarmed', 'armed'):
+            to_flow, to_ack = [], []
+            start = time.perf_counter()
+            for _ in range(n):
+                if kind == 'armed':
+                    client.run_command('arm_reward', args)
+                    prepared = wire.prepare_request('trigger_reward', args)
+                time.sleep(interval)
+                n_flows = len(server.flows)
+                t0 = time.time()
+                if kind == 'armed':
+                    fut = client.submit_prepared(prepared)
+                else:
+                    fut = client.submit('trigger_reward', args)
+                fut.result(client.timeout)
+                to_ack.append(time.time() - t0)
+                to_flow.append(server.flows[n_flows][0] - t0)
+            elapsed = time.perf_counter() - start
+            res[kind] = {'trigger_to_flow': summarize(to_flow, elapsed),
+                         'trigger_to_ack': summarize(to_ack, elapsed)}
+    finally:
+        client.close()
+    res['simulated'] = {'reward_setup': server.reward_setup,
+                        'note': "unarmed rewards wait the assumed reward_setup on the stand-in server"}
+    return res
+
+
+def bench_tones(server, module:str = 'module1', n:int = 50, dur:float = 0.2,
+                interval:float = 0.05) -> dict:
+    """
+    measure the time from requesting a tone to the stand-in server starting to
+    play it, for tones sent with play_tone and tones preloaded with preload_tone
+    and played with play_cue. the jitter of each is the standard deviation
+    of the onset delays
+
+    this is a simulation: the stand-in server only spends tone_render seconds
+    per second of tone (varying by up to 50%) on tones sent with play_tone,
+    so the difference between the two kinds reproduces that assumed
+    rendering cost. it says nothing about the speaker path of a real pi
+
+    Args:
+        server: StandInServer
+            running in-process stand-in server
+        module: str (optional)
+            module to play tones on
+        n: int (optional)
+            number of tones of each kind
+        dur: float (optional)
+            duration of each tone in seconds
+        interval: float (optional)
+            time between tones in seconds
+    """
+
+    from pyBehavior.interfaces.rpi.aio import QtAsyncClient
+    client = QtAsyncClient(server.host, server.port)
+    tone = {'module': module, 'freq': 800., 'dur': dur, 'volume': 1.}
+    requests = {'synthesized': wire.prepare_request('play_tone', tone),
+                'preloaded': wire.prepare_request('play_cue', {'module': module, 'name': 'bench'})}
+    res = {}
+    try:
+        client.run_command('preload_tone', {**tone, 'name': 'bench'})
+        for kind, prepared in requests.items():
+            onsets = []
+            start = time.perf_counter()
+            for _ in range(n):
+                time.sleep(interval)
+                n_tones = len(server.tones)
+                t0 = time.time()
+                client.submit_prepared(prepared).result(client.timeout)
+                onsets.append(server.tones[n_tones][0] - t0)
+            res[kind] = {'onset': summarize(onsets, time.perf_counter() - start),
+                         'jitter_ms': float(np.std(onsets) * 1e3)}
+    finally:
+        client.close()
+    res['simulated'] = {'tone_render': server.tone_render,
+                        'note': "tones sent with play_tone wait the assumed tone_render on the stand-in server"}
+    return res
+
+
+def _text_packet(xy:np.ndarray, conf:np.ndarray) -> bytes:
+    # legacy position packet: a python literal of ((x, y), confidence) pairs
+    return str([[(p, c) for p, c in zip(xy.tolist(), conf.tolist())]]).encode()
+
+
+def bench_positions(keypoints:typing.List[int], n:int = 5000) -> dict:
+    """
+    measure the time PositionThread takes to parse a position packet and
+    update the smoothed position, for binary packets and for packets in the
+    legacy text format, and to filter binary packets with a kalman filter
+
+    Args:
+        keypoints: typing.List[int]
+            numbers of keypoints per packet to test
+        n: int (optional)
+            number of packets of each kind
+    """
+
+    from pyBehavior.interfaces.socket import PositionThread, encode_packet
+    from pyBehavior.interfaces.kalman import ConstantVelocityKalman
+    thread = PositionThread(0)
+    rng = np.random.default_rng(0)
+    res = {}
+    try:
+        for k in keypoints:
+            xy = rng.uniform(0, 1000, (k, 2))
+            conf = rng.uniform(0, 1, k)
+            packets = {'text': _text_packet(xy, conf), 'binary': encode_packet(xy, conf),
+                       'kalman': encode_packet(xy, conf)}
+            res[k] = {}
+            for kind, packet in packets.items():
+                thread.kalman = ConstantVelocityKalman() if kind == 'kalman' else None
+                data = memoryview(bytearray(packet))
+                times = []
+                start = time.perf_counter()
+                for _ in range(n):
+                    t = time.perf_counter()
+                    thread.process(data)
+                    times.append(time.perf_counter() - t)
+                res[k][kind] = {**summarize(times, time.perf_counter() - start), 'bytes': len(packet)}
+    finally:
+        thread.sock.close()
+    return res
+
+
+def save_results(res:dict, path:str, config:dict = None) -> None:
+    """
+    save benchmark results as json along with the configuration and
+    machine they were produced on
+
+    Args:
+        res: dict
+            benchmark results
+        path: str
+            file to write to
+        config: dict (optional)
+            arguments the benchmarks were run with
+    """
+
+    out = {'time': datetime.now().isoformat(),
+           'host': platform.node(),
+           'python': platform.python_version(),
+           'config': config if config is not None else {},
+           'results': res}
+    with open(path, 'w') as f:
+        json.dump(out, f, indent = 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "benchmark the remote ratBerryPi interface and position input")
+    parser.add_argument('--host', default = None,
+                        help = "ratBerryPi server to benchmark. a local stand-in server is used if not set")
+    parser.add_argument('--port', type = int, default = 5562)
+    parser.add_argument('--latency', type = float, default = 0.002,
+                        help = "round trip latency to simulate on the stand-in server [s]")
+    parser.add_argument('--suite', choices = ['clients', 'widgets', 'rewards', 'tones', 'positions', 'all'], default = 'all')
+    parser.add_argument('-n', type = int, default = 2000,
+                        help = "number of requests per client in the clients suite")
+    parser.add_argument('--window', type = int, default = 32,
+                        help = "maximum requests in flight for the pipelined client")
+    parser.add_argument('--req', default = "modules['module1'].lickometer.licks")
+    parser.add_argument('--modules', type = int, nargs = '+', default = [1, 4, 8, 16],
+                        help = "numbers of modules to poll in the widgets suite")
+    parser.add_argument('--pumps', type = int, default = 1)
+    parser.add_argument('--duration', type = float, default = 5.,
+                        help = "duration of each run of the widgets suite [s]")
+    parser.add_argument('--lick-interval', type = float, default = 0.005)
+    parser.add_argument('--pos-interval', type = float, default = 0.1)
+    parser.add_argument('--command-interval', type = float, default = 0.1)
+    parser.add_argument('--rewards', type = int, default = 50,
+                        help = "number of rewards of each kind in the rewards suite")
+    parser.add_argument('--reward-setup', type = float, default = 0.01,
+                        help = "time the stand-in server takes to set up a reward that was not armed [s]")
+    parser.add_argument('--tones', type = int, default = 50,
+                        help = "number of tones of each kind in the tones suite")
+    parser.add_argument('--tone-render', type = float, default = 0.05,
+                        help = "time the stand-in server takes to synthesize each second of a tone [s]")
+    parser.add_argument('--keypoints', type = int, nargs = '+', default = [4, 16, 64],
+                        help = "numbers of keypoints per packet in the positions suite")
+    parser.add_argument('--packets', type = int, default = 5000,
+                        help = "number of packets of each kind in the positions suite")
+    parser.add_argument('--subprocess', action = 'store_true',
+                        help = "run the stand-in server in a separate process")
+    parser.add_argument('-o', '--output', default = None,
+                        help = "file to save the results to as json")
+    args = parser.parse_args()
+
+    server = None
+    if args.host is None:
+        from pyBehavior.interfaces.rpi.server import StandInServer, StandInState, SubprocessServer
+        if args.subprocess:
+            server = SubprocessServer(port = 0, modules = max(args.modules), pumps = args.pumps,
+                                      latency = args.latency, reward_setup = args.reward_setup,
+                                      tone_render = args.tone_render)
+        else:
+            state = StandInState(n_modules = max(args.modules), n_pumps = args.pumps)
+            server = StandInServer(state = state, latency = args.latency, reward_setup = args.reward_setup,
+                                   tone_render = args.tone_render)
+        server.start()
+        host, port = server.host, server.port
+    else:
+        host, port = args.host, args.port
+
+    res = {}
+    try:
+        if args.suite in ('clients', 'all'):
+            res['clients'] = compare_clients(host, port, args.req, args.n, args.window)
+        if args.suite in ('widgets', 'all'):
+            from pyBehavior.interfaces.rpi.aio import QtAsyncClient
+            res['widgets'] = {}
+            for name, connect in [('blocking', lambda: blocking_client(host, port)),
+                                  ('async', lambda: QtAsyncClient(host, port))]:
+                res['widgets'][name] = scale_widgets(connect, args.modules,
+                                                     n_pumps = args.pumps,
+                                                     duration = args.duration,
+                                                     lick_interval = args.lick_interval,
+                                                     pos_interval = args.pos_interval,
+                                                     command_interval = args.command_interval)
+        if args.suite in ('rewards', 'all'):
+            if server is not None and not args.subprocess:
+                res['rewards'] = bench_rewards(server, n = args.rewards)
+            elif args.suite == 'rewards':
+                print("the rewards suite requires an in-process stand-in server")
+        if args.suite in ('tones', 'all'):
+            if server is not None and not args.subprocess:
+                res['tones'] = bench_tones(server, n = args.tones)
+            elif args.suite == 'tones':
+                print("the tones suite requires an in-process stand-in server")
+        if args.suite in ('positions', 'all'):
+            res['positions'] = bench_positions(args.keypoints, args.packets)
+    finally:
+        if server is not None:
+            server.stop()
+
+    print(json.dumps(res, indent = 2))
+    if args.output is not None:
+        config = {**vars(args), 'host': host, 'port': port, 'stand_in': server is not None}
+        save_results(res, args.output, config)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import pandas as pd
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal, Qt
 from PyQt5.QtGui import QDoubleValidator, QFont
 from PyQt5.QtWidgets import (QMainWindow, QPushButton, QVBoxLayout, QHBoxLayout, QWidget,
                              QComboBox, QFileDialog, QLineEdit, QGroupBox, QLabel,
@@ -15,7 +15,6 @@ from pyBehavior.protocols import *
 from pyBehavior import styles
 import logging
 import paramiko
-from scp import SCPClient
 import typing
 
 
@@ -25,12 +24,26 @@ class RewardWidgetMeta(type(QGroupBox), ABCMeta):
 class RewardWidget(QGroupBox, metaclass = RewardWidgetMeta):
     """
     abstract class to be inherited when creating widgets for reward control
-    defines an abstract method trigger_reward which must be defined in the subclass
+    defines an abstract method trigger_reward which must be defined in the subclass.
+    widgets which can prepare a reward ahead of time override arm_reward and disarm_reward
     """
     @abstractmethod
     def trigger_reward(amount):
         ...
 
+    def arm_reward(self, amount:float, **kwargs) -> None:
+        """
+        prepare a reward so a following trigger_reward with the same
+        arguments is delivered with less delay. does nothing by default
+        """
+        pass
+
+    def disarm_reward(self) -> None:
+        """
+        drop a reward prepared with arm_reward. does nothing by default
+        """
+        pass
+
 class ModuleDict(UserDict):
     """
     custom dictionary with checking to enforce
@@ -44,7 +57,73 @@ class ModuleDict(UserDict):
             super().__setitem__(key, value)
         else:
             raise ValueError("entries in ModuleDict must be instances of subclasses of gui.RewardWidget")
-    
+
+
+class RenderThrottle(QObject):
+    """
+    caps the rate at which frequently updated read-outs (e.g. lick counts and
+    pump positions) are repainted. widgets keep their counts up to date on
+    every event but pass the text to display to set_text, which holds on to
+    the latest text for each widget and applies it the next time the refresh
+    timer fires. every read-out shares one timer, which only runs while
+    there is something to repaint
+
+    Args:
+        rate: float (optional)
+            maximum number of repaints per second
+    """
+
+    _shared = None
+
+    def __init__(self, rate:float = 20.):
+        super(RenderThrottle, self).__init__()
+        self._pending = {}
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(int(1000 / rate))
+        self._timer.timeout.connect(self.flush)
+
+    @classmethod
+    def shared(cls) -> 'RenderThrottle':
+        """
+        get the throttle shared by every widget, creating it if needed
+        """
+
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @property
+    def rate(self) -> float:
+        return 1000 / self._timer.interval()
+
+    @rate.setter
+    def rate(self, rate:float) -> None:
+        self._timer.setInterval(int(1000 / rate))
+
+    def set_text(self, widget:QWidget, text:str) -> None:
+        """
+        set the text of a widget at the next refresh. only the latest
+        text set on a widget before the refresh is displayed
+        """
+
+        self._pending[widget] = text
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self) -> None:
+        """
+        apply all pending text now
+        """
+
+        pending, self._pending = self._pending, {}
+        for widget, text in pending.items():
+            try:
+                widget.setText(text)
+            except RuntimeError:
+                # the widget was deleted before the refresh
+                pass
+
 
 class SetupGUI(QMainWindow):
     """
@@ -77,18 +156,69 @@ class SetupGUI(QMainWindow):
             and PORT which specify the username for logging into the pi, the 
             hostname for the pi, and the port number that the ratBerryPi server is 
             serving on. if running locally this file must have the field LOCAL and
-            it should be set to true
+            it should be set to true. the optional field CLIENT may be set to
+            'async' to communicate with the server through the pipelined
+            pyBehavior.interfaces.rpi.aio.QtAsyncClient. otherwise requests
+            made on the 'run' channel are spread over a pool of POOL_SIZE
+            channels (4 by default, 0 to disable pooling). attribute reads are
+            served from a client-side cache refreshed every CACHE_REFRESH seconds
+            (2 by default) unless CACHE is set to false. if ASYNC_REWARDS is
+            true rewards are sent without blocking the GUI. the client reconnects
+            automatically if the connection to the pi is lost, buffering up to
+            COMMAND_BUFFER (64 by default) idempotent commands in the meantime,
+            unless RECONNECT is set to false. the offset of the pi clock is
+            estimated every CLOCK_SYNC seconds (2 by default, 0 to disable) and
+            used to add a host_time column, converted from the TIME_COLUMN column
+            ('time' by default), to the csv files copied from the pi.
+            lick counts, pump positions and reward totals are repainted at
+            most RENDER_RATE times per second (20 by default)
         interface (ratBerryPi.interface.RewardInterface)
             interface for controlling a ratBerryPi locally
+        rpi_executor (pyBehavior.interfaces.rpi.executor.CommandExecutor)
+            background executor shared by the local widgets for calls to the
+            interface. calls on each pump run in order and the duration of
+            every call is logged at debug level
         client (ratBerryPi.Client)
             client for communicating with a remote ratBerryPi server
+        rpi_poller (pyBehavior.interfaces.rpi.poller.StatePoller)
+            poller shared by the remote widgets for reading lick counts,
+            pump positions and any other attribute watched on the pi
+        rpi_dispatcher (pyBehavior.interfaces.rpi.dispatch.RewardDispatcher)
+            background sender for rewards triggered without blocking
+        rpi_commands (pyBehavior.interfaces.rpi.dispatch.CommandDispatcher)
+            background sender for other commands (e.g. toggling LEDs and valves)
+        rpi_clock (pyBehavior.interfaces.rpi.clock.ClockSync)
+            estimator of the offset and drift of the pi clock relative to the
+            clock on this machine (None if CLOCK_SYNC is 0). probing stops if
+            the pi does not support get_time. once the pi clock has been probed
+            the estimate is saved to the session directory when a protocol is stopped,
+            the csv files copied from the pi are converted with it, and
+            rpi_clock.model.to_host converts times recorded on the pi
         layout (PyQt5.QtWidgets.QVBoxLayout)
             vertical box layout for constructing the GUI. any additional gui elements
             should be added to this layout to be displayed
         reward_modules (ModuleDict)
             dictionary mapping names to instances of RewardWidgets
+        pump_configs (dict)
+            dictionary mapping pump names to the PumpConfig widgets created for them.
+            operations may be run on every pump at once with run_pump_operation,
+            which runs pumps listed together in the MANIFOLDS field of rpi_config
+            one after another
+        refill_scheduler (pyBehavior.interfaces.rpi.refill.RefillScheduler)
+            tracks the volume dispensed by each pump and refills syringes
+            during the safe windows of the running protocol. syringes are
+            refilled if they are forecast to reach their auto fill threshold
+            within REFILL_HORIZON seconds (60 by default)
+
+    ...
+    PyQt Signals
+
+    state_entered(str)
+        id of the state the running protocol just entered
     """
 
+    state_entered = pyqtSignal(str)
+
     def __init__(self, loc):
         super(SetupGUI, self).__init__()
         self.loc = Path(loc)
@@ -102,22 +232,73 @@ class SetupGUI(QMainWindow):
         else:
             self.mapping = None
 
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+        # handlers go on the package logger so messages that background threads
+        # log through their module's logger (e.g. failed rpi polls) are written
+        # to the console and the session log alongside the gui's own
+        self._log_root = logging.getLogger('pyBehavior')
+        self._log_root.setLevel(logging.DEBUG)
+
+        self._log_fh = None
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        self._formatter = logging.Formatter(
+            '%(asctime)s.%(msecs)03d, %(levelname)s, %(message)s', "%Y-%m-%d %H:%M:%S"
+        )
+        ch.setFormatter(self._formatter)
+        self._log_root.addHandler(ch)
+
         # if there is a config file for connecting to a raspberry pi load it
         self._has_remote_rpi = False
         self._has_local_rpi = False
         if os.path.exists(self.loc/'rpi_config.yaml'):
             with open(self.loc/'rpi_config.yaml', 'r') as f:
                 self.rpi_config = yaml.safe_load(f)
+            RenderThrottle.shared().rate = self.rpi_config.get('RENDER_RATE', 20.)
             if self.rpi_config.get('LOCAL', False):
                 from ratBerryPi.interface import RewardInterface
                 self.interface = RewardInterface()
                 self.interface.start()
                 self._has_local_rpi = True
             else:
-                from ratBerryPi.remote.client import Client
-                self.client = Client(self.rpi_config['HOST'],
-                                     self.rpi_config['PORT'])
+                if self.rpi_config.get('CLIENT', 'default') == 'async':
+                    from pyBehavior.interfaces.rpi.aio import QtAsyncClient as Client
+                else:
+                    from ratBerryPi.remote.client import Client
+                pool_size = self.rpi_config.get('POOL_SIZE', 4)
+
+                def connect():
+                    client = Client(self.rpi_config['HOST'],
+                                    self.rpi_config['PORT'])
+                    if self.rpi_config.get('CLIENT', 'default') != 'async' and pool_size > 0:
+                        from pyBehavior.interfaces.rpi.pool import PooledClient
+                        client = PooledClient(client, pool_size)
+                    return client
+
+                if self.rpi_config.get('RECONNECT', True):
+                    from pyBehavior.interfaces.rpi.supervisor import SupervisedClient
+                    self.client = SupervisedClient(connect, self.rpi_config.get('COMMAND_BUFFER', 64))
+                    self.client.disconnected.connect(self._rpi_disconnected)
+                    self.client.reconnected.connect(self._rpi_reconnected)
+                else:
+                    self.client = connect()
+                if self.rpi_config.get('CACHE', True):
+                    from pyBehavior.interfaces.rpi.cache import CachedClient, CacheRefresher
+                    self.client = CachedClient(self.client)
+                    self._cache_refresher = CacheRefresher(self.client, self.rpi_config.get('CACHE_REFRESH', 2.))
+                    self._cache_refresher.start()
                 self.client.new_channel("run")
+                from pyBehavior.interfaces.rpi.poller import StatePoller
+                self.rpi_poller = StatePoller.for_client(self.client)
+                from pyBehavior.interfaces.rpi.dispatch import RewardDispatcher, CommandDispatcher
+                self.rpi_dispatcher = RewardDispatcher.for_client(self.client)
+                self.rpi_commands = CommandDispatcher.for_client(self.client)
+                self.rpi_clock = None
+                if self.rpi_config.get('CLOCK_SYNC', 2.) > 0:
+                    from pyBehavior.interfaces.rpi.clock import ClockSync
+                    self.rpi_clock = ClockSync(self.client, self.rpi_config.get('CLOCK_SYNC', 2.))
+                    self.rpi_clock.start()
                 self._has_remote_rpi = True
 
         # ── Top control bar ────────────────────────────────────────────
@@ -204,21 +385,38 @@ class SetupGUI(QMainWindow):
 
         # initialize the state machine as none until a protocol is selected
         self._state_machine = None
+        self._rpi_streamer = None
+        self._rpi_transfers = []
+        self._ssh_pool = None
 
         # placeholder for the collection of reward modules
         self.reward_modules = ModuleDict()
+        # pump config widgets register themselves here by pump name
+        self.pump_configs = {}
+        self._rig_progress = None
+        pump_menu = self.menuBar().addMenu("Pumps")
+        for label, operation in [("Calibrate all pumps", 'calibrate'),
+                                 ("Fill all lines", 'fill_lines'),
+                                 ("Empty all lines", 'empty_lines'),
+                                 ("Fill all syringes", 'fill_syringe'),
+                                 ("Push all pumps to reservoir", 'push_to_res')]:
+            pump_menu.addAction(label, lambda operation = operation: self.run_pump_operation(operation))
+
+        # schedule syringe refills during the safe windows of the protocol
+        from pyBehavior.interfaces.rpi.refill import RefillScheduler
+        rpi_config = getattr(self, 'rpi_config', {})
+        self.refill_scheduler = RefillScheduler(self, rpi_config.get('REFILL_HORIZON', 60.))
+        self.state_entered.connect(lambda state: self.refill_scheduler.check())
 
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.DEBUG)
-
-        self._log_fh = None
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.DEBUG)
-        self._formatter = logging.Formatter(
-            '%(asctime)s.%(msecs)03d, %(levelname)s, %(message)s', "%Y-%m-%d %H:%M:%S"
-        )
-        ch.setFormatter(self._formatter)
-        self.logger.addHandler(ch)
+        if self._has_local_rpi:
+            from pyBehavior.interfaces.rpi.executor import CommandExecutor
+            self.rpi_executor = CommandExecutor.for_interface(self.interface)
+            self.rpi_executor.finished.connect(
+                lambda lane, name, wait, dur: self.logger.debug(f"rpi {name} on {lane} took {dur * 1e3:.1f} ms "
+                                                                f"(queued {wait * 1e3:.1f} ms)"))
+            self.rpi_executor.failed.connect(
+                lambda lane, name, err, dur: self.logger.error(f"rpi {name} on {lane} failed after "
+                                                               f"{dur * 1e3:.1f} ms: {err}"))
 
         self._eventstring_handlers = {}
 
@@ -300,7 +498,7 @@ class SetupGUI(QMainWindow):
         self._log_fh = logging.FileHandler(self._filename)
         self._log_fh.setLevel(logging.DEBUG)
         self._log_fh.setFormatter(self._formatter)
-        self.logger.addHandler(self._log_fh)
+        self._log_root.addHandler(self._log_fh)
 
         # create the state machine
         prot = ".".join([self.loc.name, "protocols", self.prot_name])
@@ -311,6 +509,7 @@ class SetupGUI(QMainWindow):
         self._state_machine = state_machine(self)
         if self._has_remote_rpi: 
             self.client.run_command('record', channel = 'run')
+            self._start_rpi_streaming()
         elif self._has_local_rpi:
             self.interface.record(data_dir=dir_name)
 
@@ -335,16 +534,23 @@ class SetupGUI(QMainWindow):
         self._running = False
         if self._has_remote_rpi: 
             rpi_data_path = self.client.get('data_path')
-            ssh_client = paramiko.SSHClient()
-            ssh_client.load_system_host_keys()
-            ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh_client.connect(self.client.host, username = self.rpi_config['USER'], look_for_keys = True)
-            scp_client = SCPClient(ssh_client.get_transport())
-            scp_client.get(rpi_data_path, self._filename.parent.as_posix())
-            self.logger.info(f"rpi logs saved at: {self.client.get('data_path')}")
             self.client.run_command('stop_recording', channel = 'run')
+            if hasattr(self.client, 'utilization'):
+                self.logger.info(f"rpi channel pool utilization: {self.client.utilization()}")
+            clock_model = None
+            if self.rpi_clock is not None and self.rpi_clock.model.n_samples > 0:
+                clock_model = self.rpi_clock.model
+                self.logger.info(f"rpi clock offset {clock_model.offset * 1e3:.3f} ± "
+                                 f"{clock_model.uncertainty * 1e3:.3f} ms, drift {clock_model.drift * 1e6:.2f} ppm "
+                                 f"from {clock_model.n_samples} probes")
+                self.rpi_clock.save(self._filename.parent)
+            self._start_rpi_transfer(rpi_data_path, clock_model)
+        for name, mod in self.reward_modules.items():
+            if hasattr(mod, 'reward_latency'):
+                lat = ", ".join(f"{kind} n={n} median={med:.2f} ms" for kind, (n, med) in mod.reward_latency().items())
+                self.logger.info(f"reward latency on {name}: {lat}")
         # remove file handler
-        self.logger.removeHandler(self._log_fh)
+        self._log_root.removeHandler(self._log_fh)
         
         # update gui elements
         self._start_btn.setEnabled(True)
@@ -356,6 +562,158 @@ class SetupGUI(QMainWindow):
         self._pause_btn.setEnabled(False)
         self._status_bar.showMessage(f"Stopped — {datetime.strftime(datetime.now(), '%H:%M:%S')}")
 
+    def _connect_ssh(self) -> paramiko.SSHClient:
+        """
+        get an ssh connection to the remote ratBerryPi. the connection
+        is opened the first time it is needed and reused afterwards
+        """
+
+        if self._ssh_pool is None:
+            from pyBehavior.interfaces.rpi.ssh import SSHSessionPool
+            self._ssh_pool = SSHSessionPool(compress = self.rpi_config.get('SSH_COMPRESS', True))
+        return self._ssh_pool.get(self.client.host, self.rpi_config['USER'])
+
+    def rpi_exec(self, command:str, timeout:float = None) -> typing.Tuple[int, str, str]:
+        """
+        run a shell command on the remote ratBerryPi over the
+        gui's persistent ssh connection (e.g. for maintenance)
+
+        Args:
+            command: str
+                command to run
+            timeout: float (optional)
+                timeout in seconds
+
+        Returns:
+            status: int
+                exit status of the command
+            stdout: str
+                standard output of the command
+            stderr: str
+                standard error of the command
+        """
+
+        assert self._has_remote_rpi, "rpi_exec requires a remote ratBerryPi"
+        self._connect_ssh()
+        return self._ssh_pool.exec_command(self.client.host, self.rpi_config['USER'], command, timeout)
+
+    def _rpi_disconnected(self, err:str) -> None:
+        self.log(f"lost connection to rpi: {err}", raise_event_line = False)
+        self.statusBar().showMessage("lost connection to rpi, reconnecting...")
+
+    def _rpi_reconnected(self, outage:float, n_replayed:int) -> None:
+        self.log(f"reconnected to rpi after {outage:.2f} s outage, replayed {n_replayed} buffered commands",
+                 raise_event_line = False)
+        self.statusBar().showMessage(f"reconnected to rpi after {outage:.2f} s", 5000)
+        self.rpi_poller.resync()
+
+    def _start_rpi_streaming(self) -> None:
+        """
+        start mirroring the data recorded on the remote ratBerryPi into
+        the session directory every STREAM_INTERVAL seconds (5 by default).
+        if streaming is disabled or cannot be started the data is instead
+        copied when the protocol is stopped
+        """
+
+        self._rpi_streamer = None
+        interval = self.rpi_config.get('STREAM_INTERVAL', 5.)
+        if interval <= 0:
+            return
+        from pyBehavior.interfaces.rpi.transfer import SFTPSource, SessionDataStreamer
+        try:
+            ssh_client = self._connect_ssh()
+            source = SFTPSource(ssh_client.open_sftp(), self.client.get('data_path'), ssh_client)
+        except (paramiko.SSHException, OSError) as e:
+            self.logger.warning(f"could not stream rpi data, it will be copied at stop: {e}")
+            return
+        self._rpi_streamer = SessionDataStreamer(source, self._filename.parent, interval)
+        self._rpi_streamer.failed.connect(lambda e: self.logger.warning(f"rpi data streaming error: {e}"))
+        self._rpi_streamer.start()
+
+    def _start_rpi_transfer(self, rpi_data_path:str, clock_model = None) -> None:
+        """
+        hand off copying the data recorded on the remote ratBerryPi
+        to a background thread. if the data was streamed during the
+        session only the tail of each file remains to be copied.
+        progress is reported in the status bar and a new session may
+        be started while the transfer runs
+
+        Args:
+            rpi_data_path: str
+                path to the recorded data on the pi
+            clock_model: pyBehavior.interfaces.rpi.clock.ClockModel (optional)
+                model of the pi clock over the session. if given, a host_time
+                column is added to the copied csv files once the transfer succeeds
+        """
+
+        from pyBehavior.interfaces.rpi.transfer import SFTPSource, SessionTransfer
+        if self._rpi_streamer is not None:
+            self._rpi_streamer.stop(final_sync = False)
+            self.logger.info(f"streamed {self._rpi_streamer.bytes_transferred} bytes of rpi data")
+            source = self._rpi_streamer.source
+            self._rpi_streamer = None
+        else:
+            try:
+                ssh_client = self._connect_ssh()
+                source = SFTPSource(ssh_client.open_sftp(), rpi_data_path, ssh_client)
+            except (paramiko.SSHException, OSError) as e:
+                self.logger.error(f"could not copy rpi data from {rpi_data_path}: {e}")
+                return
+
+        dest = self._filename.parent
+        transfer = SessionTransfer(source, dest, on_finish = source.sftp.close)
+        transfer.progress.connect(self._rpi_transfer_progress)
+        transfer.completed.connect(lambda status, msg: self._rpi_transfer_completed(transfer, dest, status, msg,
+                                                                                    clock_model))
+        self._rpi_transfers.append(transfer)
+        transfer.start()
+
+    def _rpi_transfer_progress(self, done:int, total:int, rel:str) -> None:
+        if not self._running:
+            self._status_bar.showMessage(f"Copying rpi data: {done/1e6:.1f}/{total/1e6:.1f} MB ({rel})")
+
+    def _rpi_transfer_completed(self, transfer, dest:Path, status:str, msg:str, clock_model = None) -> None:
+        if status == 'success':
+            self.logger.info(f"rpi logs saved at: {dest} ({msg})")
+            if clock_model is not None:
+                self._convert_rpi_times(dest, list(transfer.checksums), clock_model)
+        else:
+            self.logger.error(f"failed to copy rpi logs to {dest}: {msg}")
+        if not self._running:
+            self._status_bar.showMessage(f"rpi data copy {status} — {datetime.strftime(datetime.now(), '%H:%M:%S')}")
+        self._rpi_transfers.remove(transfer)
+
+    def _convert_rpi_times(self, dest:Path, files:typing.List[str], clock_model) -> None:
+        """
+        add a host_time column to each csv file copied from the pi which
+        has a column of times on the pi clock (named by TIME_COLUMN in the
+        rpi config, 'time' by default). files without it are left as is
+
+        Args:
+            dest: Path
+                directory the files were copied to
+            files: typing.List[str]
+                paths of the copied files relative to dest
+            clock_model: pyBehavior.interfaces.rpi.clock.ClockModel
+                model of the pi clock over the session
+        """
+
+        from pyBehavior.interfaces.rpi.clock import convert_csv
+        column = self.rpi_config.get('TIME_COLUMN', 'time')
+        converted = 0
+        for rel in files:
+            if not rel.endswith('.csv'):
+                continue
+            try:
+                convert_csv(dest/rel, clock_model, column = column)
+                converted += 1
+            except KeyError:
+                pass
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"could not convert pi times in {rel}: {e}")
+        if converted:
+            self.logger.info(f"added host_time to {converted} rpi csv files")
+
     def _pause_protocol(self) -> None:
         """
         pause the protocol
@@ -390,6 +748,7 @@ class SetupGUI(QMainWindow):
             self._state_machine.handle_input(formatter(data))
             if self._state_machine.current_state.id != curr_state:
                 self.log(f"STATE MACHINE ENTERED STATE: {self._state_machine.current_state.id}", event_line)
+                self.state_entered.emit(self._state_machine.current_state.id)
 
     def register_reward_module(self, name: str, mod: RewardWidget):
         """
@@ -418,6 +777,92 @@ class SetupGUI(QMainWindow):
         self.log(f"triggering {amount:.5f} mL reward on module {module}", event_line=event_line)
         self.reward_modules[module].trigger_reward(amount, **kwargs)
 
+    def run_pump_operation(self, operation:str, pumps:typing.List[str] = None, **kwargs):
+        """
+        run an operation on every pump at once through their PumpConfig widgets
+        and show the progress of each pump in one window. pumps listed together
+        in the MANIFOLDS field of rpi_config (a list of lists of pump names)
+        share a manifold and are run one after another, all other pumps run
+        in parallel
+
+        Args:
+            operation: str
+                name of the PumpConfig method to run ('calibrate', 'fill_lines',
+                'empty_lines', 'fill_syringe' or 'push_to_res')
+            pumps: typing.List[str] (optional)
+                pumps to run the operation on. defaults to every pump with a PumpConfig
+            **kwargs:
+                passed to the PumpConfig method
+
+        Returns:
+            rig: pyBehavior.interfaces.rpi.jobs.RigJob
+                the running operation or None if nothing was started
+        """
+
+        from pyBehavior.interfaces.rpi.jobs import RigJob, RigProgress
+        pumps = list(pumps) if pumps is not None else list(self.pump_configs)
+        if operation == 'fill_syringe':
+            unsupported = [p for p in pumps if not getattr(self.pump_configs[p], 'can_fill_syringe', True)]
+            if unsupported:
+                self.log(f"skipping {', '.join(unsupported)}, fill_syringe is not supported", raise_event_line = False)
+            pumps = [p for p in pumps if p not in unsupported]
+        if not pumps:
+            self.log("no pump configs to run on", raise_event_line = False)
+            return None
+        if self._rig_progress is not None and self._rig_progress.busy:
+            self.log(f"cannot run {operation} while {self._rig_progress.rig.name} is running on the pumps",
+                     raise_event_line = False)
+            return None
+        if operation == 'empty_lines':
+            # the pi empties the lines of every pump at once
+            pumps = pumps[:1]
+
+        starts = {}
+        for pump in pumps:
+            config = self.pump_configs[pump]
+            pump_kwargs = dict(kwargs)
+            if operation == 'fill_lines' and 'modules' not in kwargs and config.modules is None:
+                # only fill the lines of this pump, not every line on the pi
+                modules = [w.module for w in self.reward_modules.values() if getattr(w, 'pump', None) == pump]
+                if modules or len(pumps) > 1:
+                    pump_kwargs['modules'] = modules
+            starts[pump] = lambda config = config, pump_kwargs = pump_kwargs: getattr(config, operation)(**pump_kwargs)
+
+        rig = RigJob(operation, starts, getattr(self, 'rpi_config', {}).get('MANIFOLDS', []))
+        rig.completed.connect(lambda name, statuses: self.log(f"{name} on all pumps finished: {statuses}",
+                                                              raise_event_line = False))
+        if self._rig_progress is None:
+            self._rig_progress = RigProgress()
+        self._rig_progress.track(rig)
+        return rig
+
+    def arm_reward(self, module:str, amount:float, **kwargs):
+        """
+        prepare a reward on a specified module so that a following call to
+        trigger_reward with the same arguments is delivered with less delay.
+        protocols should call this as soon as the reward becomes possible
+        (e.g. on entering the state in which it can be earned)
+
+        Args:
+            module: str
+                module to deliver the reward to
+            amount: float
+                amount of reward in mL
+        """
+
+        self.reward_modules[module].arm_reward(amount, **kwargs)
+
+    def disarm_reward(self, module:str):
+        """
+        drop a reward prepared with arm_reward on a specified module
+
+        Args:
+            module: str
+                module the reward was armed on
+        """
+
+        self.reward_modules[module].disarm_reward()
+
     def log(self, event:str, event_line:str = None, raise_event_line:bool = True):
         """
         log events. optionally simmultaneously
@@ -518,7 +963,23 @@ class SetupGUI(QMainWindow):
                 self._di_daemon.stop()
                 self._di_daemon_thread.quit()
         if self._has_local_rpi:
+            self.rpi_executor.stop()
             self.interface.stop()
+        for transfer in self._rpi_transfers:
+            self.logger.info("waiting for rpi data transfer to finish")
+            transfer.wait()
+        if self._ssh_pool is not None:
+            self._ssh_pool.close()
+        if self._has_remote_rpi:
+            self.rpi_dispatcher.stop()
+            self.rpi_commands.stop()
+            self.rpi_poller.stop()
+            if self.rpi_clock is not None:
+                self.rpi_clock.stop()
+        if hasattr(self, '_cache_refresher'):
+            self._cache_refresher.stop()
+        if self._has_remote_rpi and hasattr(self.client, 'close'):
+            self.client.close()
         event.accept()
 
     
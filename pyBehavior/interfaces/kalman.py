@@ -0,0 +1,187 @@
+"""
+constant velocity kalman filtering of tracked positions
+"""
+
+import threading
+import typing
+import numpy as np
+
+
+class ConstantVelocityKalman:
+    """
+    kalman filter estimating the position and velocity of a batch of
+    independently tracked points (e.g. the keypoints of one or more animals)
+    under a constant velocity model with white noise acceleration. the x and
+    y axes of every point are filtered at once with vectorized closed form
+    2x2 updates. the measurement noise of each point is scaled by the inverse
+    of its confidence, so low confidence detections barely move the estimate
+    and points with zero confidence are only predicted
+
+    the innovation (measurement minus prediction) and its variance at every
+    update are kept for the last n_innovations updates for quality control;
+    when the filter is well tuned the normalized innovation squared (see nis)
+    averages 2
+
+    Args:
+        process_noise: float (optional)
+            spectral density of the random acceleration in units^2/s^3.
+            larger values follow quick changes in velocity more closely
+        measurement_noise: float (optional)
+            variance of a measurement with confidence 1 in units^2
+        init_velocity_var: float (optional)
+            variance of the velocity of a point when it is first seen in units^2/s^2
+        gate: float (optional)
+            measurements whose normalized innovation squared exceeds this are
+            treated as outliers and ignored. by default nothing is gated
+        n_innovations: int (optional)
+            number of updates to keep innovations for
+    """
+
+    def __init__(self, process_noise:float = 1e4, measurement_noise:float = 4.,
+                 init_velocity_var:float = 1e4, gate:float = None, n_innovations:int = 1000):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.init_velocity_var = init_velocity_var
+        self.gate = gate
+        self.n_innovations = n_innovations
+        self._lock = threading.Lock()
+        self.reset(())
+
+    @property
+    def shape(self) -> tuple:
+        """
+        shape of the batch of points being tracked
+        """
+        return self.pos.shape[:-1]
+
+    def reset(self, shape:tuple) -> None:
+        """
+        forget all estimates and start tracking a batch of points of a given shape
+        """
+
+        shape = tuple(shape)
+        self.pos = np.full(shape + (2,), np.nan)
+        self.vel = np.zeros(shape + (2,))
+        # covariance of position and velocity, shared by both axes
+        self._p00 = np.full(shape, np.inf)
+        self._p01 = np.zeros(shape)
+        self._p11 = np.full(shape, self.init_velocity_var)
+        self._t = None
+        with self._lock:
+            self._innov = np.full((self.n_innovations,) + shape + (2,), np.nan)
+            self._innov_var = np.full((self.n_innovations,) + shape, np.nan)
+            self._innov_t = np.full(self.n_innovations, np.nan)
+            self._innov_idx = 0
+            self._innov_count = 0
+
+    def predict(self, t:float) -> None:
+        """
+        advance the estimates to time t in seconds
+        """
+
+        if self._t is None:
+            self._t = t
+            return
+        dt = t - self._t
+        if dt <= 0:
+            return
+        self._t = t
+        q = self.process_noise
+        seen = np.isfinite(self._p00)
+        self.pos += self.vel * dt
+        self._p00 += np.where(seen, dt * (2 * self._p01 + dt * self._p11) + q * dt ** 3 / 3, 0)
+        self._p01 += np.where(seen, dt * self._p11 + q * dt ** 2 / 2, 0)
+        self._p11 += q * dt
+
+    def update(self, t:float, xy:np.ndarray, conf:np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        predict to time t and correct the estimates with new measurements
+
+        Args:
+            t: float
+                time of the measurements in seconds
+            xy: np.ndarray
+                (..., 2) array of measured coordinates. the leading
+                dimensions are the shape of the batch of points
+            conf: np.ndarray
+                (...) array of confidences of the measurements
+
+        Returns:
+            pos: np.ndarray
+                (..., 2) estimated positions
+            vel: np.ndarray
+                (..., 2) estimated velocities in units/s
+        """
+
+        xy = np.asarray(xy, dtype = float)
+        conf = np.asarray(conf, dtype = float)
+        if xy.shape[:-1] != self.shape:
+            self.reset(xy.shape[:-1])
+        self.predict(t)
+
+        valid = (conf > 0) & np.isfinite(xy).all(axis = -1)
+        r = self.measurement_noise / np.where(valid, conf, 1.)
+        new = valid & ~np.isfinite(self._p00)
+        # points seen for the first time start at their measurement
+        self.pos[new] = xy[new]
+        self.vel[new] = 0
+        self._p00[new] = r[new]
+        self._p01[new] = 0
+        self._p11[new] = self.init_velocity_var
+
+        track = valid & ~new
+        innov = np.where(track[..., None], xy - self.pos, np.nan)
+        s = np.where(track, self._p00 + r, np.nan)
+        if self.gate is not None:
+            with np.errstate(invalid = 'ignore'):
+                track &= ~((innov ** 2).sum(axis = -1) / s > self.gate)
+        k0 = np.where(track, self._p00 / s, 0)
+        k1 = np.where(track, self._p01 / s, 0)
+        gain_innov = np.where(track[..., None], innov, 0)
+        self.pos += k0[..., None] * gain_innov
+        self.vel += k1[..., None] * gain_innov
+        p01 = self._p01.copy()
+        self._p11 -= k1 * p01
+        self._p01 -= k0 * p01
+        self._p00 *= 1 - k0
+
+        with self._lock:
+            i = self._innov_idx
+            self._innov[i] = innov
+            self._innov_var[i] = s
+            self._innov_t[i] = t
+            self._innov_idx = (i + 1) % self.n_innovations
+            self._innov_count += 1
+        return self.pos, self.vel
+
+    def innovations(self) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        innovations recorded over the last n_innovations updates in
+        chronological order. entries for points which were not
+        updated (e.g. zero confidence) are nan
+
+        Returns:
+            t: np.ndarray
+                time of each update
+            innov: np.ndarray
+                (n, ..., 2) innovation of each point at each update
+            var: np.ndarray
+                (n, ...) variance of the innovation on each axis
+        """
+
+        with self._lock:
+            n = min(self._innov_count, self.n_innovations)
+            order = (np.arange(n) + self._innov_idx - n) % self.n_innovations
+            return self._innov_t[order], self._innov[order], self._innov_var[order]
+
+    def nis(self) -> float:
+        """
+        mean normalized innovation squared over the recorded updates.
+        values well above 2 suggest the noise parameters are too small
+        and values well below 2 that they are too large
+        """
+
+        _, innov, var = self.innovations()
+        with np.errstate(invalid = 'ignore'):
+            nis = (innov ** 2).sum(axis = -1) / var
+        return float(np.nanmean(nis)) if np.isfinite(nis).any() else float('nan')
@@ -0,0 +1,324 @@
+"""
+asyncio based client for communicating with a remote ratBerryPi server
+
+unlike ratBerryPi.remote.client.Client, which allows a single request in
+flight per channel, requests made through these clients are pipelined over
+one connection and matched to their replies by id.
+"""
+
+from PyQt5.QtCore import QObject, pyqtSignal
+import asyncio
+import concurrent.futures
+import itertools
+import socket
+import threading
+import traceback
+import typing
+from pyBehavior.interfaces.rpi import wire
+
+
+class AsyncClient:
+    """
+    asyncio client which pipelines requests to a ratBerryPi server
+    over a single connection. all coroutines must be awaited on the
+    event loop the client was connected on
+    """
+
+    def __init__(self, host:str, port:int):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._write_lock = None
+        self._ids = itertools.count()
+        self._pending = {}
+        # whether the server echoes request ids, known once it has replied
+        self._echoes_ids = False
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    @property
+    def in_flight(self) -> int:
+        """
+        number of requests awaiting a reply
+        """
+        return len(self._pending)
+
+    async def connect(self) -> None:
+        """
+        open the connection to the server
+        """
+
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        sock = self._writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._write_lock = asyncio.Lock()
+        self._reader_task = asyncio.ensure_future(self._read_replies())
+
+    async def request(self, command:str, args:dict = None) -> str:
+        """
+        send a request and wait for the reply text
+
+        Args:
+            command: str
+                name of the command to run
+            args: dict (optional)
+                arguments to the command
+        """
+
+        return await self._request(lambda req_id: wire.encode_request(command, args, req_id))
+
+    async def request_prepared(self, prepared:bytes) -> str:
+        """
+        send a request serialized ahead of time with wire.prepare_request
+        and wait for the reply text
+        """
+        return await self._request(lambda req_id: wire.finish_request(prepared, req_id))
+
+    async def _request(self, encode:typing.Callable) -> str:
+        if not self.connected:
+            raise ConnectionError("client is not connected")
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        sent = False
+        try:
+            async with self._write_lock:
+                self._writer.write(encode(req_id))
+                sent = True
+                await self._writer.drain()
+            return await fut
+        except asyncio.CancelledError:
+            # a request that was never sent or whose reply carries its id can
+            # be forgotten. otherwise replies are matched in order, so the
+            # cancelled future stays pending to swallow the late reply
+            # instead of it being taken as the reply to the next request
+            if not sent or self._echoes_ids:
+                self._pending.pop(req_id, None)
+            raise
+
+    async def run_command(self, command:str, args:dict = None) -> str:
+        return await self.request(command, args)
+
+    async def get(self, req:str):
+        """
+        read an attribute of the reward interface on the server
+        """
+        return wire.parse_value(await self.request('GET', {'req': req}))
+
+    async def get_many(self, reqs:typing.List[str]) -> list:
+        """
+        read several attributes. one request is sent per attribute, but
+        they are pipelined so the reads take about one round trip in total
+        """
+        return await asyncio.gather(*[self.get(req) for req in reqs])
+
+    async def _read_replies(self) -> None:
+        err = ConnectionError("connection closed by server")
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                req_id, reply = wire.decode_reply(line)
+                if req_id is not None:
+                    self._echoes_ids = True
+                else:
+                    # server does not echo ids so replies arrive in order
+                    if not self._pending:
+                        continue
+                    req_id = next(iter(self._pending))
+                fut = self._pending.pop(req_id, None)
+                if fut is not None and not fut.done():
+                    fut.set_result(reply)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            err = ConnectionError(str(e))
+        finally:
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(err)
+            self._pending.clear()
+            if self._writer is not None:
+                self._writer.close()
+
+    async def close(self) -> None:
+        """
+        close the connection to the server
+        """
+
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions = True)
+
+
+class QtAsyncClient(QObject):
+    """
+    wrapper around AsyncClient which runs the asyncio event loop
+    in a background thread so it can be used alongside the Qt event loop.
+
+    requests may be submitted without blocking using submit and submit_get.
+    when a callback is provided it is called on the Qt thread once the reply
+    arrives. the blocking methods get, run_command and new_channel mirror
+    ratBerryPi.remote.client.Client so this class can be used as a drop-in
+    replacement for it.
+
+    requests without a channel share one pipelined connection. like
+    ratBerryPi channels, every channel opened with new_channel gets a
+    connection of its own so a long command on one channel (e.g. a pump
+    job) never holds up requests on the others. blocking calls give up
+    after timeout seconds, except for pump jobs (see wire.JOB_COMMANDS)
+    which are waited on for as long as they take.
+
+    ...
+    PyQt Signals
+
+    replied(object, object)
+    """
+
+    replied = pyqtSignal(object, object)
+
+    def __init__(self, host:str, port:int, timeout:float = 5.):
+        super(QtAsyncClient, self).__init__()
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target = self._loop.run_forever, daemon = True)
+        self._thread.start()
+        self._client = AsyncClient(host, port)
+        self._channels = {}
+        self._lock = threading.Lock()
+        self.replied.connect(self._deliver)
+        self._run(self._client.connect()).result(self.timeout)
+
+    @property
+    def batched(self) -> bool:
+        # get_many pipelines the reads so they take about one round trip
+        return True
+
+    @property
+    def in_flight(self) -> int:
+        return self._client.in_flight + sum(c.in_flight for c in list(self._channels.values()))
+
+    def _channel(self, channel:str) -> AsyncClient:
+        return self._channels.get(channel, self._client)
+
+    def _run(self, coro) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _attach(self, fut:concurrent.futures.Future, callback:typing.Callable) -> concurrent.futures.Future:
+        if callback is not None:
+            fut.add_done_callback(lambda f: self.replied.emit(callback, f))
+        return fut
+
+    def _deliver(self, callback:typing.Callable, fut:concurrent.futures.Future) -> None:
+        try:
+            callback(fut.result())
+        except Exception:
+            traceback.print_exc()
+
+    def submit(self, command:str, args:dict = None, callback:typing.Callable = None,
+               channel:str = None) -> concurrent.futures.Future:
+        """
+        send a command without waiting for the reply
+
+        Args:
+            command: str
+                name of the command to run
+            args: dict (optional)
+                arguments to the command
+            callback: typing.Callable (optional)
+                function to call on the Qt thread with the reply
+            channel: str (optional)
+                channel to send the command on
+        """
+        return self._attach(self._run(self._channel(channel).request(command, args)), callback)
+
+    def submit_prepared(self, prepared:bytes, callback:typing.Callable = None) -> concurrent.futures.Future:
+        """
+        send a request serialized ahead of time with wire.prepare_request
+        without waiting for the reply
+
+        Args:
+            prepared: bytes
+                the serialized request
+            callback: typing.Callable (optional)
+                function to call on the Qt thread with the reply
+        """
+        return self._attach(self._run(self._client.request_prepared(prepared)), callback)
+
+    def submit_get(self, req:str, callback:typing.Callable = None, channel:str = None) -> concurrent.futures.Future:
+        """
+        read an attribute without waiting for the reply
+
+        Args:
+            req: str
+                attribute to read
+            callback: typing.Callable (optional)
+                function to call on the Qt thread with the value
+            channel: str (optional)
+                channel to send the request on
+        """
+        return self._attach(self._run(self._channel(channel).get(req)), callback)
+
+    def submit_get_many(self, reqs:typing.List[str], callback:typing.Callable = None,
+                        channel:str = None) -> concurrent.futures.Future:
+        """
+        read several attributes, pipelined so they take about one round
+        trip, without waiting for the reply
+        """
+        return self._attach(self._run(self._channel(channel).get_many(reqs)), callback)
+
+    def new_channel(self, name:str) -> None:
+        """
+        open a dedicated connection for a channel
+        """
+
+        with self._lock:
+            if name is None or name in self._channels:
+                return
+            client = AsyncClient(self.host, self.port)
+            self._run(client.connect()).result(self.timeout)
+            self._channels[name] = client
+
+    @staticmethod
+    def _wait(fut:concurrent.futures.Future, timeout:float = None):
+        try:
+            return fut.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # cancel the request so its late reply is not matched to another one
+            fut.cancel()
+            raise
+
+    def get(self, req:str, channel:str = None):
+        return self._wait(self.submit_get(req, channel = channel), self.timeout)
+
+    def get_many(self, reqs:typing.List[str], channel:str = None) -> list:
+        return self._wait(self.submit_get_many(reqs, channel = channel), self.timeout)
+
+    def run_command(self, command:str, args:dict = None, channel:str = None) -> str:
+        timeout = None if command in wire.JOB_COMMANDS else self.timeout
+        return self._wait(self.submit(command, args, channel = channel), timeout)
+
+    def close(self) -> None:
+        """
+        close the connection and stop the event loop
+        """
+
+        if self._loop.is_running():
+            for client in [self._client] + list(self._channels.values()):
+                try:
+                    self._run(client.close()).result(self.timeout)
+                except (concurrent.futures.TimeoutError, OSError):
+                    pass
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(self.timeout)
@@ -0,0 +1,306 @@
+"""
+client-side cache of ratBerryPi pump and module attributes
+"""
+
+from PyQt5.QtCore import QThread
+import logging
+import re
+import threading
+import time
+import typing
+from pyBehavior.interfaces.rpi import wire
+from pyBehavior.interfaces.rpi.supervisor import TIMEOUT_ERRORS
+
+
+logger = logging.getLogger(__name__)
+
+
+# time to live in seconds for attributes matching each pattern. the first
+# matching pattern is used. attributes that change on the pi without a
+# command from pyBehavior (licks, piston position) are kept short. positions
+# expire well within the 0.1 s interval PumpConfig polls them at, so every
+# poll reads the pi while other readers in between share the value
+DEFAULT_TTLS = [
+    (r".*\.lickometer\.licks$", 0.),
+    (r".*\.position$", 0.05),
+    (r"^data_path$", 0.),
+    (r".*\.(LED\.on|valve\.is_open)$", 5.),
+    (r"^auto_fill$", 5.),
+    (r".*\.(syringe\.syringeType|stepType|pump\.name)$", 60.),
+]
+
+_INVALID = object()
+
+
+def _module(a, attr): return f"modules['{a['module']}'].{attr}"
+def _pump(a, attr): return f"pumps['{a['pump']}'].{attr}"
+
+
+# known effects of each command on the cached attributes. attributes mapped to
+# _INVALID are dropped from the cache, all others are set to the given value
+COMMAND_EFFECTS = {
+    'toggle_LED': lambda a: {_module(a, 'LED.on'): a['on']},
+    'toggle_valve': lambda a: {_module(a, 'valve.is_open'): a['open_valve']},
+    'reset_licks': lambda a: {_module(a, 'lickometer.licks'): 0},
+    'update_post_delay': lambda a: {_module(a, 'post_delay'): a['post_delay']},
+    'play_tone': lambda a: {},
+    'preload_tone': lambda a: {},
+    'play_cue': lambda a: {},
+    'get_time': lambda a: {},
+    'trigger_reward': lambda a: {},
+    'arm_reward': lambda a: {},
+    'disarm_reward': lambda a: {},
+    'toggle_auto_fill': lambda a: {'auto_fill': a['on']},
+    'set_auto_fill_frac_thresh': lambda a: {'auto_fill_frac_thresh': a['value']},
+    'calibrate': lambda a: {_pump(a, 'position'): 0.},
+    'push_to_reservoir': lambda a: {_pump(a, 'position'): _INVALID},
+    'fill_syringe': lambda a: {_pump(a, 'position'): _INVALID},
+    'set_step_speed': lambda a: {_pump(a, 'speed'): a['speed'],
+                                 _pump(a, 'flow_rate'): _INVALID},
+    'set_flow_rate': lambda a: {_pump(a, 'flow_rate'): _INVALID,
+                                _pump(a, 'speed'): _INVALID},
+    'set_microstep_type': lambda a: {_pump(a, 'stepType'): a['stepType'],
+                                     _pump(a, 'flow_rate'): _INVALID,
+                                     _pump(a, 'speed'): _INVALID},
+    'change_syringe': lambda a: {_pump(a, 'syringe.syringeType'): a['syringeType'],
+                                 _pump(a, 'flow_rate'): _INVALID},
+}
+
+
+class CachedClient:
+    """
+    wrapper around a ratBerryPi client which caches the values of
+    attributes read with get. cached values expire after a time to live
+    that depends on the attribute. commands sent through run_command update
+    the cache with their known effects once they succeed (or are buffered
+    to be sent once the pi can be reached again) and invalidate
+    anything they may have changed otherwise, so reading state back after a
+    command does not cost another round trip. a read which was sent before
+    a command changed an attribute may return its old value after the
+    command, so values read before the last change made by a command are
+    never stored
+
+    Args:
+        client: ratBerryPi.remote.client.Client
+            client to wrap. if reading an attribute raises ConnectionError
+            the last cached value is returned when there is one
+        ttls: typing.List[typing.Tuple[str, float]] (optional)
+            list of (regex, time to live) pairs. the first pattern matching
+            an attribute determines its time to live in seconds
+        default_ttl: float (optional)
+            time to live for attributes not matching any pattern
+    """
+
+    def __init__(self, client, ttls:typing.List[typing.Tuple[str, float]] = None, default_ttl:float = 1.):
+        self.client = client
+        self.ttls = [(re.compile(p), t) for p, t in (ttls if ttls is not None else DEFAULT_TTLS)]
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._values = {}
+        # time of the last change made to each attribute by a command
+        self._changed = {}
+        self._cleared = float('-inf')
+        self._ttl_cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def ttl(self, req:str) -> float:
+        """
+        time to live of an attribute in seconds
+        """
+
+        if req not in self._ttl_cache:
+            self._ttl_cache[req] = next((t for p, t in self.ttls if p.match(req)), self.default_ttl)
+        return self._ttl_cache[req]
+
+    def peek(self, req:str, default = None):
+        """
+        return the cached value of an attribute regardless of its
+        age without making any requests
+        """
+
+        with self._lock:
+            entry = self._values.get(req)
+        return default if entry is None else entry[0]
+
+    def set(self, req:str, value) -> None:
+        """
+        store a value for an attribute
+        """
+
+        if isinstance(value, str):
+            value = wire.parse_value(value)
+        with self._lock:
+            self._values[req] = (value, time.monotonic())
+
+    def _store(self, req:str, value, t_sent:float):
+        # store a value read from the pi unless a command changed the
+        # attribute after the read was sent. returns the newest known value
+        if isinstance(value, str):
+            value = wire.parse_value(value)
+        with self._lock:
+            if t_sent >= max(self._changed.get(req, float('-inf')), self._cleared):
+                self._values[req] = (value, time.monotonic())
+            entry = self._values.get(req)
+        return value if entry is None else entry[0]
+
+    def _change(self, req:str, value = _INVALID) -> None:
+        # record a change made to an attribute by a command
+        with self._lock:
+            now = time.monotonic()
+            self._changed[req] = now
+            if value is _INVALID:
+                self._values.pop(req, None)
+            else:
+                self._values[req] = (value, now)
+
+    def invalidate(self, pattern:str = None) -> None:
+        """
+        drop cached values
+
+        Args:
+            pattern: str (optional)
+                regex for the attributes to drop. all attributes are
+                dropped if not provided
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            if pattern is None:
+                self._values.clear()
+                self._cleared = now
+            else:
+                p = re.compile(pattern)
+                for req in [r for r in self._values if p.match(r)]:
+                    del self._values[req]
+                    self._changed[req] = now
+
+    def get(self, req:str, channel:str = None, max_age:float = None):
+        """
+        read an attribute, serving it from the cache if the cached
+        value is younger than its time to live
+
+        Args:
+            req: str
+                attribute to read
+            channel: str (optional)
+                channel to read on if the value is not cached
+            max_age: float (optional)
+                override for the time to live of the attribute
+        """
+
+        max_age = max_age if max_age is not None else self.ttl(req)
+        with self._lock:
+            entry = self._values.get(req)
+        if max_age > 0:
+            if entry is not None and (time.monotonic() - entry[1]) < max_age:
+                self.hits += 1
+                return entry[0]
+        self.misses += 1
+        t = time.monotonic()
+        try:
+            value = self.client.get(req, channel = channel)
+        except (ConnectionError,) + TIMEOUT_ERRORS:
+            # serve the last known value while the pi is unreachable or slow
+            if entry is not None:
+                return entry[0]
+            raise
+        return self._store(req, value, t)
+
+    def get_many(self, reqs:typing.List[str], channel:str = None, max_age:float = None) -> list:
+        """
+        read several attributes. attributes that are not cached are read
+        in a single batch if the wrapped client supports it
+
+        Args:
+            reqs: typing.List[str]
+                attributes to read
+            channel: str (optional)
+                channel to read on for attributes that are not cached
+            max_age: float (optional)
+                override for the time to live of the attributes
+        """
+
+        now = time.monotonic()
+        values = {}
+        with self._lock:
+            for req in reqs:
+                age = max_age if max_age is not None else self.ttl(req)
+                entry = self._values.get(req)
+                if age > 0 and entry is not None and (now - entry[1]) < age:
+                    values[req] = entry[0]
+        self.hits += len(values)
+        missing = [r for r in reqs if r not in values]
+        if missing:
+            self.misses += len(missing)
+            t = time.monotonic()
+            if getattr(self.client, 'batched', False):
+                fetched = self.client.get_many(missing, channel = channel)
+            else:
+                fetched = [self.client.get(r, channel = channel) for r in missing]
+            for req, value in zip(missing, fetched):
+                values[req] = self._store(req, value, t)
+        return [values[r] for r in reqs]
+
+    def run_command(self, command:str, args:dict = None, channel:str = None) -> str:
+        args = args if args is not None else {}
+        effects = COMMAND_EFFECTS.get(command)
+        try:
+            status = self.client.run_command(command, args, channel = channel)
+        except BaseException:
+            self.invalidate()
+            raise
+        if effects is None:
+            self.invalidate()
+            return status
+        for req, value in effects(args).items():
+            if status not in (wire.SUCCESS, wire.BUFFERED):
+                value = _INVALID
+            self._change(req, value)
+        return status
+
+    def refresh(self, channel:str = None) -> None:
+        """
+        re-read every cached attribute whose time to live is non-zero
+        """
+
+        with self._lock:
+            reqs = [r for r in self._values if self.ttl(r) > 0]
+        if not reqs:
+            return
+        t = time.monotonic()
+        if getattr(self.client, 'batched', False):
+            values = self.client.get_many(reqs, channel = channel)
+        else:
+            values = [self.client.get(r, channel = channel) for r in reqs]
+        for req, value in zip(reqs, values):
+            self._store(req, value, t)
+
+
+class CacheRefresher(QThread):
+    """
+    thread which periodically refreshes every attribute
+    in a CachedClient on its own channel
+    """
+
+    def __init__(self, client:CachedClient, interval:float = 2., channel:str = 'cache_refresh'):
+        super(CacheRefresher, self).__init__()
+        self.client = client
+        self.interval = interval
+        self.channel = channel
+        self.client.new_channel(self.channel)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.client.refresh(channel = self.channel)
+            except (OSError, ValueError) as e:
+                logger.warning(f"failed to refresh rpi cache: {e}")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.wait()
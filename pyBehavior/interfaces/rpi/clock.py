@@ -0,0 +1,270 @@
+"""
+estimation of the offset and drift of the clock on a remote ratBerryPi
+relative to the clock on this machine
+"""
+
+from PyQt5.QtCore import QThread, pyqtSignal
+import csv
+import json
+import logging
+import threading
+import time
+import typing
+from pathlib import Path
+import numpy as np
+from pyBehavior.interfaces.rpi import wire
+
+
+logger = logging.getLogger(__name__)
+
+
+class ClockModel:
+    """
+    linear model relating the clock on the pi to the clock on this machine.
+    times are in seconds since the epoch on the respective clock:
+
+        pi_time = host_time + offset + drift * (host_time - t_ref)
+
+    Args:
+        offset: float (optional)
+            offset of the pi clock at t_ref in seconds
+        drift: float (optional)
+            rate at which the pi clock gains on this machine's clock in s/s
+        t_ref: float (optional)
+            time on this machine at which the offset was estimated
+        uncertainty: float (optional)
+            bound on the error of the offset in seconds (half of the
+            shortest round trip used to estimate it)
+        n_samples: int (optional)
+            number of probes the model was fit to
+    """
+
+    def __init__(self, offset:float = 0., drift:float = 0., t_ref:float = 0.,
+                 uncertainty:float = float('nan'), n_samples:int = 0):
+        self.offset = offset
+        self.drift = drift
+        self.t_ref = t_ref
+        self.uncertainty = uncertainty
+        self.n_samples = n_samples
+
+    @classmethod
+    def fit(cls, samples:typing.List[typing.Tuple[float, float, float]]) -> 'ClockModel':
+        """
+        fit the model to probes of the pi clock
+
+        Args:
+            samples: typing.List[typing.Tuple[float, float, float]]
+                (host time, offset, round trip delay) of each probe, where the
+                host time is the midpoint of the round trip
+        """
+
+        if not samples:
+            return cls()
+        t, offset, delay = np.array(samples).T
+        # probes delayed by queueing are asymmetric, so only the probes with
+        # round trips close to the shortest are used. at least the quickest
+        # few are kept so the drift can still be estimated when round trips
+        # are so short that few are within twice the shortest
+        keep = delay <= max(2 * delay.min(), np.sort(delay)[min(delay.size, 8) - 1])
+        t, offset = t[keep], offset[keep]
+        t_ref = float(t[-1])
+        if t.size > 1 and np.ptp(t) > 0:
+            drift, at_ref = np.polyfit(t - t_ref, offset, 1)
+        else:
+            drift, at_ref = 0., np.median(offset)
+        return cls(float(at_ref), float(drift), t_ref, float(delay.min() / 2), int(keep.sum()))
+
+    def to_host(self, t_pi):
+        """
+        convert times on the pi clock to times on this machine's clock.
+        accepts scalars or arrays
+        """
+        return (np.asarray(t_pi) - self.offset + self.drift * self.t_ref) / (1 + self.drift)
+
+    def to_pi(self, t_host):
+        """
+        convert times on this machine's clock to times on the pi clock.
+        accepts scalars or arrays
+        """
+        t_host = np.asarray(t_host)
+        return t_host + self.offset + self.drift * (t_host - self.t_ref)
+
+    def to_dict(self) -> dict:
+        return {'offset': self.offset,
+                'drift': self.drift,
+                't_ref': self.t_ref,
+                'uncertainty': self.uncertainty,
+                'n_samples': self.n_samples}
+
+    def save(self, path:str) -> None:
+        """
+        save the model as json
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent = 2)
+
+    @classmethod
+    def load(cls, path:str) -> 'ClockModel':
+        """
+        load a model saved with save
+        """
+        with open(path, 'r') as f:
+            return cls(**json.load(f))
+
+
+def convert_csv(path:str, model:ClockModel, column:str = 'time', out_column:str = 'host_time') -> None:
+    """
+    add a column to a csv file recorded on the pi with the
+    times in one of its columns converted to host time
+
+    Args:
+        path: str
+            csv file to convert
+        model: ClockModel
+            model of the pi clock
+        column: str (optional)
+            column holding times on the pi clock
+        out_column: str (optional)
+            column to write the converted times to
+    """
+
+    import pandas as pd
+    df = pd.read_csv(path)
+    df[out_column] = model.to_host(df[column].to_numpy(dtype = float))
+    df.to_csv(path, index = False)
+
+
+class ClockSync(QThread):
+    """
+    thread which estimates the offset and drift of the clock on a remote
+    ratBerryPi NTP style. every interval a short burst of get_time probes is
+    sent and the one with the shortest round trip is kept, assuming the
+    pi read its clock halfway through the round trip. a ClockModel is fit to
+    the probes from the last window seconds. if the pi rejects get_time
+    (e.g. an older ratBerryPi server) probing stops and supported is set to False
+
+    Args:
+        client:
+            client for communicating with the pi
+        interval: float (optional)
+            time between bursts of probes in seconds
+        burst: int (optional)
+            number of probes per burst
+        window: float (optional)
+            time span of the probes used to fit the model in seconds
+        channel: str (optional)
+            channel to send probes on
+
+    ...
+    PyQt Signals
+
+    updated(float, float, float)
+        offset of the pi clock now in seconds, drift in s/s and
+        the round trip delay of the latest probe in seconds
+    """
+
+    updated = pyqtSignal(float, float, float)
+
+    def __init__(self, client, interval:float = 2., burst:int = 4, window:float = 600.,
+                 channel:str = 'clock'):
+        super(ClockSync, self).__init__()
+        self.client = client
+        self.interval = interval
+        self.burst = burst
+        self.window = window
+        self.channel = channel
+        self.client.new_channel(self.channel)
+        self.samples = []
+        self._model = ClockModel()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._failing = False
+        self.supported = True
+
+    @property
+    def model(self) -> ClockModel:
+        """
+        the latest estimate of the pi clock
+        """
+        with self._lock:
+            return self._model
+
+    def probe(self) -> typing.Tuple[float, float, float]:
+        """
+        read the pi clock once
+
+        Returns:
+            t: float
+                midpoint of the round trip on this machine's clock
+            offset: float
+                offset of the pi clock in seconds
+            delay: float
+                round trip delay in seconds
+        """
+
+        t0 = time.time()
+        reply = self.client.run_command('get_time', channel = self.channel)
+        t1 = time.time()
+        if reply.startswith("ERROR"):
+            raise ValueError(reply.strip())
+        t_pi = float(wire.parse_value(reply))
+        return (t0 + t1) / 2, t_pi - (t0 + t1) / 2, t1 - t0
+
+    def run(self):
+        while not self._stop_event.is_set():
+            probes = []
+            for _ in range(self.burst):
+                try:
+                    probes.append(self.probe())
+                    self._failing = False
+                except (OSError, ValueError, TypeError) as e:
+                    # the pi rejected the command, as opposed to a reply made locally
+                    # saying it could not be sent or was not answered in time
+                    msg = f"{e}"
+                    if msg.startswith("ERROR") and 'not sent' not in msg and 'no reply' not in msg:
+                        logger.warning(f"rpi does not support get_time, clock sync disabled: {e}")
+                        self.supported = False
+                        return
+                    # only report the first of a run of failures
+                    if not self._failing:
+                        logger.warning(f"failed to probe rpi clock: {e}")
+                    self._failing = True
+                    break
+            if probes:
+                best = min(probes, key = lambda p: p[2])
+                with self._lock:
+                    # only the probes within the window are fit, so older ones are dropped
+                    self.samples = [s for s in self.samples if s[0] >= best[0] - self.window]
+                    self.samples.append(best)
+                    self._model = ClockModel.fit(self.samples)
+                model = self._model
+                self.updated.emit(float(model.to_pi(best[0]) - best[0]), model.drift, best[2])
+            self._stop_event.wait(self.interval)
+
+    def save(self, directory:str) -> None:
+        """
+        save the probes from the last window seconds to
+        rpi_clock.csv and the current model to rpi_clock.json
+        in a directory. nothing is saved if the pi clock was
+        never probed
+        """
+
+        directory = Path(directory)
+        with self._lock:
+            samples = list(self.samples)
+            model = self._model
+        if not samples:
+            return
+        with open(directory/"rpi_clock.csv", 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(['host_time', 'offset', 'delay'])
+            writer.writerows(samples)
+        model.save(directory/"rpi_clock.json")
+
+    def stop(self) -> None:
+        """
+        stop probing
+        """
+
+        self._stop_event.set()
+        self.wait()
@@ -0,0 +1,162 @@
+"""
+non-blocking commands and reward delivery on a remote ratBerryPi
+"""
+
+from PyQt5.QtCore import QThread, pyqtSignal
+import queue
+import time
+from pyBehavior.interfaces.rpi import wire
+
+
+class CommandDispatcher(QThread):
+    """
+    thread which sends commands to a remote ratBerryPi on a dedicated
+    channel so the caller does not wait for the round trip. commands are
+    sent in the order they were queued and each reply is reported through
+    a signal.
+
+    widgets should share one dispatcher per client through for_client
+
+    Args:
+        client:
+            client to send commands through
+        channel: str (optional)
+            channel to send commands on
+
+    ...
+    PyQt Signals
+
+    replied(str, object, str, float, float)
+        command, its arguments, the reply from the pi, the time the command
+        was queued and the time the reply arrived. times are seconds since
+        the epoch on this machine
+    """
+
+    replied = pyqtSignal(str, object, str, float, float)
+
+    _dispatchers = {}
+
+    def __init__(self, client, channel:str = 'commands'):
+        super(CommandDispatcher, self).__init__()
+        self.client = client
+        self.channel = channel
+        self.client.new_channel(self.channel)
+        self._queue = queue.Queue()
+        self._stopped = False
+
+    @classmethod
+    def for_client(cls, client) -> 'CommandDispatcher':
+        """
+        get the dispatcher shared by everything using a client, creating it if needed
+        """
+
+        key = id(client)
+        if key not in cls._dispatchers:
+            cls._dispatchers[key] = cls(client)
+        return cls._dispatchers[key]
+
+    @property
+    def pending(self) -> int:
+        """
+        number of commands waiting to be sent
+        """
+        return self._queue.qsize()
+
+    def send(self, command:str, args:dict = None) -> None:
+        """
+        queue a command to be sent to the pi and return immediately.
+        the dispatcher is started on the first call
+        """
+
+        if self._stopped:
+            raise RuntimeError("dispatcher has been stopped")
+        self._queue.put((command, args if args is not None else {}, time.time()))
+        if not self.isRunning():
+            self.start()
+
+    def _replied(self, command:str, args:dict, status:str, t_dispatch:float, t_reply:float) -> None:
+        self.replied.emit(command, args, status, t_dispatch, t_reply)
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            command, args, t_dispatch = item
+            try:
+                status = self.client.run_command(command, args, channel = self.channel)
+            except Exception as e:
+                status = f"ERROR: {e}"
+            self._replied(command, args, status, t_dispatch, time.time())
+
+    def stop(self) -> None:
+        """
+        send any commands that are still queued and stop the dispatcher
+        """
+
+        self._stopped = True
+        if self.isRunning():
+            self._queue.put(None)
+            self.wait()
+        for key, dispatcher in list(self._dispatchers.items()):
+            if dispatcher is self:
+                del self._dispatchers[key]
+
+
+class RewardDispatcher(CommandDispatcher):
+    """
+    dispatcher for sending rewards to a remote ratBerryPi without waiting
+    for the round trip. rewards are sent on their own channel so they are
+    not held up behind other commands
+
+    Args:
+        client:
+            client to send rewards through
+        channel: str (optional)
+            channel to send rewards on
+
+    ...
+    PyQt Signals
+
+    acked(str, float, float, float)
+        module, amount, time the reward was dispatched and time the pi
+        acknowledged it. times are seconds since the epoch on this machine
+    failed(str, float, str)
+        module, amount and the error reported for a reward which failed
+    """
+
+    acked = pyqtSignal(str, float, float, float)
+    failed = pyqtSignal(str, float, str)
+
+    _dispatchers = {}
+
+    def __init__(self, client, channel:str = 'rewards'):
+        super(RewardDispatcher, self).__init__(client, channel)
+
+    def dispatch(self, module:str, amount:float, force:bool = True, enqueue:bool = False) -> None:
+        """
+        queue a reward to be sent to the pi and return immediately.
+        the dispatcher is started on the first call
+
+        Args:
+            module: str
+                module to deliver the reward to
+            amount: float
+                amount of reward in mL
+            force: bool (optional)
+                see RPIRewardControl.trigger_reward
+            enqueue: bool (optional)
+                see RPIRewardControl.trigger_reward
+        """
+
+        self.send('trigger_reward', {'module': module,
+                                     'amount': amount,
+                                     'force': force,
+                                     'enqueue': enqueue})
+
+    def _replied(self, command:str, args:dict, status:str, t_dispatch:float, t_reply:float) -> None:
+        super(RewardDispatcher, self)._replied(command, args, status, t_dispatch, t_reply)
+        if status == wire.SUCCESS:
+            self.acked.emit(args['module'], args['amount'], t_dispatch, t_reply)
+        else:
+            self.failed.emit(args['module'], args['amount'], status.strip())
@@ -0,0 +1,183 @@
+"""
+background execution of calls to a local ratBerryPi interface
+"""
+
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+import queue
+import threading
+import time
+import typing
+
+
+class _Call:
+    """
+    a call queued on a CommandExecutor
+    """
+
+    __slots__ = ('lane', 'name', 'fn', 'kwargs', 'callback', 'on_error',
+                 't_submit', 'wait', 'duration', 'result', 'error', 'done')
+
+    def __init__(self, lane:str, name:str, fn:typing.Callable, kwargs:dict,
+                 callback:typing.Callable = None, on_error:typing.Callable = None):
+        self.lane = lane
+        self.name = name
+        self.fn = fn
+        self.kwargs = kwargs
+        self.callback = callback
+        self.on_error = on_error
+        self.t_submit = time.perf_counter()
+        self.wait = 0.
+        self.duration = 0.
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _Lane(QThread):
+    """
+    thread which runs the calls queued on one lane of a CommandExecutor in order
+    """
+
+    ran = pyqtSignal(object)
+
+    def __init__(self, name:str):
+        super(_Lane, self).__init__()
+        self.name = name
+        self.queue = queue.Queue()
+
+    def run(self):
+        while True:
+            call = self.queue.get()
+            if call is None:
+                return
+            t = time.perf_counter()
+            call.wait = t - call.t_submit
+            try:
+                call.result = call.fn(**call.kwargs)
+            except Exception as e:
+                call.error = e
+            call.duration = time.perf_counter() - t
+            call.done.set()
+            self.ran.emit(call)
+
+
+class CommandExecutor(QObject):
+    """
+    runs calls to a local ratBerryPi interface in background threads so the
+    GUI stays responsive while the pi is busy (e.g. while a stepper moves).
+    calls are queued on lanes, typically one per pump, and the calls on a
+    lane run one at a time in the order they were submitted while calls on
+    different lanes run concurrently. results are passed to a callback on
+    the GUI thread and the outcome and duration of every call is reported
+    through a signal
+
+    widgets should share one executor per interface through for_interface
+
+    ...
+    PyQt Signals
+
+    finished(str, str, float, float)
+        lane, name of the call, time spent waiting in the queue and
+        time taken by the call in seconds
+    failed(str, str, str, float)
+        lane, name of the call, the error raised and the
+        time taken by the call in seconds
+    """
+
+    finished = pyqtSignal(str, str, float, float)
+    failed = pyqtSignal(str, str, str, float)
+
+    _executors = {}
+
+    def __init__(self):
+        super(CommandExecutor, self).__init__()
+        self._lanes = {}
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    @classmethod
+    def for_interface(cls, interface) -> 'CommandExecutor':
+        """
+        get the executor shared by everything using an interface, creating it if needed
+        """
+
+        key = id(interface)
+        if key not in cls._executors:
+            cls._executors[key] = cls()
+        return cls._executors[key]
+
+    def _lane(self, name:str) -> _Lane:
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("executor has been stopped")
+            lane = self._lanes.get(name)
+            if lane is None:
+                lane = _Lane(name)
+                lane.ran.connect(self._ran)
+                lane.start()
+                self._lanes[name] = lane
+            return lane
+
+    def submit(self, lane:str, name:str, fn:typing.Callable, callback:typing.Callable = None,
+               on_error:typing.Callable = None, **kwargs) -> None:
+        """
+        queue a call and return immediately
+
+        Args:
+            lane: str
+                lane to run the call on (e.g. the name of the pump it uses)
+            name: str
+                name of the call used when reporting it
+            fn: typing.Callable
+                function to call
+            callback: typing.Callable (optional)
+                function called on the GUI thread with the result of the call
+            on_error: typing.Callable (optional)
+                function called on the GUI thread with the error if the call fails
+            **kwargs:
+                passed to fn
+        """
+        self._lane(lane).queue.put(_Call(lane, name, fn, kwargs, callback, on_error))
+
+    def run(self, lane:str, name:str, fn:typing.Callable, **kwargs):
+        """
+        run a call on a lane and wait for it to finish (e.g. from the thread
+        of a PumpJob so its steps stay in order with other calls on the pump).
+        this must not be called from the GUI thread or from a lane
+
+        Returns:
+            the result of the call. any error raised by the call is re-raised
+        """
+
+        call = _Call(lane, name, fn, kwargs)
+        self._lane(lane).queue.put(call)
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _ran(self, call:_Call) -> None:
+        if call.error is None:
+            self.finished.emit(call.lane, call.name, call.wait, call.duration)
+            if call.callback is not None:
+                call.callback(call.result)
+        else:
+            self.failed.emit(call.lane, call.name, f"{call.error}", call.duration)
+            if call.on_error is not None:
+                call.on_error(call.error)
+
+    def stop(self) -> None:
+        """
+        run any calls that are still queued and stop the executor
+        """
+
+        with self._lock:
+            self._stopped = True
+            lanes = list(self._lanes.values())
+        for lane in lanes:
+            lane.queue.put(None)
+        for lane in lanes:
+            lane.wait()
+        for key, executor in list(CommandExecutor._executors.items()):
+            if executor is self:
+                del CommandExecutor._executors[key]
@@ -0,0 +1,347 @@
+"""
+background jobs for long running ratBerryPi pump operations, on a single
+pump or across every pump on a rig
+"""
+
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+from PyQt5.QtWidgets import QWidget, QHBoxLayout, QVBoxLayout, QGridLayout, QProgressBar, QPushButton, QLabel
+import threading
+import typing
+
+
+class PumpJob(QThread):
+    """
+    thread which runs a long running pump operation as a sequence of steps.
+    progress is reported after each step and the job may be cancelled
+    between steps
+
+    Args:
+        name: str
+            name of the operation (e.g. 'fill lines')
+        steps: typing.List[typing.Tuple[str, typing.Callable]]
+            list of (description, function) pairs to run in order
+
+    ...
+    PyQt Signals
+
+    progress(int, int, str)
+        number of steps completed, total number of steps and a description
+        of the step that is currently running
+    completed(str, str, str)
+        name of the job, status ('success', 'cancelled' or 'failed') and a message
+    """
+
+    progress = pyqtSignal(int, int, str)
+    completed = pyqtSignal(str, str, str)
+
+    def __init__(self, name:str, steps:typing.List[typing.Tuple[str, typing.Callable]]):
+        super(PumpJob, self).__init__()
+        self.name = name
+        self.steps = steps
+        self.status = None
+        self.message = ""
+        self._cancel = threading.Event()
+
+    @property
+    def n_steps(self) -> int:
+        return len(self.steps)
+
+    def cancel(self) -> None:
+        """
+        request that the job stop before its next step. a step
+        that is already running on the pi is allowed to finish
+        """
+        self._cancel.set()
+
+    def when_completed(self, fn:typing.Callable) -> None:
+        """
+        call a function once with the name, status and message of the job when
+        it completes. unlike connecting to completed this also works if the
+        job has already completed (e.g. when it failed as soon as it started)
+        """
+
+        called = []
+        def once(name:str, status:str, msg:str):
+            if not called:
+                called.append(True)
+                fn(name, status, msg)
+        self.completed.connect(once)
+        # the status is set before completed is emitted
+        if self.status is not None:
+            once(self.name, self.status, self.message)
+
+    def _complete(self, status:str, msg:str) -> None:
+        self.message = msg
+        self.status = status
+        self.completed.emit(self.name, status, msg)
+
+    def run(self):
+        for i, (desc, fn) in enumerate(self.steps):
+            if self._cancel.is_set():
+                self._complete('cancelled', f"cancelled after {i}/{self.n_steps} steps")
+                return
+            self.progress.emit(i, self.n_steps, desc)
+            try:
+                fn()
+            except Exception as e:
+                self._complete('failed', f"{desc} failed: {e}")
+                return
+        self.progress.emit(self.n_steps, self.n_steps, "done")
+        self._complete('success', "")
+
+
+class JobProgress(QWidget):
+    """
+    widget showing the progress of a PumpJob with a button to cancel it.
+    the widget is hidden while no job is running and disables a set of
+    controls for the duration of each job it tracks
+
+    Args:
+        controls: typing.List[QWidget] (optional)
+            controls to disable while a job is running
+    """
+
+    def __init__(self, controls:typing.List[QWidget] = None):
+        super(JobProgress, self).__init__()
+        self.controls = controls if controls is not None else []
+        self.job = None
+
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.label = QLabel("")
+        self.bar = QProgressBar()
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.clicked.connect(self.cancel)
+        layout.addWidget(self.label)
+        layout.addWidget(self.bar)
+        layout.addWidget(self.cancel_btn)
+        self.setLayout(layout)
+        self.hide()
+
+    @property
+    def busy(self) -> bool:
+        return self.job is not None and self.job.isRunning()
+
+    def track(self, job:PumpJob) -> None:
+        """
+        start a job and display its progress
+        """
+
+        self.job = job
+        self.label.setText(job.name)
+        # show a busy indicator when there is no meaningful progress to report
+        self.bar.setRange(0, job.n_steps if job.n_steps > 1 else 0)
+        self.bar.setValue(0)
+        self.cancel_btn.setEnabled(job.n_steps > 1)
+        job.progress.connect(self._update)
+        job.completed.connect(self._done)
+        for c in self.controls:
+            c.setEnabled(False)
+        self.show()
+        job.start()
+
+    def cancel(self) -> None:
+        if self.busy:
+            self.job.cancel()
+            self.cancel_btn.setEnabled(False)
+
+    def _update(self, done:int, total:int, desc:str) -> None:
+        if total > 1:
+            self.bar.setValue(done)
+        self.label.setText(f"{self.job.name}: {desc}")
+
+    def _done(self, name:str, status:str, msg:str) -> None:
+        for c in self.controls:
+            c.setEnabled(True)
+        self.hide()
+
+
+class RigJob(QObject):
+    """
+    runs the same operation on several pumps at once through the PumpJob
+    of each pump. pumps which share a manifold are run one after another
+    while all other pumps run in parallel, so the operation takes about as
+    long as the slowest pump (or manifold)
+
+    Args:
+        name: str
+            name of the operation (e.g. 'fill_lines')
+        starts: typing.Dict[str, typing.Callable]
+            maps each pump to a function which starts the operation on that
+            pump and returns its PumpJob, or None if the pump is busy
+        groups: typing.List[typing.List[str]] (optional)
+            groups of pumps which share a manifold and must not run at once
+
+    ...
+    PyQt Signals
+
+    pump_started(str, object)
+        pump and the PumpJob started on it
+    pump_finished(str, str, str)
+        pump, status ('success', 'cancelled', 'failed' or 'busy') and a message
+    completed(str, object)
+        name of the operation and a dict mapping each pump to its status
+    """
+
+    pump_started = pyqtSignal(str, object)
+    pump_finished = pyqtSignal(str, str, str)
+    completed = pyqtSignal(str, object)
+
+    def __init__(self, name:str, starts:typing.Dict[str, typing.Callable],
+                 groups:typing.List[typing.List[str]] = None):
+        super(RigJob, self).__init__()
+        self.name = name
+        self.starts = starts
+        self.statuses = {}
+        self.jobs = {}
+        self._cancelled = False
+        self._reported = False
+        # pumps not on a listed manifold can run alongside everything else
+        groups = [[p for p in g if p in starts] for g in (groups if groups is not None else [])]
+        grouped = {p for g in groups for p in g}
+        self._queues = [g for g in groups if g] + [[p] for p in starts if p not in grouped]
+
+    @property
+    def pumps(self) -> typing.List[str]:
+        return list(self.starts)
+
+    @property
+    def done(self) -> bool:
+        return len(self.statuses) == len(self.starts)
+
+    def start(self) -> None:
+        """
+        start the first pump on every manifold
+        """
+
+        for queue in self._queues:
+            self._next(queue)
+        self._check_done()
+
+    def cancel(self) -> None:
+        """
+        cancel the operation on every pump. pumps waiting for their manifold
+        are not started and running jobs stop before their next step
+        """
+
+        if self._cancelled or self.done:
+            return
+        self._cancelled = True
+        for job in self.jobs.values():
+            if job.isRunning():
+                job.cancel()
+        for queue in self._queues:
+            while queue:
+                self._finish(queue.pop(0), 'cancelled', "cancelled before starting")
+        self._check_done()
+
+    def _next(self, queue:typing.List[str]) -> None:
+        while queue and not self._cancelled:
+            pump = queue.pop(0)
+            job = self.starts[pump]()
+            if job is None:
+                self._finish(pump, 'busy', "another operation is running on this pump")
+                continue
+            self.jobs[pump] = job
+            self.pump_started.emit(pump, job)
+            # the job is already running, so it may have completed before this point
+            job.when_completed(lambda name, status, msg, pump = pump, queue = queue: self._job_done(pump, queue, status, msg))
+            return
+
+    def _job_done(self, pump:str, queue:typing.List[str], status:str, msg:str) -> None:
+        self._finish(pump, status, msg)
+        self._next(queue)
+        self._check_done()
+
+    def _finish(self, pump:str, status:str, msg:str) -> None:
+        self.statuses[pump] = status
+        self.pump_finished.emit(pump, status, msg)
+
+    def _check_done(self) -> None:
+        # jobs which complete right away finish inside start, so only report once
+        if self.done and not self._reported:
+            self._reported = True
+            self.completed.emit(self.name, dict(self.statuses))
+
+
+class RigProgress(QWidget):
+    """
+    window showing the progress of a RigJob on every pump,
+    with a button to cancel the whole operation
+    """
+
+    def __init__(self):
+        super(RigProgress, self).__init__()
+        self.rig = None
+        self.setWindowTitle("Pumps")
+        layout = QVBoxLayout()
+        self.title = QLabel("")
+        self.grid = QGridLayout()
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.clicked.connect(self.cancel)
+        layout.addWidget(self.title)
+        layout.addLayout(self.grid)
+        layout.addWidget(self.cancel_btn)
+        self.setLayout(layout)
+        self._rows = {}
+
+    @property
+    def busy(self) -> bool:
+        return self.rig is not None and not self.rig.done
+
+    def track(self, rig:RigJob) -> None:
+        """
+        start a rig job and display its progress
+        """
+
+        self.rig = rig
+        while self.grid.count():
+            w = self.grid.takeAt(0).widget()
+            if w is not None:
+                w.deleteLater()
+        self._rows = {}
+        for i, pump in enumerate(rig.pumps):
+            bar = QProgressBar()
+            bar.setRange(0, 1)
+            bar.setValue(0)
+            status = QLabel("waiting for manifold")
+            self.grid.addWidget(QLabel(pump), i, 0)
+            self.grid.addWidget(bar, i, 1)
+            self.grid.addWidget(status, i, 2)
+            self._rows[pump] = (bar, status)
+        self.title.setText(f"{rig.name}: running")
+        self.cancel_btn.setEnabled(True)
+        rig.pump_started.connect(self._started)
+        rig.pump_finished.connect(self._finished)
+        rig.completed.connect(self._completed)
+        self.show()
+        rig.start()
+
+    def cancel(self) -> None:
+        if self.busy:
+            self.rig.cancel()
+            self.cancel_btn.setEnabled(False)
+
+    def _started(self, pump:str, job:PumpJob) -> None:
+        bar, status = self._rows[pump]
+        # show a busy indicator when there is no meaningful progress to report
+        bar.setRange(0, job.n_steps if job.n_steps > 1 else 0)
+        status.setText("running")
+        job.progress.connect(lambda done, total, desc, pump = pump: self._update(pump, done, total, desc))
+
+    def _update(self, pump:str, done:int, total:int, desc:str) -> None:
+        bar, status = self._rows[pump]
+        if total > 1:
+            bar.setValue(done)
+        status.setText(desc)
+
+    def _finished(self, pump:str, status:str, msg:str) -> None:
+        bar, label = self._rows[pump]
+        bar.setRange(0, 1)
+        bar.setValue(1 if status == 'success' else 0)
+        label.setText(f"{status} {msg}".strip())
+
+    def _completed(self, name:str, statuses:dict) -> None:
+        n_ok = sum(s == 'success' for s in statuses.values())
+        self.title.setText(f"{name}: {n_ok}/{len(statuses)} pumps succeeded")
+        self.cancel_btn.setEnabled(False)
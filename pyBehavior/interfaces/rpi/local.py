@@ -1,8 +1,13 @@
 from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtWidgets import QGroupBox, QSizePolicy, QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QLineEdit, QLabel, QComboBox, QTabWidget
 from PyQt5.QtGui import  QDoubleValidator
+import functools
+import statistics
 import time
-from pyBehavior.gui import RewardWidget
+from pyBehavior.gui import RewardWidget, RenderThrottle
+from pyBehavior.interfaces.rpi.executor import CommandExecutor
+from pyBehavior.interfaces.rpi.jobs import PumpJob, JobProgress
+from pyBehavior.interfaces.rpi.refill import syringe_volume
 from ratBerryPi.resources.pump import Syringe, Pump
 from ratBerryPi.interface import RewardInterface
 import typing
@@ -10,9 +15,23 @@ import typing
 
 class PumpConfig(QGroupBox):
     """
-    a widget for controlling a pump on the ratBerryPi locally
+    a widget for controlling a pump on the ratBerryPi locally.
+    calls to the interface run on the shared CommandExecutor in the
+    order they were made on this pump, so the GUI does not block while
+    the pump moves. long running operations (calibrating, filling and
+    emptying lines and pushing to the reservoir) run in the background
+    as PumpJobs whose steps are queued on the same lane
+
+    ...
+    PyQt Signals
+
+    job_finished(str, str, str)
+        name of the operation, status ('success', 'cancelled' or 'failed')
+        and a message
     """
 
+    job_finished = pyqtSignal(str, str, str)
+
     def __init__(self, interface:RewardInterface, pump:str, parent, modules:typing.List[str] = None):
         super(PumpConfig, self).__init__()
 
@@ -20,6 +39,12 @@ class PumpConfig(QGroupBox):
         self.pump = pump
         self.modules = modules
         self.parent = parent
+        self.executor = CommandExecutor.for_interface(self.interface)
+        self._render = RenderThrottle.shared()
+        if hasattr(parent, 'pump_configs'):
+            parent.pump_configs[self.pump] = self
+        # fill_syringe is not implemented by every version of ratBerryPi
+        self.can_fill_syringe = hasattr(self.interface, 'fill_syringe')
 
         vlayout = QVBoxLayout()
 
@@ -136,7 +161,7 @@ class PumpConfig(QGroupBox):
         self.push_amt.setValidator(QDoubleValidator())
         self.push_amt.setText("2")
         self.push_res_btn = QPushButton("Push")
-        self.push_res_btn.clicked.connect(self.push_to_res)
+        self.push_res_btn.clicked.connect(lambda x: self.push_to_res())
         push_res_layout.addWidget(amt_label)
         push_res_layout.addWidget(self.push_amt)
         push_res_layout.addWidget(self.push_res_btn)
@@ -154,34 +179,80 @@ class PumpConfig(QGroupBox):
 
         # some formatting
         vlayout.addWidget(tabs)
+
+        # progress of any running pump operation
+        self.job_progress = JobProgress([self.calibrate_btn, self.fill_btn, self.fill_all_btn,
+                                         self.push_res_btn, self.empty_btn, self.syringe_select,
+                                         self.step_type_select, self.step_speed, self.flow_rate])
+        vlayout.addWidget(self.job_progress)
         self.setLayout(vlayout)
 
     def _update_pos(self, pos: float) -> None:
-        self.pos_label.setText(f"{pos:.3f}")
-
-    def calibrate(self) -> None:
-        """
-        set pump position to 0
-        """
-        try:
-            self.interface.calibrate(self.pump)
-        except BaseException as e:
-            pass
-            
-
-    def fill_lines(self, modules:typing.List[str] = None, fill_all:bool = False):
-        """
-        fill all of the lines leading to the modules
-        this call is blocking currently so the gui will freeze
-
-        TODO: neeed to handle the freezing more gracefully
-        maybe a little loading window?
+        self._render.set_text(self.pos_label, f"{pos:.3f}")
+
+    def _submit(self, name:str, fn:typing.Callable, callback:typing.Callable = None,
+                lane:str = None, **kwargs) -> None:
+        # queue a call on this pump's lane and refresh the fields from the
+        # state of the pump once it finishes, whether or not it succeeded
+        def done(result = None):
+            self._refresh()
+            if callback is not None:
+                callback()
+        self.executor.submit(lane if lane is not None else self.pump, name, fn,
+                             callback = done, on_error = done, **kwargs)
+
+    def _refresh(self) -> None:
+        pump = self.interface.pumps[self.pump]
+        self.flow_rate.setText(f"{pump.flow_rate}")
+        self.step_speed.setText(f"{pump.speed}")
+
+    def _start_job(self, name:str, steps:typing.List[typing.Tuple[str, typing.Callable]]) -> PumpJob:
+        if self.job_progress.busy:
+            self.parent.log(f"cannot {name} on '{self.pump}' while '{self.job_progress.job.name}' is running",
+                            raise_event_line = False)
+            return None
+        # run each step on this pump's lane so it is ordered with the other calls on the pump
+        steps = [(desc, functools.partial(self.executor.run, self.pump, desc, fn)) for desc, fn in steps]
+        job = PumpJob(name, steps)
+        job.completed.connect(self._job_completed)
+        self.parent.log(f"starting {name} on {self.pump}", raise_event_line = False)
+        self.job_progress.track(job)
+        return job
+
+    def _job_completed(self, name:str, status:str, msg:str) -> None:
+        self.parent.log(f"{name} on {self.pump} finished with status '{status}' {msg}".strip(),
+                        raise_event_line = False)
+        self.job_finished.emit(name, status, msg)
+
+    def calibrate(self) -> PumpJob:
+        """
+        set pump position to 0. this runs in the background
+
+        Returns:
+            job: PumpJob
+                the background job or None if another operation is
+                already running on this pump
+        """
+        return self._start_job('calibrate', [('calibrating', lambda: self.interface.calibrate(self.pump))])
+
+    def fill_lines(self, modules:typing.List[str] = None, fill_all:bool = False) -> PumpJob:
+        """
+        fill all of the lines leading to the modules. lines are filled
+        one module at a time in the background so progress can be
+        reported and the operation can be cancelled between modules
 
         Args:
             modules: typing.List[str] (optional)
                 list of modules to fill lines for
                 default behavior is to fill lines
                 for all modules associated to this pump widget
+            fill_all: bool (optional)
+                fill the lines of all modules on the ratBerryPi
+
+        Returns:
+            job: PumpJob
+                the background job or None if another operation is
+                already running on this pump
         """
 
         if fill_all:
@@ -189,25 +260,25 @@ class PumpConfig(QGroupBox):
         elif modules is None:
             modules = self.modules
 
-        try:
-            self.interface.fill_lines(modules)
-        except BaseException as e:
-            pass
+        if modules is None:
+            steps = [('filling all lines', lambda: self.interface.fill_lines(None))]
+        else:
+            steps = [(f"filling {m}", lambda m = m: self.interface.fill_lines([m])) for m in modules]
+        return self._start_job('fill lines', steps)
 
-    def empty_lines(self):
+    def empty_lines(self) -> PumpJob:
         """
-        empty all of the lines leading to the modules
+        empty all of the lines leading to the modules in the background
         NOTE: this can only work by emptying all lines 
         for all modules associated to the pump on the 
         ratBerryPi side
 
-        TODO: neeed to handle the freezing more gracefully
-        maybe a little loading window?
+        Returns:
+            job: PumpJob
+                the background job or None if another operation is
+                already running on this pump
         """
-        try:
-            self.interface.empty_lines()
-        except BaseException as e:
-            pass
+        return self._start_job('empty lines', [('emptying lines', self.interface.empty_lines)])
 
     def toggle_auto_fill(self, on:bool = None) -> None:
         """
@@ -222,12 +293,10 @@ class PumpConfig(QGroupBox):
         """
 
         on = on if on is not None else not self.interface.auto_fill
-        try:
-            self.interface.toggle_auto_fill(on = on)
-        except BaseException as e:
-            pass
-        time.sleep(.1)
-        self.auto_fill_btn.setChecked(self.interface.auto_fill)
+        # auto-fill applies to every pump on the interface
+        self._submit('toggle auto fill', self.interface.toggle_auto_fill,
+                     callback = lambda: self.auto_fill_btn.setChecked(self.interface.auto_fill),
+                     lane = 'interface', on = on)
 
     def set_auto_fill_frac_thresh(self, value:float = None) -> None:
         """
@@ -240,11 +309,9 @@ class PumpConfig(QGroupBox):
         """
         
         value = value if value is not None else float(self.auto_fill_thresh.text())
-        try:
-            self.interface.set_auto_fill_frac_thresh(value)
-        except BaseException as e:
-            pass
-        self.auto_fill_thresh.setText(f"{value}")
+        self._submit('set auto fill threshold', self.interface.set_auto_fill_frac_thresh,
+                     callback = lambda: self.auto_fill_thresh.setText(f"{self.interface.auto_fill_frac_thresh}"),
+                     lane = 'interface', value = value)
 
     def set_microstep_type(self, step_type:str = None) -> None:
         """
@@ -261,28 +328,17 @@ class PumpConfig(QGroupBox):
         idx = self.step_type_select.findText(step_type)
         if idx == -1:
             raise ValueError('Invalid syringe type specified')
-        try:
-            self.interface.set_microstep_type(pump=self.pump, 
-                                            stepType=step_type)
-        except BaseException as e:
-            pass
         self.step_type_select.setCurrentIndex(idx)
-        flow_rate = self.interface.pumps[self.pump].flow_rate
-        self.flow_rate.setText(f"{flow_rate}")
+        self._submit('set microstep type', self.interface.set_microstep_type,
+                     pump = self.pump, stepType = step_type)
 
     def set_step_speed(self, speed:float=None) -> None:
         """
         set the flow rate of the pump
         """
         speed = speed if speed is not None else float(self.step_speed.text())
-        try:
-            self.interface.set_step_speed(pump=self.pump,
-                                        speed=speed)
-        except BaseException as e:
-            pass
-        self.step_speed.setText(f"{speed}")
-        flow_rate = self.interface.pumps[self.pump].flow_rate
-        self.flow_rate.setText(f"{flow_rate}")
+        self._submit('set step speed', self.interface.set_step_speed,
+                     pump = self.pump, speed = speed)
 
 
     def set_flow_rate(self, flow_rate:float=None) -> None:
@@ -290,15 +346,8 @@ class PumpConfig(QGroupBox):
         set the flow rate of the pump
         """
         flow_rate = flow_rate if flow_rate is not None else float(self.flow_rate.text())     
-        try:
-            self.interface.set_flow_rate(pump=self.pump,
-                                        flow_rate=flow_rate)
-        except BaseException as e:
-            pass
-        flow_rate = self.interface.pumps[self.pump].flow_rate
-        self.flow_rate.setText(f"{flow_rate}")
-        speed = self.interface.pumps[self.pump].speed
-        self.step_speed.setText(f"{speed}")
+        self._submit('set flow rate', self.interface.set_flow_rate,
+                     pump = self.pump, flow_rate = flow_rate)
 
     def change_syringe(self, syringe_type:str = None) -> None:
         """
@@ -313,38 +362,90 @@ class PumpConfig(QGroupBox):
         idx = self.syringe_select.findText(syringe_type)
         if idx == -1:
             raise ValueError('Invalid syringe type specified')
-        try:
-            self.interface.change_syringe(pump = self.pump, 
-                                        syringeType = syringe_type)
-        except BaseException as e:
-            pass
-
         self.syringe_select.setCurrentIndex(idx)
-        flow_rate = self.interface.pumps[self.pump].flow_rate
-        self.flow_rate.setText(f"{flow_rate}")
+        self._submit('change syringe', self.interface.change_syringe,
+                     pump = self.pump, syringeType = syringe_type)
         
-    def push_to_res(self, amount:float = None) -> None:
+    @property
+    def syringe_type(self) -> str:
+        """
+        name of the selected syringe type
+        """
+        return self.syringe_select.currentText()
+
+    @property
+    def syringe_volume(self) -> float:
+        """
+        capacity in mL of the selected syringe
+        """
+        return syringe_volume(self.syringe_type)
+
+    @property
+    def position(self) -> float:
+        """
+        position of the piston in cm
+        """
+        return float(self.interface.pumps[self.pump].position)
+
+    @property
+    def auto_fill_frac(self) -> float:
+        """
+        fraction of the syringe volume at which the pi refills it
+        """
+        return float(self.auto_fill_thresh.text())
+
+    def fill_syringe(self) -> PumpJob:
+        """
+        refill the syringe from the reservoir in the background
+
+        Returns:
+            job: PumpJob
+                the background job or None if another operation is
+                already running on this pump or the interface cannot fill syringes
+        """
+        if not self.can_fill_syringe:
+            self.parent.log(f"cannot fill syringe on '{self.pump}', the interface does not support fill_syringe",
+                            raise_event_line = False)
+            return None
+        return self._start_job('fill syringe', [('filling syringe', lambda: self.interface.fill_syringe(pump = self.pump))])
+
+    def push_to_res(self, amount:float = None) -> PumpJob:
         """
-        push a specified amount of fluid to the reservoir
+        push a specified amount of fluid to the reservoir in the background
 
         Args:
             amount: float (optional)
                 amount of fluid to push in mL
                 default behavior is to use the value set in
                 the gui
+
+        Returns:
+            job: PumpJob
+                the background job or None if another operation is
+                already running on this pump
         """
 
         amount = amount if amount is not None else float(self.push_amt.text())
-        try:
-            self.interface.push_to_reservoir(pump = self.pump, amount = amount)
-        except BaseException as e:
-            pass
+        return self._start_job('push to reservoir',
+                               [(f"pushing {amount} mL",
+                                 lambda: self.interface.push_to_reservoir(pump = self.pump, amount = amount))])
 
         
 
 class RPIRewardControl(RewardWidget):
     """
-    A widget for controlling ratBerryPi reward modules locally on the pi
+    A widget for controlling ratBerryPi reward modules locally on the pi.
+    calls to the interface run on the shared CommandExecutor so the GUI does
+    not block while a reward is delivered. rewards, valve toggles and post
+    delay changes are ordered with the other calls on the module's pump,
+    while LED and tone calls are ordered per module. the time from calling
+    trigger_reward to the interface's trigger_reward returning, including
+    any wait behind other calls on the pump, is kept in reward_latencies
+    (see reward_latency)
+
+    arming rewards is not supported: the interface opens the valve and sets
+    up the stepper inside trigger_reward, so nothing can be staged ahead of
+    time without leaving the valve open, and arm_reward does nothing
 
     ...
     PyQt Signals
@@ -360,6 +461,12 @@ class RPIRewardControl(RewardWidget):
         self.interface = interface
         self.module = module
         self.parent = parent
+        self.executor = CommandExecutor.for_interface(self.interface)
+        self._render = RenderThrottle.shared()
+        self.amount_dispensed = 0.
+        self.n_pulses = 0
+        self.reward_latencies = {'trigger_to_return': []}
+        self.cues = {}
     
         vlayout= QVBoxLayout()
 
@@ -367,11 +474,11 @@ class RPIRewardControl(RewardWidget):
         self.setTitle(self.module)
 
         # pump name
-        pump_name =   self.interface.modules[self.module].pump.name
+        self.pump = self.interface.modules[self.module].pump.name
         playout = QHBoxLayout()
         playout.addWidget(QLabel(f"Pump: "))
         pump_le = QLineEdit()
-        pump_le.setText(pump_name)
+        pump_le.setText(self.pump)
         pump_le.setEnabled(False)
         playout.addWidget(pump_le)
         vlayout.addLayout(playout)
@@ -534,12 +641,24 @@ class RPIRewardControl(RewardWidget):
         self.setLayout(vlayout)
 
     def reset_amount_dispensed(self):
-        self.amt_disp.setText(f"{0}")
-        self.npulse.setText(f"{0}")
+        self.amount_dispensed = 0.
+        self.n_pulses = 0
+        self._render.set_text(self.amt_disp, f"{0}")
+        self._render.set_text(self.npulse, f"{0}")
+
+    def _count_reward(self, amount:float) -> None:
+        self.amount_dispensed += amount
+        self.n_pulses += 1
+        self._render.set_text(self.amt_disp, f"{self.amount_dispensed:g}")
+        self._render.set_text(self.npulse, f"{self.n_pulses}")
+        # only delivered rewards count towards the syringe forecast
+        scheduler = getattr(self.parent, 'refill_scheduler', None)
+        if scheduler is not None:
+            scheduler.record(self.module, amount)
 
     def _update_licks(self) -> None:
-        self.lick_count.setText(f"{self.interface.modules[self.module].lickometer.licks}")
         self.new_lick.emit(True)
+        self._render.set_text(self.lick_count, f"{self.interface.modules[self.module].lickometer.licks}")
 
     def _single_pulse(self) -> None:
         amt = float(self.amt.text())
@@ -555,11 +674,9 @@ class RPIRewardControl(RewardWidget):
         """
         reset the lick count for this module
         """
-        try:
-            self.interface.reset_licks(self.module)
-        except BaseException as e:
-            pass
-        self.lick_count.setText(f"Lick Count: {self.interface.modules[self.module].lickometer.licks}")
+        refresh = lambda *args: self._render.set_text(self.lick_count, f"{self.interface.modules[self.module].lickometer.licks}")
+        self.executor.submit(self.module, 'reset licks', self.interface.reset_licks,
+                             callback = refresh, on_error = refresh, module = self.module)
     
     def update_post_delay(self, post_delay:float = None) -> None:
         """
@@ -571,12 +688,10 @@ class RPIRewardControl(RewardWidget):
                 new post pump actuation delay in seconds
         """
         post_delay = post_delay if post_delay is not None else float(self.post_delay.text())
-        try:
-            self.interface.update_post_delay(module = self.module, 
-                                            post_delay = float(self.post_delay.text()))
-        except BaseException as e:
-            pass
-        self.post_delay.setText(f"{post_delay}")
+        refresh = lambda *args: self.post_delay.setText(f"{self.interface.modules[self.module].post_delay}")
+        self.executor.submit(self.pump, 'update post delay', self.interface.update_post_delay,
+                             callback = refresh, on_error = refresh,
+                             module = self.module, post_delay = post_delay)
 
     def play_tone(self, freq:float = None, volume:float = None, dur:float = None) -> None:
         """
@@ -597,16 +712,59 @@ class RPIRewardControl(RewardWidget):
         freq = freq if freq is not None else float(self.tone_freq.text())
         volume = volume if volume is not None else float(self.tone_vol.text())
         dur = dur if dur is not None else float(self.tone_dur.text())
+        self.executor.submit(self.module, 'play tone', self.interface.play_tone,
+                             module = self.module, freq = freq, volume = volume, dur = dur)
+
+    def preload_tone(self, name:str, freq:float, dur:float, volume:float) -> None:
+        """
+        register a tone which can then be played by name with play_cue.
+        if the interface can preload tones (preload_tone and play_cue) the
+        tone is synthesized once and kept, otherwise the call to play_tone
+        is prepared
+
+        Args:
+            name: str
+                name to play the tone by
+            freq: float
+                tone frequency in Hz
+            dur: float
+                duration of the tone in seconds
+            volume: float
+                fraction of max volume to play the tone at.
+                this value should be between 0 and 1
+        """
+
+        tone = {'module': self.module, 'freq': freq, 'volume': volume, 'dur': dur}
+        fallback = functools.partial(self.interface.play_tone, **tone)
+        if not (hasattr(self.interface, 'preload_tone') and hasattr(self.interface, 'play_cue')):
+            self.cues[name] = fallback
+            return
+
+        # the tone is preloaded on the module's lane so cues played in the
+        # meantime are queued behind it and see the fallback if it fails
+        def preload():
+            try:
+                self.interface.preload_tone(name = name, **tone)
+            except Exception:
+                self.cues[name] = fallback
+                raise
 
-        try:
-            self.interface.play_tone(
-                module = self.module,
-                freq = freq,
-                volume = volume,
-                dur = dur
-            )
-        except BaseException as e:
-            pass
+        self.cues[name] = functools.partial(self.interface.play_cue, module = self.module, name = name)
+        self.executor.submit(self.module, f"preload tone {name}", preload,
+                             on_error = lambda e: self.parent.log(f"failed to preload tone '{name}' on {self.module}: {e}",
+                                                                 raise_event_line = False))
+
+    def play_cue(self, name:str) -> None:
+        """
+        play a tone registered with preload_tone
+
+        Args:
+            name: str
+                name the tone was registered with
+        """
+
+        # look the cue up on the lane in case preloading it fails
+        self.executor.submit(self.module, f"play cue {name}", lambda: self.cues[name]())
 
     def toggle_led(self, on:bool = None) -> None:
         """
@@ -622,11 +780,9 @@ class RPIRewardControl(RewardWidget):
         if on is None:
             led_state = self.interface.modules[self.module].LED.on
             on = not led_state
-        try:
-            self.interface.toggle_LED(module = self.module, on = on)
-        except BaseException as e:
-            pass
-        self.led_btn.setChecked(self.interface.modules[self.module].LED.on)
+        refresh = lambda *args: self.led_btn.setChecked(self.interface.modules[self.module].LED.on)
+        self.executor.submit(self.module, 'toggle LED', self.interface.toggle_LED,
+                             callback = refresh, on_error = refresh, module = self.module, on = on)
 
     def toggle_valve(self, open_valve:bool = None):
         """
@@ -642,13 +798,23 @@ class RPIRewardControl(RewardWidget):
         if open_valve is None:
             valve_state = self.interface.modules[self.module].valve.is_open
             open_valve = not valve_state
-        try:
-            self.interface.toggle_valve(module = self.module, open_valve = open_valve)
-        except BaseException as e:
-            pass
+        self.executor.submit(self.pump, 'toggle valve', self.interface.toggle_valve,
+                             callback = self._refresh_valve, on_error = self._refresh_valve,
+                             module = self.module, open_valve = open_valve)
+
+    def _refresh_valve(self, *args) -> None:
         self.valve_btn.setChecked(self.interface.modules[self.module].valve.is_open)
 
 
+    def reward_latency(self) -> dict:
+        """
+        number of rewards delivered and the median time in ms from calling
+        trigger_reward to the interface's trigger_reward returning
+        """
+
+        return {kind: (len(lat), statistics.median(lat) * 1000 if lat else float('nan'))
+                for kind, lat in self.reward_latencies.items()}
+
     def trigger_reward(self, amount:float, force:bool = True, enqueue:bool = False) -> None:
         """
         trigger a reward of a specified amount
@@ -667,14 +833,15 @@ class RPIRewardControl(RewardWidget):
                 delivery until after the currently running task is finished
         """
 
-        try:
-            self.interface.trigger_reward(
-                module = self.module,
-                amount = amount,
-                force = force,
-                enqueue = enqueue
-            )
-        except BaseException as e:
-            pass
-        self.amt_disp.setText(f"{float(self.amt_disp.text()) + amount}")
-        self.npulse.setText(f"{float(self.npulse.text()) + 1}")
\ No newline at end of file
+        # latencies include the time spent waiting behind other calls on the pump
+        t = time.perf_counter()
+
+        def timed():
+            self.interface.trigger_reward(module = self.module, amount = amount, force = force, enqueue = enqueue)
+            return time.perf_counter() - t
+
+        def done(latency:float):
+            self.reward_latencies['trigger_to_return'].append(latency)
+            self._count_reward(amount)
+
+        self.executor.submit(self.pump, 'reward', timed, callback = done)
\ No newline at end of file
@@ -0,0 +1,225 @@
+"""
+shared poller for attributes of a remote ratBerryPi
+"""
+
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+import typing
+from pyBehavior.interfaces.rpi import wire
+from pyBehavior.interfaces.rpi.pool import ChannelPool
+
+
+logger = logging.getLogger(__name__)
+
+
+class PollerWatch(QObject):
+    """
+    handle for an attribute watched by a StatePoller
+
+    Args:
+        req: str
+            attribute being watched
+        interval: float
+            time between reads of the attribute in seconds
+
+    ...
+    PyQt Signals
+
+    updated(object)
+        new value of the attribute. emitted on the first read and
+        whenever the value changes
+    """
+
+    updated = pyqtSignal(object)
+
+    def __init__(self, req:str, interval:float):
+        super(PollerWatch, self).__init__()
+        self.req = req
+        self.interval = interval
+        self.value = None
+        self.due = 0.
+
+    def _set(self, value) -> None:
+        if isinstance(value, str):
+            value = wire.parse_value(value)
+        if self.value is None or value != self.value:
+            self.value = value
+            self.updated.emit(value)
+
+
+class StatePoller(QThread):
+    """
+    thread which polls every watched attribute of a remote ratBerryPi. on
+    each tick all attributes that are due are read in one batch and the
+    results are fanned out through the signals of each PollerWatch. each
+    attribute is read at its own rate, so the number of threads and
+    channels stays bounded as modules are added.
+
+    when the client can batch reads (e.g. QtAsyncClient) a batch is a
+    single get_many call on one channel, which pipelines the reads so they
+    take about one round trip. otherwise the reads in a
+    batch are sent concurrently, each on its own channel from a pool of up
+    to fanout channels, so a batch still costs about one round trip. each
+    read is still its own request though, so to keep the load on the pi
+    bounded as attributes are added the reads are capped at max_rate per
+    second in total: when more attributes are watched than that allows,
+    every attribute is read less often than its interval asks for
+
+    widgets should share one poller per client through StatePoller.for_client
+
+    Args:
+        client:
+            client to poll through
+        channel: str (optional)
+            channel to poll on. also used as the prefix for the
+            names of the channels opened when reads are not batched
+        fanout: int (optional)
+            maximum number of reads in flight at once when reads are not batched
+        max_rate: float (optional)
+            maximum number of reads per second when reads are not batched
+    """
+
+    _pollers = {}
+
+    def __init__(self, client, channel:str = 'poller', fanout:int = 8, max_rate:float = 400.):
+        super(StatePoller, self).__init__()
+        self.client = client
+        self.channel = channel
+        self.max_rate = max_rate
+        self.batched = getattr(client, 'batched', False)
+        if self.batched:
+            self.client.new_channel(self.channel)
+            self._pool = None
+            self._readers = None
+        else:
+            logger.info(f"rpi client cannot batch reads, polling on up to {fanout} channels instead")
+            self._pool = ChannelPool(client, size = fanout, prefix = channel)
+            self._readers = ThreadPoolExecutor(max_workers = fanout, thread_name_prefix = channel)
+        self.n_batches = 0
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._failing = False
+
+    @classmethod
+    def for_client(cls, client) -> 'StatePoller':
+        """
+        get the poller shared by everything using a client, creating it if needed
+        """
+
+        key = id(client)
+        if key not in cls._pollers:
+            cls._pollers[key] = cls(client)
+        return cls._pollers[key]
+
+    def watch(self, req:str, interval:float) -> PollerWatch:
+        """
+        start polling an attribute. if the attribute is already watched the
+        existing watch is returned and polled at the faster of the two rates.
+        the poller is started on the first call
+
+        Args:
+            req: str
+                attribute to poll (e.g. "modules['module1'].lickometer.licks")
+            interval: float
+                time between reads in seconds
+        """
+
+        with self._lock:
+            w = self._watches.get(req)
+            if w is None:
+                w = PollerWatch(req, interval)
+                self._watches[req] = w
+            else:
+                w.interval = min(w.interval, interval)
+            w.due = 0.
+        self._wake.set()
+        if not self.isRunning() and not self._stopped:
+            self.start()
+        return w
+
+    def unwatch(self, req:str) -> None:
+        """
+        stop polling an attribute
+        """
+
+        with self._lock:
+            self._watches.pop(req, None)
+
+    def resync(self) -> None:
+        """
+        read every watched attribute on the next tick (e.g. after the
+        connection to the pi has been restored)
+        """
+
+        with self._lock:
+            for w in self._watches.values():
+                w.due = 0.
+        self._wake.set()
+
+    def _interval(self, w:PollerWatch, n:int) -> float:
+        # without batching every read is a request, so share max_rate between the n watches
+        if self.batched:
+            return w.interval
+        return max(w.interval, n / self.max_rate)
+
+    def _read(self, reqs:typing.List[str]) -> list:
+        if self.batched:
+            return self.client.get_many(reqs, channel = self.channel)
+        return list(self._readers.map(self._read_one, reqs))
+
+    def _read_one(self, req:str):
+        with self._pool.channel() as ch:
+            return self.client.get(req, channel = ch)
+
+    def run(self):
+        while not self._stopped:
+            now = time.monotonic()
+            with self._lock:
+                watches = list(self._watches.values())
+            if not watches:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            # read everything that will be due within half of the fastest
+            # interval so attributes with similar rates share a batch
+            slack = min(self._interval(w, len(watches)) for w in watches) / 2
+            due = [w for w in watches if w.due <= now + slack]
+            if due:
+                try:
+                    values = self._read([w.req for w in due])
+                    self._failing = False
+                except (OSError, ValueError) as e:
+                    # only report the first of a run of failures
+                    if not self._failing:
+                        logger.warning(f"failed to poll rpi: {e}")
+                    self._failing = True
+                    values = None
+                self.n_batches += 1
+                now = time.monotonic()
+                for i, w in enumerate(due):
+                    w.due = max(w.due + self._interval(w, len(watches)), now)
+                    if values is not None:
+                        w._set(values[i])
+            wait = min(w.due for w in watches) - time.monotonic()
+            if wait > 0:
+                self._wake.wait(wait)
+                self._wake.clear()
+
+    def stop(self) -> None:
+        """
+        stop polling
+        """
+
+        self._stopped = True
+        self._wake.set()
+        self.wait()
+        if self._readers is not None:
+            self._readers.shutdown()
+        for key, poller in list(StatePoller._pollers.items()):
+            if poller is self:
+                del StatePoller._pollers[key]
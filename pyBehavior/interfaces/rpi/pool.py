@@ -0,0 +1,185 @@
+"""
+connection pooling for remote ratBerryPi clients
+"""
+
+from contextlib import contextmanager
+import queue
+import threading
+import time
+import typing
+
+
+class ChannelPool:
+    """
+    bounded pool of channels on a ratBerryPi client. channels are
+    opened lazily up to the size of the pool and handed out to one
+    request at a time so concurrent requests never share a channel
+
+    Args:
+        client: ratBerryPi.remote.client.Client
+            client to open channels on
+        size: int (optional)
+            maximum number of channels to open
+        prefix: str (optional)
+            prefix for the names of the channels opened by the pool
+    """
+
+    def __init__(self, client, size:int = 4, prefix:str = 'pool'):
+        assert size > 0, "pool size must be positive"
+        self.client = client
+        self.size = size
+        self.prefix = prefix
+        self._free = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._n_open = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._n_checkouts = 0
+        self._n_waits = 0
+        self._wait_time = 0.
+        self._busy_time = 0.
+        self._t_start = time.perf_counter()
+        self._t_last = self._t_start
+
+    def _account(self, delta:int) -> None:
+        # integrate the number of channels in use over time
+        now = time.perf_counter()
+        self._busy_time += self._in_use * (now - self._t_last)
+        self._t_last = now
+        self._in_use += delta
+        self._peak_in_use = max(self._peak_in_use, self._in_use)
+
+    def acquire(self, timeout:float = None) -> str:
+        """
+        check out a channel, opening a new one if none are free
+        and the pool is not full. blocks until a channel is released
+        otherwise
+
+        Args:
+            timeout: float (optional)
+                maximum time to wait for a channel in seconds
+        """
+
+        t = time.perf_counter()
+        name = None
+        new = False
+        with self._lock:
+            try:
+                name = self._free.get_nowait()
+            except queue.Empty:
+                if self._n_open < self.size:
+                    name = f"{self.prefix}{self._n_open}"
+                    self._n_open += 1
+                    new = True
+            if name is not None:
+                self._account(1)
+                self._n_checkouts += 1
+        if name is None:
+            try:
+                name = self._free.get(timeout = timeout)
+            except queue.Empty:
+                raise TimeoutError(f"no channel available after {timeout}s")
+            with self._lock:
+                self._account(1)
+                self._n_checkouts += 1
+                self._n_waits += 1
+                self._wait_time += time.perf_counter() - t
+        elif new:
+            try:
+                self.client.new_channel(name)
+            except BaseException:
+                with self._lock:
+                    self._n_open -= 1
+                    self._account(-1)
+                raise
+        return name
+
+    def release(self, name:str) -> None:
+        """
+        return a channel to the pool
+        """
+
+        with self._lock:
+            self._account(-1)
+        self._free.put(name)
+
+    @contextmanager
+    def channel(self, timeout:float = None) -> typing.Iterator[str]:
+        """
+        context manager which checks out a channel for the duration of the block
+        """
+
+        name = self.acquire(timeout)
+        try:
+            yield name
+        finally:
+            self.release(name)
+
+    def utilization(self) -> dict:
+        """
+        summary of how heavily the pool has been used since it was created
+        """
+
+        with self._lock:
+            self._account(0)
+            elapsed = self._t_last - self._t_start
+            return {'size': self.size,
+                    'open': self._n_open,
+                    'in_use': self._in_use,
+                    'peak_in_use': self._peak_in_use,
+                    'checkouts': self._n_checkouts,
+                    'waits': self._n_waits,
+                    'mean_wait_ms': 1e3 * self._wait_time / self._n_waits if self._n_waits else 0.,
+                    'busy_fraction': self._busy_time / (self.size * elapsed) if elapsed > 0 else 0.}
+
+
+class PooledClient:
+    """
+    wrapper around a ratBerryPi client which runs requests on
+    channels checked out from a ChannelPool. requests made without a
+    channel or on one of the shared channel names are pooled. requests
+    on any other channel (e.g. one opened by a polling thread with
+    new_channel) are passed through to that channel unchanged
+
+    Args:
+        client: ratBerryPi.remote.client.Client
+            client to wrap
+        size: int (optional)
+            maximum number of pooled channels
+        shared: typing.Iterable[str] (optional)
+            channel names whose requests should be pooled
+        timeout: float (optional)
+            maximum time to wait for a free channel in seconds
+    """
+
+    def __init__(self, client, size:int = 4, shared:typing.Iterable[str] = ('run',), timeout:float = None):
+        self.client = client
+        self.pool = ChannelPool(client, size)
+        self.shared = set(shared)
+        self.timeout = timeout
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _pooled(self, channel:str) -> bool:
+        return channel is None or channel in self.shared
+
+    def new_channel(self, name:str) -> None:
+        if name not in self.shared:
+            self.client.new_channel(name)
+
+    def get(self, req:str, channel:str = None):
+        if self._pooled(channel):
+            with self.pool.channel(self.timeout) as ch:
+                return self.client.get(req, channel = ch)
+        return self.client.get(req, channel = channel)
+
+    def run_command(self, command:str, args:dict = None, channel:str = None) -> str:
+        args = args if args is not None else {}
+        if self._pooled(channel):
+            with self.pool.channel(self.timeout) as ch:
+                return self.client.run_command(command, args, channel = ch)
+        return self.client.run_command(command, args, channel = channel)
+
+    def utilization(self) -> dict:
+        return self.pool.utilization()
@@ -0,0 +1,212 @@
+"""
+forecasting of syringe depletion and scheduling of refills
+during windows of a protocol where they will not delay a reward
+"""
+
+from collections import deque
+import math
+import re
+import time
+import typing
+
+
+# inner diameters in cm of the syringe types supported by ratBerryPi
+SYRINGE_DIAMETERS = {"BD1mL": 0.478, "BD3mL": 0.866, "BD5mL": 1.206, "BD10mL": 1.45,
+                     "BD20mL": 1.913, "BD30mL": 2.17, "BD60mL": 2.67}
+
+
+def syringe_volume(syringe_type:str) -> float:
+    """
+    capacity in mL of a syringe type named like the ratBerryPi
+    syringe types (e.g. 'BD5mL'). returns nan if it cannot be parsed
+    """
+
+    m = re.search(r"(\d+(?:\.\d+)?)\s*mL", syringe_type)
+    return float(m.group(1)) if m else float('nan')
+
+
+def syringe_area(syringe_type:str) -> float:
+    """
+    cross sectional area in cm^2 (i.e. mL dispensed per cm of
+    piston travel) of a syringe type. returns nan if it is unknown
+    """
+
+    d = SYRINGE_DIAMETERS.get(syringe_type, float('nan'))
+    return math.pi * (d / 2) ** 2
+
+
+class SyringeForecast:
+    """
+    tracks the volume dispensed from each pump since its syringe was last
+    filled and forecasts when each syringe will run low from the rate at
+    which rewards were delivered recently. the dispensed volume follows the
+    rewards recorded in between observations of the pump position, which
+    also account for fluid moved by the pi itself (e.g. automatic refills)
+
+    Args:
+        window: float (optional)
+            time over which to average the reward rate in seconds
+    """
+
+    def __init__(self, window:float = 120.):
+        self.window = window
+        self.dispensed = {}
+        self._history = {}
+
+    def record(self, pump:str, amount:float, t:float = None) -> None:
+        """
+        record a reward dispensed from a pump
+        """
+
+        t = t if t is not None else time.monotonic()
+        self.dispensed[pump] = self.dispensed.get(pump, 0.) + amount
+        self._history.setdefault(pump, deque()).append((t, amount))
+
+    def filled(self, pump:str) -> None:
+        """
+        record that the syringe on a pump was refilled
+        """
+        self.dispensed[pump] = 0.
+
+    def observe(self, pump:str, dispensed:float) -> None:
+        """
+        record the volume dispensed from the syringe on a pump as measured on the pi
+        """
+        self.dispensed[pump] = max(dispensed, 0.)
+
+    def rate(self, pump:str, t:float = None) -> float:
+        """
+        recent rate at which a pump dispensed reward in mL/s
+        """
+
+        t = t if t is not None else time.monotonic()
+        history = self._history.get(pump, deque())
+        while history and history[0][0] < t - self.window:
+            history.popleft()
+        if not history:
+            return 0.
+        # average over the window, or since the first reward if that was more recent
+        span = min(self.window, max(t - history[0][0], 1.))
+        return sum(a for _, a in history) / span
+
+    def remaining(self, pump:str, capacity:float) -> float:
+        """
+        volume in mL left in the syringe on a pump
+        """
+        return capacity - self.dispensed.get(pump, 0.)
+
+    def time_to(self, pump:str, capacity:float, frac:float, t:float = None) -> float:
+        """
+        forecast time in seconds until the syringe on a pump has frac of
+        its capacity left. returns inf if nothing is being dispensed
+        """
+
+        rate = self.rate(pump, t)
+        left = self.remaining(pump, capacity) - frac * capacity
+        if left <= 0:
+            return 0.
+        return left / rate if rate > 0 else float('inf')
+
+
+class RefillScheduler:
+    """
+    refills syringes ahead of time while the running protocol is in a safe
+    window (see Protocol.safe_states) so the pi's automatic refill, which
+    fires as soon as a syringe drops below the auto fill threshold, does not
+    land in the middle of a trial. a syringe is refilled in a safe window if
+    it is forecast to reach the threshold within horizon seconds. the volume
+    left in each syringe is taken from the pump position reported by its
+    PumpConfig whenever it is known
+
+    refills rely on the fill_syringe command, which not every ratBerryPi
+    implements. pumps whose PumpConfig found it unsupported when it was
+    created are never refilled (this is logged once), and if the pi
+    rejects the command anyway the scheduler is disabled for the rest
+    of the session
+
+    Args:
+        gui: SetupGUI
+            setup gui whose rewards and pump configs are tracked
+        horizon: float (optional)
+            how far ahead to forecast in seconds. this should be at least
+            the time between safe windows
+        window: float (optional)
+            time over which to average the reward rate in seconds
+    """
+
+    def __init__(self, gui, horizon:float = 60., window:float = 120.):
+        self.gui = gui
+        self.horizon = horizon
+        self.forecast = SyringeForecast(window)
+        self.enabled = True
+        self._refilling = set()
+        self._unsupported = set()
+
+    def record(self, module:str, amount:float) -> None:
+        """
+        record a reward delivered on a module. reward widgets call this
+        once a reward has been delivered, so failed rewards are not counted
+        """
+
+        pump = getattr(self.gui.reward_modules[module], 'pump', None)
+        if pump is not None:
+            self.forecast.record(pump, amount)
+
+    def due(self) -> typing.List[str]:
+        """
+        pumps whose syringes are forecast to reach their
+        auto fill threshold within the horizon
+        """
+
+        pumps = []
+        for pump, config in self.gui.pump_configs.items():
+            if pump in self._refilling:
+                continue
+            if not getattr(config, 'can_fill_syringe', True):
+                if pump not in self._unsupported:
+                    self._unsupported.add(pump)
+                    self.gui.log(f"not pre-emptively refilling {pump}, the rpi does not support fill_syringe",
+                                 raise_event_line = False)
+                continue
+            # the position is the piston travel in cm since the syringe was last filled
+            dispensed = config.position * syringe_area(config.syringe_type)
+            if dispensed == dispensed:
+                self.forecast.observe(pump, dispensed)
+            if self.forecast.dispensed.get(pump, 0.) <= 0:
+                continue
+            capacity = config.syringe_volume
+            if capacity != capacity:
+                continue
+            if self.forecast.time_to(pump, capacity, config.auto_fill_frac) <= self.horizon:
+                pumps.append(pump)
+        return pumps
+
+    def check(self) -> None:
+        """
+        start refilling any syringe that is due if the protocol is in a safe
+        window. this is called by the setup gui whenever the state changes
+        """
+
+        if not self.enabled:
+            return
+        prot = getattr(self.gui, '_state_machine', None)
+        if prot is None or not prot.in_safe_window():
+            return
+        for pump in self.due():
+            job = self.gui.pump_configs[pump].fill_syringe()
+            if job is None:
+                continue
+            self._refilling.add(pump)
+            self.gui.log(f"pre-emptively refilling {pump} with "
+                         f"{self.forecast.dispensed.get(pump, 0.):.3f} mL dispensed",
+                         raise_event_line = False)
+            job.when_completed(lambda name, status, msg, pump = pump: self._refilled(pump, status, msg))
+
+    def _refilled(self, pump:str, status:str, msg:str) -> None:
+        self._refilling.discard(pump)
+        if status == 'success':
+            self.forecast.filled(pump)
+        elif status == 'failed' and 'ERROR:' in msg and 'not sent' not in msg and self.enabled:
+            # the pi rejected the command, so every later refill would fail too
+            self.enabled = False
+            self.gui.log(f"disabling pre-emptive refills: {msg}", raise_event_line = False)
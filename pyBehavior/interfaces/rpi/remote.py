@@ -1,24 +1,131 @@
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
+from PyQt5.QtCore import QObject, pyqtSignal, Qt
 from PyQt5.QtWidgets import QGroupBox, QSizePolicy, QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QLineEdit, QLabel, QComboBox, QTabWidget
 from PyQt5.QtGui import QDoubleValidator
+from collections import deque
+import statistics
 import time
-from pyBehavior.gui import RewardWidget
+from pyBehavior.gui import RewardWidget, RenderThrottle
+from pyBehavior.interfaces.rpi.jobs import PumpJob, JobProgress
+from pyBehavior.interfaces.rpi.refill import syringe_volume
+from pyBehavior.interfaces.rpi.poller import StatePoller
+from pyBehavior.interfaces.rpi.dispatch import RewardDispatcher, CommandDispatcher
+from pyBehavior.interfaces.rpi import wire
 import typing
 
 
+class RemoteToggle(QObject):
+    """
+    keeps a checkable button in sync with a boolean attribute on the pi.
+    when toggled the button is updated immediately and the command is sent
+    in the background. once the pi replies the button is reverted to the
+    last known state if the command failed. the attribute is also polled so
+    changes made on the pi by other means are reflected in the button
+
+    Args:
+        client:
+            client for communicating with the pi
+        button: QPushButton
+            checkable button showing the state of the attribute
+        req: str
+            attribute on the pi (e.g. "modules['module1'].LED.on")
+        command: str
+            command used to set the attribute
+        make_args: typing.Callable
+            function mapping the desired state to the arguments of the command
+        log: typing.Callable
+            function used to log failed commands
+        interval: float (optional)
+            time between reads of the attribute in seconds
+    """
+
+    def __init__(self, client, button, req:str, command:str, make_args:typing.Callable,
+                 log:typing.Callable, interval:float = 1.):
+        super(RemoteToggle, self).__init__()
+        self.button = button
+        self.command = command
+        self.make_args = make_args
+        self.log = log
+        self.state = bool(client.get(req, channel = 'run'))
+        self.confirmed = self.state
+        self.button.setChecked(self.state)
+        self._in_flight = []
+        self._dispatcher = CommandDispatcher.for_client(client)
+        self._dispatcher.replied.connect(self._replied)
+        self.watch = StatePoller.for_client(client).watch(req, interval)
+        self.watch.updated.connect(self._polled)
+
+    def set(self, on:bool = None) -> None:
+        """
+        set the attribute. toggles the current state if on is not provided
+        """
+
+        on = on if on is not None else not self.state
+        self.state = on
+        self.button.setChecked(on)
+        args = self.make_args(on)
+        self._in_flight.append((args, on))
+        self._dispatcher.send(self.command, args)
+
+    def _replied(self, command:str, args:dict, status:str, t_dispatch:float, t_reply:float) -> None:
+        match = next((i for i, (a, _) in enumerate(self._in_flight) if a is args), None)
+        if match is None:
+            return
+        _, on = self._in_flight.pop(match)
+        if status in (wire.SUCCESS, wire.BUFFERED):
+            self.confirmed = on
+        else:
+            self.log(f"{command} {args} failed: {status.strip()}")
+        if not self._in_flight:
+            self._show(self.confirmed)
+
+    def _polled(self, value) -> None:
+        self.confirmed = bool(value)
+        # the reply to an in flight command is more recent than the poll
+        if not self._in_flight:
+            self._show(self.confirmed)
+
+    def _show(self, on:bool) -> None:
+        self.state = on
+        self.button.setChecked(on)
+
+
 class PumpConfig(QGroupBox):
     """
 
     a widget for controlling a pump on the ratBerryPi remotely
-    through a client
+    through a client. long running operations (calibrating, filling
+    and emptying lines and pushing to the reservoir) run in the
+    background on a dedicated channel
+
+    ...
+    PyQt Signals
+
+    job_finished(str, str, str)
+        name of the operation, status ('success', 'cancelled' or 'failed')
+        and a message
 
     """
+
+    job_finished = pyqtSignal(str, str, str)
+
+    # time between reads of the piston position in seconds
+    pos_poll_interval = 0.1
+
     def __init__(self, client, pump, parent, modules = None):
         super(PumpConfig, self).__init__()
         self.client = client
         self.pump = pump
         self.modules = modules
         self.parent = parent
+        self._render = RenderThrottle.shared()
+        if hasattr(parent, 'pump_configs'):
+            parent.pump_configs[self.pump] = self
+        self._job_channel = f"{self.pump}_jobs"
+        self.client.new_channel(self._job_channel)
+        # fill_syringe is not implemented by every ratBerryPi server, so check
+        # once whether the interface on the pi exposes it
+        reply = self.client.get('fill_syringe', channel = 'run')
+        self.can_fill_syringe = not f"{reply}".startswith("ERROR")
 
         vlayout = QVBoxLayout()
 
@@ -32,9 +139,9 @@ class PumpConfig(QGroupBox):
         self.pos_label.setEnabled(False)
         playout.addWidget(self.pos_label)
         vlayout.addLayout(playout)
-        self.pos_thread = PumpConfig.RPIPumpPosThread(self.client, self.pump)
-        self.pos_thread.pos_updated.connect(self._update_pos)
-        self.pos_thread.start()
+        self.pos_watch = StatePoller.for_client(self.client).watch(f"pumps['{self.pump}'].position",
+                                                                   self.pos_poll_interval)
+        self.pos_watch.updated.connect(self._update_pos)
 
         # button to calibrate the pump
         self.calibrate_btn = QPushButton("Calibrate")
@@ -102,8 +209,8 @@ class PumpConfig(QGroupBox):
         self.auto_fill_thresh.editingFinished.connect(self.set_auto_fill_frac_thresh)
         self.auto_fill_btn = QPushButton("Toggle Auto-Fill")
         self.auto_fill_btn.setCheckable(True)
-        init_state = bool(self.client.get(f"auto_fill", channel = 'run'))
-        self.auto_fill_btn.setChecked(init_state)
+        self._auto_fill = RemoteToggle(self.client, self.auto_fill_btn, "auto_fill", 'toggle_auto_fill',
+                                       lambda on: {'on': on}, self._log)
         self.auto_fill_btn.clicked.connect(self.toggle_auto_fill)
         auto_fill_layout.addWidget(auto_fill_thresh_label)
         auto_fill_layout.addWidget(self.auto_fill_thresh)
@@ -136,7 +243,7 @@ class PumpConfig(QGroupBox):
         self.push_amt.setValidator(QDoubleValidator())
         self.push_amt.setText("2")
         self.push_res_btn = QPushButton("Push")
-        self.push_res_btn.clicked.connect(self.push_to_res)
+        self.push_res_btn.clicked.connect(lambda x: self.push_to_res())
         push_res_layout.addWidget(amt_label)
         push_res_layout.addWidget(self.push_amt)
         push_res_layout.addWidget(self.push_res_btn)
@@ -153,30 +260,67 @@ class PumpConfig(QGroupBox):
 
         # some formatting
         vlayout.addWidget(tabs)
+
+        # progress of any running pump operation
+        self.job_progress = JobProgress([self.calibrate_btn, self.fill_btn, self.fill_all_btn,
+                                         self.push_res_btn, self.empty_btn, self.syringe_select,
+                                         self.step_type_select, self.step_speed, self.flow_rate])
+        vlayout.addWidget(self.job_progress)
         self.setLayout(vlayout)
 
     def _update_pos(self, pos:float) -> None:
-        self.pos_label.setText(f"{pos:.3f}")
-
-    def calibrate(self) -> None:
-        """
-        set pump position to 0
+        self._render.set_text(self.pos_label, f"{pos:.3f}")
+
+    def _run_job_command(self, command:str, args:dict) -> None:
+        status = self.client.run_command(command, args, channel = self._job_channel)
+        if not status == 'SUCCESS\n':
+            raise RuntimeError(status.strip())
+
+    def _start_job(self, name:str, steps:typing.List[typing.Tuple[str, typing.Callable]]) -> PumpJob:
+        if self.job_progress.busy:
+            self.parent.log(f"cannot {name} on '{self.pump}' while '{self.job_progress.job.name}' is running",
+                            raise_event_line = False)
+            return None
+        job = PumpJob(name, steps)
+        job.completed.connect(self._job_completed)
+        self.parent.log(f"starting {name} on {self.pump}", raise_event_line = False)
+        self.job_progress.track(job)
+        return job
+
+    def _job_completed(self, name:str, status:str, msg:str) -> None:
+        self.parent.log(f"{name} on {self.pump} finished with status '{status}' {msg}".strip(),
+                        raise_event_line = False)
+        self.job_finished.emit(name, status, msg)
+
+    def calibrate(self) -> PumpJob:
         """
-        self.client.run_command('calibrate', {'pump': self.pump}, channel = 'run')
+        set pump position to 0. this runs in the background
 
-    def fill_lines(self, modules:typing.List[str] = None, fill_all:bool = False) -> None:
+        Returns:
+            job: PumpJob
+                the background job or None if another operation is
+                already running on this pump
         """
-        fill all of the lines leading to the modules
-        this call is blocking currently so the gui will freeze
+        return self._start_job('calibrate', [('calibrating', lambda: self._run_job_command('calibrate', {'pump': self.pump}))])
 
-        TODO: neeed to handle the freezing more gracefully
-        maybe a little loading window?
+    def fill_lines(self, modules:typing.List[str] = None, fill_all:bool = False) -> PumpJob:
+        """
+        fill all of the lines leading to the modules. lines are filled
+        one module at a time in the background so progress can be
+        reported and the operation can be cancelled between modules
 
         Args:
             modules: typing.List[str] (optional)
                 list of modules to fill lines for
                 default behavior is to fill lines
                 for all modules associated to this pump widget
+            fill_all: bool (optional)
+                fill the lines of all modules on the ratBerryPi
+
+        Returns:
+            job: PumpJob
+                the background job or None if another operation is
+                already running on this pump
         """
 
         if fill_all:
@@ -184,25 +328,37 @@ class PumpConfig(QGroupBox):
         elif modules is None:
             modules = self.modules
 
-        self.client.run_command('fill_lines', {'modules': modules}, channel = 'run')
+        if modules is None:
+            steps = [('filling all lines', lambda: self._run_job_command('fill_lines', {'modules': None}))]
+        else:
+            steps = [(f"filling {m}", lambda m = m: self._run_job_command('fill_lines', {'modules': [m]}))
+                     for m in modules]
+        return self._start_job('fill lines', steps)
 
-    def empty_lines(self) -> None:
+    def empty_lines(self) -> PumpJob:
         """
-        empty all of the lines leading to the modules
+        empty all of the lines leading to the modules in the background
         NOTE: this can only work by emptying all lines 
         for all modules associated to the pump on the 
         ratBerryPi side
 
-        TODO: neeed to handle the freezing more gracefully
-        maybe a little loading window?
+        Returns:
+            job: PumpJob
+                the background job or None if another operation is
+                already running on this pump
         """
 
-        self.client.run_command('empty_lines', {}, channel = 'run')
+        return self._start_job('empty lines', [('emptying lines', lambda: self._run_job_command('empty_lines', {}))])
+
+    def _log(self, msg:str) -> None:
+        self.parent.log(msg, raise_event_line = False)
 
     def toggle_auto_fill(self, on:bool = None) -> None:
         """
         toggle whether or not the pumps on the reward interface
-        are in auto-fill mode (i.e. they refill the syringes
+        are in auto-fill mode (i.e. they refill the syringes.
+        the button is updated right away and the command is
+        sent in the background
 
         Args:
             on: bool (optional)
@@ -211,10 +367,7 @@ class PumpConfig(QGroupBox):
                 the opposite of the current state
         """
 
-        on = on if on is not None else not bool(self.client.get(f"auto_fill", channel = 'run'))
-        self.client.run_command('toggle_auto_fill', {'on': on}, channel = 'run')
-        time.sleep(.1)
-        self.auto_fill_btn.setChecked(bool(self.client.get(f"auto_fill", channel = 'run')))
+        self._auto_fill.set(on)
 
     def set_auto_fill_frac_thresh(self, value:float = None) -> None:
         """
@@ -252,7 +405,7 @@ class PumpConfig(QGroupBox):
         }
         self.client.run_command('set_microstep_type', args, channel = 'run')
         self.step_type_select.setCurrentIndex(idx)
-        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = self.pump))
+        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = 'run'))
         self.flow_rate.setText(f"{flow_rate}")
 
     def set_step_speed(self, speed:float=None) -> None:
@@ -266,7 +419,7 @@ class PumpConfig(QGroupBox):
         }
         self.client.run_command('set_step_speed', args, channel = 'run')
         self.step_speed.setText(f"{speed}")
-        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = self.pump))
+        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = 'run'))
         self.flow_rate.setText(f"{flow_rate}")
 
 
@@ -280,9 +433,9 @@ class PumpConfig(QGroupBox):
             'flow_rate': flow_rate
         }
         self.client.run_command('set_flow_rate', args, channel = 'run')
-        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = self.pump))
+        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = 'run'))
         self.flow_rate.setText(f"{flow_rate}")
-        speed = float(self.client.get(f"pumps['{self.pump}'].speed", channel = self.pump))
+        speed = float(self.client.get(f"pumps['{self.pump}'].speed", channel = 'run'))
         self.step_speed.setText(f"{speed}")
 
     def change_syringe(self, syringe_type:str = None) -> None:
@@ -306,18 +459,67 @@ class PumpConfig(QGroupBox):
         }
         self.client.run_command('change_syringe', args, channel = 'run')
         self.syringe_select.setCurrentIndex(idx)
-        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = self.pump))
+        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = 'run'))
         self.flow_rate.setText(f"{flow_rate}")
 
-    def push_to_res(self, amount:float = None) -> None:
+    @property
+    def syringe_type(self) -> str:
         """
-        push a specified amount of fluid to the reservoir
+        name of the selected syringe type
+        """
+        return self.syringe_select.currentText()
+
+    @property
+    def syringe_volume(self) -> float:
+        """
+        capacity in mL of the selected syringe
+        """
+        return syringe_volume(self.syringe_type)
+
+    @property
+    def position(self) -> float:
+        """
+        last known position of the piston in cm, or nan if it is not known yet
+        """
+        value = self.pos_watch.value
+        return float(value) if value is not None else float('nan')
+
+    @property
+    def auto_fill_frac(self) -> float:
+        """
+        fraction of the syringe volume at which the pi refills it
+        """
+        return float(self.auto_fill_thresh.text())
+
+    def fill_syringe(self) -> PumpJob:
+        """
+        refill the syringe from the reservoir in the background
+
+        Returns:
+            job: PumpJob
+                the background job or None if another operation is
+                already running on this pump or the pi cannot fill syringes
+        """
+        if not self.can_fill_syringe:
+            self.parent.log(f"cannot fill syringe on '{self.pump}', the rpi does not support fill_syringe",
+                            raise_event_line = False)
+            return None
+        return self._start_job('fill syringe', [('filling syringe', lambda: self._run_job_command('fill_syringe', {'pump': self.pump}))])
+
+    def push_to_res(self, amount:float = None) -> PumpJob:
+        """
+        push a specified amount of fluid to the reservoir in the background
 
         Args:
             amount: float (optional)
                 amount of fluid to push in mL
                 default behavior is to use the value set in
                 the gui
+
+        Returns:
+            job: PumpJob
+                the background job or None if another operation is
+                already running on this pump
         """
 
         amount = amount if amount is not None else float(self.push_amt.text())
@@ -325,44 +527,40 @@ class PumpConfig(QGroupBox):
             'pump': self.pump,
             'amount': amount
         }
-        self.client.run_command('push_to_reservoir', args, channel = 'run')
-        
-    class RPIPumpPosThread(QThread):
-        """
-        thread to keep track of pump piston position
-
-        ...
-        PyQt Signals
-
-        pos_updated(float)
-        """
-        pos_updated = pyqtSignal(float)
-        def __init__(self, client, pump):
-            super(PumpConfig.RPIPumpPosThread, self).__init__()
-            self.client = client
-            self.pump = pump
-            self.client.new_channel(self.pump)
-            self.pos = None
-
-        def run(self):
-            while True:
-                try:
-                    pos = self.client.get(f"pumps['{self.pump}'].position", channel = self.pump)
-                    if pos != self.pos:
-                        self.pos = pos
-                        self.pos_updated.emit(self.pos)
-                except ValueError as e:
-                    print(f"invalid position read on '{self.pump}'")
-                finally:
-                    time.sleep(.1)
-        
+        return self._start_job('push to reservoir',
+                               [(f"pushing {amount} mL", lambda: self._run_job_command('push_to_reservoir', args))])
+
 
 class RPIRewardControl(RewardWidget):
     """
     A widget for controlling ratBerryPi reward modules remotely through a client.
+    if the field ASYNC_REWARDS of the parent's rpi_config is true, trigger_reward
+    returns immediately and the reward is sent from a background thread. rewards
+    prepared with arm_reward are sent with less delay, and the time from
+    triggering each reward to the pi acknowledging it is kept in
+    reward_latencies (see reward_latency) so armed and unarmed rewards
+    can be compared
+
+    ...
+    PyQt Signals
+
+    new_licks(int)
+        number of new licks detected on the module
+    reward_acked(float, float, float)
+        amount of a reward, time it was triggered and time the pi
+        acknowledged it in seconds since the epoch
+    reward_failed(float, str)
+        amount of a reward which failed and the error reported
     """
 
     new_licks = pyqtSignal(int)
+    reward_acked = pyqtSignal(float, float, float)
+    reward_failed = pyqtSignal(float, str)
+    _fired = pyqtSignal(float, float, float, str)
+    _cue_played = pyqtSignal(str, str)
+
+    # time between reads of the lick count in seconds
+    lick_poll_interval = 0.005
 
     def __init__(self, client, module, parent):
         super(RPIRewardControl, self).__init__()
@@ -370,6 +568,22 @@ class RPIRewardControl(RewardWidget):
         self.module = module
         self.client = client
         self.parent = parent
+        self._render = RenderThrottle.shared()
+        self.async_rewards = bool(getattr(parent, 'rpi_config', {}).get('ASYNC_REWARDS', False))
+        self.amount_dispensed = 0.
+        self.n_pulses = 0
+        self.reward_latencies = {'armed_trigger_to_ack': [], 'unarmed_trigger_to_ack': []}
+        self._dispatcher = None
+        self._dispatched_armed = deque()
+        self._armed = None
+        self._stage_on_pi = True
+        self._commands = CommandDispatcher.for_client(self.client)
+        self._commands.replied.connect(self._staged)
+        self._fired.connect(self._fire_replied)
+        self.cues = {}
+        self._cue_requests = {}
+        self._cues_on_pi = True
+        self._cue_played.connect(self._cue_replied)
 
         self.setTitle(self.module)
         vlayout = QVBoxLayout()
@@ -379,8 +593,8 @@ class RPIRewardControl(RewardWidget):
         pump_row = QHBoxLayout()
         pump_lbl = QLabel("Pump")
         pump_lbl.setFixedWidth(40)
-        pump_name = self.client.get(f"modules['{self.module}'].pump.name", channel='run')
-        pump_le = QLineEdit(pump_name)
+        self.pump = self.client.get(f"modules['{self.module}'].pump.name", channel='run')
+        pump_le = QLineEdit(self.pump)
         pump_le.setEnabled(False)
         pump_row.addWidget(pump_lbl)
         pump_row.addWidget(pump_le)
@@ -403,9 +617,10 @@ class RPIRewardControl(RewardWidget):
         lick_group.setLayout(lick_vlayout)
         vlayout.addWidget(lick_group)
 
-        self.lick_thread = RPIRewardControl.RPILickThread(self.client, self.module)
-        self.lick_thread.lick_num_updated.connect(self._update_licks)
-        self.lick_thread.start()
+        self._polled_licks = self.lick_count_n
+        self.lick_watch = StatePoller.for_client(self.client).watch(f"modules['{self.module}'].lickometer.licks",
+                                                                    self.lick_poll_interval)
+        self.lick_watch.updated.connect(self._licks_polled)
 
         # ── Session stats ──────────────────────────────────────────────
         stats_group = QGroupBox()
@@ -512,14 +727,14 @@ class RPIRewardControl(RewardWidget):
         self.led_btn = QPushButton("LED")
         self.led_btn.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.led_btn.setCheckable(True)
-        init_led = bool(self.client.get(f"modules['{self.module}'].LED.on", channel='run'))
-        self.led_btn.setChecked(init_led)
+        self._led = RemoteToggle(self.client, self.led_btn, f"modules['{self.module}'].LED.on", 'toggle_LED',
+                                 lambda on: {'module': self.module, 'on': on}, self._log)
         self.led_btn.clicked.connect(self.toggle_led)
         self.valve_btn = QPushButton("Valve")
         self.valve_btn.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.valve_btn.setCheckable(True)
-        init_valve = bool(self.client.get(f"modules['{self.module}'].valve.is_open", channel='run'))
-        self.valve_btn.setChecked(init_valve)
+        self._valve = RemoteToggle(self.client, self.valve_btn, f"modules['{self.module}'].valve.is_open",
+                                   'toggle_valve', lambda on: {'module': self.module, 'open_valve': on}, self._log)
         self.valve_btn.clicked.connect(self.toggle_valve)
         for btn in (pulse_btn, small_pulse_btn, tone_btn, self.led_btn, self.valve_btn):
             clayout.addWidget(btn)
@@ -528,14 +743,77 @@ class RPIRewardControl(RewardWidget):
         vlayout.addWidget(ctrl_group)
         self.setLayout(vlayout)
 
+    @property
+    def led_on(self) -> bool:
+        """
+        whether the led on this module is on. this is served from the
+        client's cache when the client caches attributes
+        """
+        return bool(self.client.get(f"modules['{self.module}'].LED.on", channel = 'run'))
+
+    @property
+    def valve_open(self) -> bool:
+        """
+        whether the valve on this module is open. this is served from the
+        client's cache when the client caches attributes
+        """
+        return bool(self.client.get(f"modules['{self.module}'].valve.is_open", channel = 'run'))
+
     def reset_amount_dispensed(self):
-        self.amt_disp.setText(f"{0}")
-        self.npulse.setText(f"{0}")
-    
+        self.amount_dispensed = 0.
+        self.n_pulses = 0
+        self._render.set_text(self.amt_disp, f"{0}")
+        self._render.set_text(self.npulse, f"{0}")
+
+    def _count_reward(self, amount:float) -> None:
+        self.amount_dispensed += amount
+        self.n_pulses += 1
+        self._render.set_text(self.amt_disp, f"{self.amount_dispensed:g}")
+        self._render.set_text(self.npulse, f"{self.n_pulses}")
+        # only delivered rewards count towards the syringe forecast
+        scheduler = getattr(self.parent, 'refill_scheduler', None)
+        if scheduler is not None:
+            scheduler.record(self.module, amount)
+
+    def _reward_acked(self, module:str, amount:float, t_dispatch:float, t_ack:float) -> None:
+        if module != self.module:
+            return
+        self._acked(amount, t_dispatch, t_ack, self._dispatched_armed.popleft())
+
+    def _reward_failed(self, module:str, amount:float, status:str) -> None:
+        if module != self.module:
+            return
+        self._dispatched_armed.popleft()
+        self._failed(amount, status)
+
+    def _acked(self, amount:float, t_dispatch:float, t_ack:float, armed:bool) -> None:
+        self.reward_latencies['armed_trigger_to_ack' if armed else 'unarmed_trigger_to_ack'].append(t_ack - t_dispatch)
+        self._count_reward(amount)
+        self.reward_acked.emit(amount, t_dispatch, t_ack)
+
+    def _failed(self, amount:float, status:str) -> None:
+        self.parent.log(f"{amount} mL reward on {self.module} failed: {status}", raise_event_line = False)
+        self.reward_failed.emit(amount, status)
+
+    def reward_latency(self) -> dict:
+        """
+        number of armed and unarmed rewards acknowledged by the pi
+        and the median time from trigger to acknowledgement in ms
+        """
+
+        return {kind: (len(lat), statistics.median(lat) * 1000 if lat else float('nan'))
+                for kind, lat in self.reward_latencies.items()}
+
+    def _licks_polled(self, licks):
+        licks = int(licks)
+        amt, self._polled_licks = licks - self._polled_licks, licks
+        if amt != 0:
+            self._update_licks(amt)
+
     def _update_licks(self, amt):
         if amt > 0: self.new_licks.emit(amt)
         self.lick_count_n += amt
-        self.lick_count.setText(f"{self.lick_count_n}")
+        self._render.set_text(self.lick_count, f"{self.lick_count_n}")
 
     def _single_pulse(self):
         amt = float(self.amt.text())
@@ -597,52 +875,174 @@ class RPIRewardControl(RewardWidget):
         if not status=='SUCCESS\n':
             print('error status', status)
 
+    def preload_tone(self, name:str, freq:float, dur:float, volume:float) -> None:
+        """
+        register a tone which can then be played by name with play_cue. the pi
+        is asked to synthesize the tone once and keep it (preload_tone) so it
+        starts playing with less delay. if the pi does not support preloading,
+        the play_tone command for the cue is instead serialized ahead of time
+
+        Args:
+            name: str
+                name to play the tone by
+            freq: float
+                tone frequency in Hz
+            dur: float
+                duration of the tone in seconds
+            volume: float
+                fraction of max volume to play the tone at.
+                this value should be between 0 and 1
+        """
+
+        tone = {'module': self.module, 'freq': freq, 'dur': dur, 'volume': volume}
+        self.cues[name] = tone
+        self._cue_requests[name] = (wire.prepare_request('play_cue', {'module': self.module, 'name': name}),
+                                    wire.prepare_request('play_tone', tone))
+        if self._cues_on_pi:
+            self._preload_on_pi(name)
+
+    def _preload_on_pi(self, name:str) -> None:
+        status = self.client.run_command('preload_tone', {**self.cues[name], 'name': name}, channel = 'run')
+        if status not in (wire.SUCCESS, wire.BUFFERED):
+            self._cues_on_pi = False
+            self._log(f"rpi could not preload tones on {self.module} ({status.strip()}), "
+                      "tones will be synthesized when played")
+
+    def play_cue(self, name:str) -> None:
+        """
+        play a tone registered with preload_tone
+
+        Args:
+            name: str
+                name the tone was registered with
+        """
+
+        on_pi = self._cues_on_pi
+        prepared = self._cue_requests[name][0 if on_pi else 1]
+        submit = getattr(self.client, 'submit_prepared', None)
+        if submit is not None and getattr(self.client, 'connected', True):
+            submit(prepared).add_done_callback(lambda f: self._cue_played.emit(name, self._result(f)))
+            return
+        if on_pi:
+            status = self.client.run_command('play_cue', {'module': self.module, 'name': name}, channel = 'run')
+        else:
+            status = self.client.run_command('play_tone', self.cues[name], channel = 'run')
+        self._cue_replied(name, status)
+
+    def _cue_replied(self, name:str, status:str) -> None:
+        if status == wire.SUCCESS:
+            return
+        if not self._cues_on_pi:
+            print('error status', status)
+            return
+        # the pi may have lost its cues (e.g. if it was restarted),
+        # so load the cue again and play it the slow way this time
+        self._log(f"failed to play cue '{name}' on {self.module} ({status.strip()}), preloading it again")
+        self._preload_on_pi(name)
+        tone = self.cues[name]
+        self.play_tone(tone['freq'], tone['volume'], tone['dur'])
+
+    def _log(self, msg:str) -> None:
+        self.parent.log(msg, raise_event_line = False)
+
     def toggle_led(self, on:bool = None) -> None:
         """
         toggle the led. by default the led is toggled
         to the opposite of it's current state 
-        (i.e. turned off if on and vice versa)
+        (i.e. turned off if on and vice versa). the button
+        is updated right away and the command is sent in
+        the background
 
         Args:
             on: bool (optional)
                 whether to turn the led on 
         """
 
-        if on is None:
-            led_state = bool(self.client.get(f"modules['{self.module}'].LED.on", channel = 'run'))
-            on = not led_state
-        
-        args = {'module': self.module,
-                'on': on}
-        status = self.client.run_command('toggle_LED', args, channel = 'run')
-        if not status=='SUCCESS\n': print('error status', status)
-        led_state = bool(self.client.get(f"modules['{self.module}'].LED.on", channel = 'run'))
-        self.led_btn.setChecked(led_state)
+        self._led.set(on)
 
     def toggle_valve(self, open_valve:bool = None):
         """
         toggle the state of the valve. by default the valve
         is toggled to the opposite of its current state
-        (i.e. opened if closed and vice versa)
+        (i.e. opened if closed and vice versa). the button
+        is updated right away and the command is sent in
+        the background
 
         Args:
             open_valve: bool (optional)
                 whether to open the valve
         """
 
-        if open_valve is None:
-            valve_state = bool(self.client.get(f"modules['{self.module}'].valve.is_open", channel = 'run'))
-            open_valve = not valve_state
-        args = {'module': self.module,
-                'open_valve': open_valve}
-        status = self.client.run_command('toggle_valve', args, channel = 'run')
-        if not status=='SUCCESS\n': print('error status', status)
-        valve_state = bool(self.client.get(f"modules['{self.module}'].valve.is_open", channel = 'run'))
-        self.valve_btn.setChecked(valve_state)
+        self._valve.set(open_valve)
         
-    def trigger_reward(self, amount:float, force:bool = True, enqueue:bool = False) -> None:
+    def arm_reward(self, amount:float, force:bool = True, enqueue:bool = False) -> None:
         """
-        trigger a reward of a specified amount
+        prepare a reward so that the next call to trigger_reward with the same
+        arguments is sent with as little delay as possible (e.g. call this on
+        entering the state in which the reward may be earned). the command is
+        serialized ahead of time and the pi is asked to set up the pump
+        (arm_reward). the valve stays closed until the reward is triggered so
+        fluid pushed by other modules on the same pump cannot leak into this
+        line. if the pi does not support arming only the command is prepared.
+        the reward is disarmed once it is triggered
+
+        Args:
+            amount: float
+                amount of reward to deliver in mL
+            force: bool (optional)
+                see trigger_reward
+            enqueue: bool (optional)
+                see trigger_reward
+        """
+
+        args = {'module': self.module,
+                'amount': amount,
+                'force': force,
+                'enqueue': enqueue}
+        self._armed = (args, wire.prepare_request('trigger_reward', args))
+        if self._stage_on_pi:
+            self._commands.send('arm_reward', args)
+
+    def disarm_reward(self) -> None:
+        """
+        drop the reward prepared with arm_reward
+        """
+
+        if self._armed is None:
+            return
+        self._armed = None
+        if self._stage_on_pi:
+            self._commands.send('disarm_reward', {'module': self.module})
+
+    def _staged(self, command:str, args:dict, status:str, t_dispatch:float, t_reply:float) -> None:
+        if command not in ('arm_reward', 'disarm_reward') or args.get('module') != self.module:
+            return
+        if status not in (wire.SUCCESS, wire.BUFFERED) and self._stage_on_pi:
+            self._stage_on_pi = False
+            self._log(f"rpi could not arm rewards on {self.module} ({status.strip()}), "
+                      "rewards will only be prepared locally")
+
+    @staticmethod
+    def _result(fut, timeout:float = None) -> str:
+        try:
+            return fut.result(timeout)
+        except Exception as e:
+            # a request that timed out is cancelled so its late reply is dropped
+            fut.cancel()
+            return f"ERROR: {e}"
+
+    def _fire_replied(self, amount:float, t_dispatch:float, t_reply:float, status:str) -> None:
+        if status == wire.SUCCESS:
+            self._acked(amount, t_dispatch, t_reply, True)
+        else:
+            self._failed(amount, status.strip())
+
+    def trigger_reward(self, amount:float, force:bool = True, enqueue:bool = False, block:bool = None) -> None:
+        """
+        trigger a reward of a specified amount. the volume and pulse
+        counters are updated once the pi acknowledges the reward. if a
+        reward with the same arguments was armed with arm_reward the
+        prepared command is sent
 
         Args: 
             amount: float
@@ -656,49 +1056,46 @@ class RPIRewardControl(RewardWidget):
                 that is using this module's pump, when set to True,
                 this argument allows the user to enqueue this reward 
                 delivery until after the currently running task is finished
+            block: bool (optional)
+                whether to wait for the pi to acknowledge the reward. if False
+                the reward is sent from a background thread and reward_acked or
+                reward_failed is emitted once the pi replies. defaults to the
+                opposite of ASYNC_REWARDS
         """
 
+        block = block if block is not None else not self.async_rewards
         args = {'module': self.module, 
                 'amount': amount,
                 'force': force,
                 'enqueue' : enqueue}
+        armed = self._armed is not None and self._armed[0] == args
+        if armed:
+            prepared, self._armed = self._armed[1], None
+            submit = getattr(self.client, 'submit_prepared', None)
+            # the prepared command can only be sent as is by pipelining clients
+            if submit is not None and getattr(self.client, 'connected', True):
+                t_dispatch = time.time()
+                fut = submit(prepared)
+                if block:
+                    status = self._result(fut, getattr(self.client, 'timeout', None))
+                    self._fire_replied(amount, t_dispatch, time.time(), status)
+                else:
+                    fut.add_done_callback(lambda f: self._fired.emit(amount, t_dispatch, time.time(),
+                                                                     self._result(f)))
+                return
+
+        if not block:
+            if self._dispatcher is None:
+                self._dispatcher = RewardDispatcher.for_client(self.client)
+                self._dispatcher.acked.connect(self._reward_acked)
+                self._dispatcher.failed.connect(self._reward_failed)
+            self._dispatched_armed.append(armed)
+            self._dispatcher.dispatch(self.module, amount, force, enqueue)
+            return
+
+        t_dispatch = time.time()
         status = self.client.run_command("trigger_reward", args, channel = 'run')
-        if not status=='SUCCESS\n':
-            print('error status', status)
-        self.amt_disp.setText(f"{float(self.amt_disp.text()) + amount}")
-        self.npulse.setText(f"{float(self.npulse.text()) + 1}")
-
-    class RPILickThread(QThread):
-        """
-        thread to monitor licks on the pi
-
-        ...
-        PyQt Signals
-
-        lick_num_updated(int)
-
-        """
-
-        lick_num_updated = pyqtSignal(int)
-        
-        def __init__(self, client, module):
-            super(RPIRewardControl.RPILickThread, self).__init__()
-            self.client = client
-            self.module = module
-            self.client.new_channel(f"{self.module}_licks")
-        
-        def run(self):
-            prev_licks = int(self.client.get(f"modules['{self.module}'].lickometer.licks",
-                                                channel = f"{self.module}_licks"))
-            while True:
-                try:
-                    licks = int(self.client.get(f"modules['{self.module}'].lickometer.licks",
-                                                channel = f"{self.module}_licks"))
-                    if licks!=prev_licks:
-                        self.lick_num_updated.emit(licks - prev_licks)
-                        prev_licks = licks
-                except ValueError as e:
-                    print(f"invalid read on '{self.module}'")
-                    raise e
-                finally:
-                    time.sleep(.005)
\ No newline at end of file
+        if status == 'SUCCESS\n':
+            self._acked(amount, t_dispatch, time.time(), armed)
+        else:
+            self._failed(amount, status.strip())
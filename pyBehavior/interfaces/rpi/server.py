@@ -0,0 +1,516 @@
+"""
+lightweight stand-in for the ratBerryPi server
+
+the server keeps an in-memory model of the pumps and reward modules on a
+ratBerryPi and answers requests using the message format described in
+pyBehavior.interfaces.rpi.wire. licks are generated at configurable rates,
+pumps move at their flow rate, network latency can be simulated and
+recordings are written to a local directory. it is intended for developing
+GUIs and benchmarking the remote interface without access to a pi. the
+server can run in process (StandInServer), in a subprocess
+(SubprocessServer) or from the command line with pyBehavior-rpi-server.
+"""
+
+import argparse
+import ast
+import asyncio
+import inspect
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing
+from pathlib import Path
+from types import SimpleNamespace
+from pyBehavior.interfaces.rpi import wire
+from pyBehavior.interfaces.rpi.refill import syringe_area
+
+
+class StandInState:
+    """
+    in-memory model of the attributes of a ratBerryPi reward interface
+    that pyBehavior reads. attributes are addressed with the same paths
+    used on the pi (e.g. "modules['module1'].lickometer.licks")
+    """
+
+    def __init__(self, n_modules:int = 4, n_pumps:int = 1):
+        self.pumps = {}
+        for i in range(n_pumps):
+            name = f"pump{i+1}"
+            self.pumps[name] = SimpleNamespace(name = name, position = 0., speed = 1000.,
+                                               flow_rate = 0.5, stepType = 'Full',
+                                               syringe = SimpleNamespace(syringeType = 'BD5mL'))
+        self.modules = {}
+        for i in range(n_modules):
+            name = f"module{i+1}"
+            self.modules[name] = SimpleNamespace(name = name,
+                                                 pump = self.pumps[f"pump{i % n_pumps + 1}"],
+                                                 post_delay = 0.5,
+                                                 lickometer = SimpleNamespace(licks = 0),
+                                                 LED = SimpleNamespace(on = False),
+                                                 valve = SimpleNamespace(is_open = False))
+        self.auto_fill = False
+        self.auto_fill_frac_thresh = 0.1
+        self.recording = False
+        self.data_path = ''
+
+    def resolve(self, path:str):
+        """
+        evaluate an attribute path against this state. only attribute
+        access and subscripting with literals are allowed
+        """
+
+        def _eval(node):
+            if isinstance(node, ast.Name):
+                return getattr(self, node.id)
+            elif isinstance(node, ast.Attribute):
+                return getattr(_eval(node.value), node.attr)
+            elif isinstance(node, ast.Subscript):
+                return _eval(node.value)[ast.literal_eval(node.slice)]
+            raise ValueError(f"unsupported request '{path}'")
+
+        return _eval(ast.parse(path, mode = 'eval').body)
+
+
+class StandInServer:
+    """
+    asyncio server answering ratBerryPi requests from a StandInState.
+    the server runs its event loop in a background thread.
+
+    Args:
+        host: str
+            address to serve on
+        port: int
+            port to serve on. if 0 a free port is chosen
+        state: StandInState (optional)
+            state to serve. a default state is created if not provided
+        latency: float (optional)
+            round trip network latency to simulate in seconds
+        jitter: float (optional)
+            maximum random delay in seconds added to the latency of each reply
+        lick_rate: float or dict (optional)
+            mean rate in Hz at which licks are generated on each module.
+            may be a dict mapping module names to rates. licks are
+            generated as a poisson process
+        data_root: str (optional)
+            directory in which to create recordings. a directory in the
+            system temporary directory is used if not provided
+        tick: float (optional)
+            interval in seconds at which licks and pump movement are simulated
+        reward_setup: float (optional)
+            time in seconds the pi takes to configure the stepper before a
+            reward that was not armed with arm_reward. this is an assumed cost,
+            not one measured on a pi
+        tone_render: float (optional)
+            time in seconds the pi takes to synthesize each second of a tone.
+            the actual time varies randomly by up to 50% per tone. tones
+            preloaded with preload_tone are played without synthesizing them.
+            like reward_setup this is an assumed cost, not one measured on a pi
+        clock_offset: float (optional)
+            offset in seconds of the simulated pi clock from the clock on this
+            machine. the pi clock is used to answer get_time and to stamp recordings
+        clock_drift: float (optional)
+            rate in s/s at which the simulated pi clock gains on this machine's clock
+
+    Attributes:
+        flows (list):
+            (time, module, amount, armed) for every reward, where time is
+            when fluid started to flow in seconds since the epoch
+        tones (list):
+            (time, module, freq, preloaded) for every tone, where time is
+            when the tone started playing in seconds since the epoch
+    """
+
+    def __init__(self, host:str = '127.0.0.1', port:int = 0, state:StandInState = None,
+                 latency:float = 0., jitter:float = 0., lick_rate:typing.Union[float, dict] = 0.,
+                 data_root:str = None, tick:float = 0.005, reward_setup:float = 0.,
+                 tone_render:float = 0., clock_offset:float = 0., clock_drift:float = 0.):
+        self.host = host
+        self.port = port
+        self.state = state if state is not None else StandInState()
+        self.latency = latency
+        self.jitter = jitter
+        self.lick_rate = lick_rate
+        self.data_root = Path(data_root if data_root is not None else Path(tempfile.gettempdir())/"ratBerryPi_standin")
+        self.tick = tick
+        self.reward_setup = reward_setup
+        self.tone_render = tone_render
+        self.clock_offset = clock_offset
+        self.clock_drift = clock_drift
+        self._clock_start = time.time()
+        self.n_requests = 0
+        self.flows = []
+        self.tones = []
+        self._armed = {}
+        self._cues = {}
+        self._moves = {}
+        self._next_lick = {}
+        self._events = None
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def start(self) -> None:
+        """
+        start serving in a background thread
+        """
+
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            self._loop.create_task(self._simulate())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target = serve, daemon = True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self) -> None:
+        """
+        stop the server
+        """
+
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._close_recording()
+
+    async def _shutdown(self) -> None:
+        self._server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+
+    async def _handle_connection(self, reader, writer) -> None:
+        loop = asyncio.get_running_loop()
+        # replies must leave in the order their requests arrived, so a reply
+        # is never scheduled before the previous one on the same connection
+        last_send = 0.
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    command, args, req_id = wire.decode_request(line)
+                except (ValueError, KeyError):
+                    req_id = None
+                    reply = "ERROR: malformed request"
+                else:
+                    try:
+                        reply = await self.handle(command, args)
+                    except Exception as e:
+                        reply = f"ERROR: {e}"
+                data = wire.encode_reply(reply, req_id)
+                delay = self.latency + (random.uniform(0, self.jitter) if self.jitter > 0 else 0.)
+                if delay > 0:
+                    last_send = max(loop.time() + delay, last_send)
+                    loop.call_at(last_send, self._send, writer, data)
+                else:
+                    self._send(writer, data)
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _send(writer, data:bytes) -> None:
+        if not writer.is_closing():
+            writer.write(data)
+
+    async def handle(self, command:str, args:dict) -> str:
+        """
+        run a command against the state and return the reply text. commands
+        that take time on the pi (e.g. filling lines) only reply once done
+        """
+
+        self.n_requests += 1
+        if command == 'GET':
+            # reading a command name (e.g. fill_syringe) checks that the interface implements it
+            if args['req'].isidentifier() and hasattr(self, f"_cmd_{args['req']}"):
+                return f"<bound method RewardInterface.{args['req']}>"
+            return f"{self.state.resolve(args['req'])}"
+        handler = getattr(self, f"_cmd_{command}", None)
+        if handler is None:
+            return f"ERROR: unknown command '{command}'"
+        res = handler(**args)
+        if inspect.isawaitable(res):
+            res = await res
+        # commands which answer with a value return its text
+        return res if isinstance(res, str) else wire.SUCCESS
+
+    def pi_time(self) -> float:
+        """
+        current time on the simulated pi clock in seconds since the epoch
+        """
+
+        t = time.time()
+        return t + self.clock_offset + self.clock_drift * (t - self._clock_start)
+
+    def _rate(self, module:str) -> float:
+        if isinstance(self.lick_rate, dict):
+            return self.lick_rate.get(module, 0.)
+        return self.lick_rate
+
+    async def _simulate(self) -> None:
+        loop = asyncio.get_running_loop()
+        last = loop.time()
+        while True:
+            await asyncio.sleep(self.tick)
+            now = loop.time()
+            dt, last = now - last, now
+            for name, module in self.state.modules.items():
+                rate = self._rate(name)
+                if rate <= 0:
+                    self._next_lick.pop(name, None)
+                    continue
+                if name not in self._next_lick:
+                    self._next_lick[name] = now + random.expovariate(rate)
+                while self._next_lick[name] <= now:
+                    module.lickometer.licks += 1
+                    self._log_event(name, 'lick', module.lickometer.licks)
+                    self._next_lick[name] += random.expovariate(rate)
+            for name in list(self._moves):
+                pump = self.state.pumps[name]
+                remaining, done = self._moves[name]
+                # position is tracked as the piston travel in cm since the syringe was filled
+                step = min(abs(remaining), dt * pump.flow_rate / syringe_area(pump.syringe.syringeType))
+                step = step if remaining > 0 else -step
+                pump.position += step
+                remaining -= step
+                if abs(remaining) < 1e-12:
+                    del self._moves[name]
+                    done.set_result(None)
+                else:
+                    self._moves[name] = (remaining, done)
+
+    def _move(self, pump:str, amount:float) -> asyncio.Future:
+        """
+        start moving a pump to dispense an amount of fluid in mL. a negative
+        amount withdraws fluid. the returned future completes once every
+        pending movement of the pump is done
+        """
+
+        p = self.state.pumps[pump]
+        delta = amount / syringe_area(p.syringe.syringeType)
+        if pump in self._moves:
+            remaining, done = self._moves[pump]
+        else:
+            remaining, done = 0., asyncio.get_running_loop().create_future()
+        self._moves[pump] = (remaining + delta, done)
+        return asyncio.shield(done)
+
+    def _log_event(self, module:str, event:str, value) -> None:
+        if self._events is not None:
+            self._events.write(f"{self.pi_time()},{module},{event},{value}\n")
+            self._events.flush()
+
+    def _close_recording(self) -> None:
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+
+    async def _cmd_trigger_reward(self, module:str, amount:float, force:bool = True, enqueue:bool = False) -> None:
+        armed = self._armed.pop(module, None) == (amount, force, enqueue)
+        if not armed and self.reward_setup > 0:
+            await asyncio.sleep(self.reward_setup)
+        self.flows.append((time.time(), module, amount, armed))
+        self._move(self.state.modules[module].pump.name, amount)
+        self._log_event(module, 'reward', amount)
+
+    def _cmd_arm_reward(self, module:str, amount:float, force:bool = True, enqueue:bool = False) -> None:
+        # only the pump is set up, the valve opens once the reward is triggered
+        self._armed[module] = (amount, force, enqueue)
+
+    def _cmd_disarm_reward(self, module:str) -> None:
+        self._armed.pop(module, None)
+
+    def _cmd_reset_licks(self, module:str) -> None:
+        self.state.modules[module].lickometer.licks = 0
+
+    def _cmd_update_post_delay(self, module:str, post_delay:float) -> None:
+        self.state.modules[module].post_delay = post_delay
+
+    async def _render(self, dur:float) -> None:
+        if self.tone_render > 0:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.tone_render * dur)
+
+    def _play(self, module:str, freq:float, preloaded:bool) -> None:
+        self.tones.append((time.time(), module, freq, preloaded))
+        self._log_event(module, 'tone', freq)
+
+    async def _cmd_play_tone(self, module:str, freq:float, dur:float, volume:float) -> None:
+        await self._render(dur)
+        self._play(module, freq, False)
+
+    async def _cmd_preload_tone(self, module:str, name:str, freq:float, dur:float, volume:float) -> None:
+        await self._render(dur)
+        self._cues[(module, name)] = (freq, dur, volume)
+
+    def _cmd_play_cue(self, module:str, name:str) -> None:
+        if (module, name) not in self._cues:
+            raise ValueError(f"no cue named '{name}' on {module}")
+        self._play(module, self._cues[(module, name)][0], True)
+
+    def _cmd_toggle_LED(self, module:str, on:bool) -> None:
+        self.state.modules[module].LED.on = on
+        self._log_event(module, 'LED', on)
+
+    def _cmd_toggle_valve(self, module:str, open_valve:bool) -> None:
+        self.state.modules[module].valve.is_open = open_valve
+        self._log_event(module, 'valve', open_valve)
+
+    async def _cmd_calibrate(self, pump:str) -> None:
+        await self._move(pump, -self.state.pumps[pump].position *
+                         syringe_area(self.state.pumps[pump].syringe.syringeType))
+
+    async def _cmd_fill_lines(self, modules:list = None) -> None:
+        modules = modules if modules is not None else list(self.state.modules)
+        for m in modules:
+            await self._move(self.state.modules[m].pump.name, 0.1)
+
+    async def _cmd_empty_lines(self) -> None:
+        await asyncio.gather(*[self._move(p, 0.1 * len([m for m in self.state.modules.values()
+                                                        if m.pump.name == p]))
+                               for p in self.state.pumps])
+
+    async def _cmd_push_to_reservoir(self, pump:str, amount:float) -> None:
+        await self._move(pump, amount)
+
+    async def _cmd_fill_syringe(self, pump:str) -> None:
+        p = self.state.pumps[pump]
+        await self._move(pump, -p.position * syringe_area(p.syringe.syringeType))
+
+    def _cmd_toggle_auto_fill(self, on:bool) -> None:
+        self.state.auto_fill = on
+
+    def _cmd_set_auto_fill_frac_thresh(self, value:float) -> None:
+        self.state.auto_fill_frac_thresh = value
+
+    def _cmd_set_microstep_type(self, pump:str, stepType:str) -> None:
+        self.state.pumps[pump].stepType = stepType
+
+    def _cmd_set_step_speed(self, pump:str, speed:float) -> None:
+        self.state.pumps[pump].speed = speed
+
+    def _cmd_set_flow_rate(self, pump:str, flow_rate:float) -> None:
+        self.state.pumps[pump].flow_rate = flow_rate
+
+    def _cmd_change_syringe(self, pump:str, syringeType:str) -> None:
+        self.state.pumps[pump].syringe.syringeType = syringeType
+
+    def _cmd_get_time(self) -> str:
+        return f"{self.pi_time():.6f}"
+
+    def _cmd_record(self) -> None:
+        self._close_recording()
+        path = self.data_root/time.strftime("%Y_%m_%d_%H_%M_%S")
+        path.mkdir(parents = True, exist_ok = True)
+        self._events = open(path/"events.csv", 'w')
+        self._events.write("time,module,event,value\n")
+        self.state.recording = True
+        self.state.data_path = path.as_posix()
+
+    def _cmd_stop_recording(self) -> None:
+        self._close_recording()
+        self.state.recording = False
+
+
+class SubprocessServer:
+    """
+    StandInServer running in a separate python process, which keeps the
+    load of simulating the pi off the process being tested or benchmarked.
+    the process is started with the same arguments as pyBehavior-rpi-server
+
+    Args:
+        **kwargs:
+            options of pyBehavior-rpi-server (e.g. modules = 16, latency = 0.002)
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.host = kwargs.get('host', '127.0.0.1')
+        self.port = kwargs.get('port', 0)
+        self._proc = None
+
+    def start(self) -> None:
+        """
+        start the server process and wait until it is listening
+        """
+
+        cmd = [sys.executable, '-m', 'pyBehavior.interfaces.rpi.server']
+        for k, v in {**self.kwargs, 'host': self.host, 'port': self.port}.items():
+            cmd += [f"--{k.replace('_', '-')}", f"{v}"]
+        self._proc = subprocess.Popen(cmd, stdout = subprocess.PIPE, text = True)
+        line = self._proc.stdout.readline()
+        if not line:
+            raise RuntimeError("stand-in ratBerryPi server failed to start")
+        self.host, port = line.split()[-1].rsplit(':', 1)
+        self.port = int(port)
+
+    def stop(self) -> None:
+        """
+        stop the server process
+        """
+
+        if self._proc is None:
+            return
+        self._proc.terminate()
+        self._proc.wait()
+        self._proc.stdout.close()
+        self._proc = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "run a stand-in ratBerryPi server")
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 5562,
+                        help = "port to serve on. 0 picks a free port")
+    parser.add_argument('--modules', type = int, default = 4, help = "number of reward modules")
+    parser.add_argument('--pumps', type = int, default = 1, help = "number of pumps")
+    parser.add_argument('--latency', type = float, default = 0., help = "simulated network latency [s]")
+    parser.add_argument('--jitter', type = float, default = 0., help = "maximum random extra latency [s]")
+    parser.add_argument('--lick-rate', type = float, default = 0., help = "mean lick rate per module [Hz]")
+    parser.add_argument('--data-root', default = None, help = "directory to write recordings to")
+    parser.add_argument('--reward-setup', type = float, default = 0.,
+                        help = "simulated time to set up a reward that was not armed [s]")
+    parser.add_argument('--clock-offset', type = float, default = 0.,
+                        help = "offset of the simulated pi clock [s]")
+    parser.add_argument('--clock-drift', type = float, default = 0.,
+                        help = "drift of the simulated pi clock [s/s]")
+    parser.add_argument('--tone-render', type = float, default = 0.,
+                        help = "simulated time to synthesize each second of a tone [s]")
+    args = parser.parse_args()
+
+    server = StandInServer(host = args.host, port = args.port,
+                           state = StandInState(n_modules = args.modules, n_pumps = args.pumps),
+                           latency = args.latency, jitter = args.jitter,
+                           lick_rate = args.lick_rate, data_root = args.data_root,
+                           reward_setup = args.reward_setup, tone_render = args.tone_render,
+                           clock_offset = args.clock_offset, clock_drift = args.clock_drift)
+    server.start()
+    print(f"listening on {server.host}:{server.port}", flush = True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+pool of reusable ssh connections to remote ratBerryPis
+"""
+
+import paramiko
+import threading
+import typing
+
+
+class SSHSessionPool:
+    """
+    pool of ssh connections keyed by host and username. connections are
+    opened lazily the first time they are needed and reused afterwards.
+    each connection is health-checked before it is handed out and is
+    transparently replaced if it has gone stale
+
+    Args:
+        compress: bool (optional)
+            whether to compress traffic on new connections
+        keepalive: int (optional)
+            interval in seconds at which to send keepalive packets
+            on idle connections. 0 disables keepalives
+    """
+
+    def __init__(self, compress:bool = True, keepalive:int = 30):
+        self.compress = compress
+        self.keepalive = keepalive
+        self.n_connects = 0
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _healthy(client:paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        try:
+            transport.send_ignore()
+        except (paramiko.SSHException, OSError, EOFError):
+            return False
+        return True
+
+    def _connect(self, host:str, username:str) -> paramiko.SSHClient:
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(host, username = username, look_for_keys = True, compress = self.compress)
+        if self.keepalive > 0:
+            client.get_transport().set_keepalive(self.keepalive)
+        self.n_connects += 1
+        return client
+
+    def get(self, host:str, username:str) -> paramiko.SSHClient:
+        """
+        get a healthy connection to a host, connecting if needed
+
+        Args:
+            host: str
+                hostname of the pi
+            username: str
+                user to log in as
+        """
+
+        key = (host, username)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None and not self._healthy(client):
+                client.close()
+                client = None
+            if client is None:
+                client = self._connect(host, username)
+                self._clients[key] = client
+            return client
+
+    def open_sftp(self, host:str, username:str) -> paramiko.SFTPClient:
+        """
+        open an sftp session over a pooled connection
+        """
+        return self.get(host, username).open_sftp()
+
+    def exec_command(self, host:str, username:str, command:str,
+                     timeout:float = None) -> typing.Tuple[int, str, str]:
+        """
+        run a shell command on a host over a pooled connection
+
+        Returns:
+            status: int
+                exit status of the command
+            stdout: str
+                standard output of the command
+            stderr: str
+                standard error of the command
+        """
+
+        _, stdout, stderr = self.get(host, username).exec_command(command, timeout = timeout)
+        out, err = stdout.read().decode(), stderr.read().decode()
+        return stdout.channel.recv_exit_status(), out, err
+
+    def close(self) -> None:
+        """
+        close all pooled connections
+        """
+
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
@@ -0,0 +1,237 @@
+"""
+automatic reconnection to a remote ratBerryPi
+"""
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from collections import OrderedDict
+import concurrent.futures
+import logging
+import threading
+import time
+import typing
+from pyBehavior.interfaces.rpi import wire
+
+
+logger = logging.getLogger(__name__)
+
+
+# commands which leave the pi in the same state no matter how many times
+# they are sent. these may be buffered while the connection is down and
+# replayed once it is restored. only the latest of each command for a
+# given target is kept
+IDEMPOTENT = {
+    'toggle_LED': lambda a: a['module'],
+    'toggle_valve': lambda a: a['module'],
+    'update_post_delay': lambda a: a['module'],
+    'arm_reward': lambda a: a['module'],
+    'disarm_reward': lambda a: a['module'],
+    'preload_tone': lambda a: (a['module'], a['name']),
+    'toggle_auto_fill': lambda a: None,
+    'set_auto_fill_frac_thresh': lambda a: None,
+    'set_microstep_type': lambda a: a['pump'],
+    'set_step_speed': lambda a: a['pump'],
+    'set_flow_rate': lambda a: a['pump'],
+    'change_syringe': lambda a: a['pump'],
+}
+
+# errors indicating that the connection to the pi was lost
+CONNECTION_ERRORS = (ConnectionError, OSError, EOFError)
+# errors indicating that a request was sent but the pi did not reply in time.
+# TimeoutError subclasses OSError so these must be caught first
+TIMEOUT_ERRORS = (TimeoutError, concurrent.futures.TimeoutError)
+
+
+class SupervisedClient(QObject):
+    """
+    wrapper around a ratBerryPi client which reconnects with exponential
+    backoff when the connection to the pi is lost. while the connection is
+    down reads raise ConnectionError, idempotent commands are buffered (up
+    to buffer_size distinct commands) and replayed in order once the
+    connection is restored, and all other commands fail with an error reply.
+    a request which is sent but not answered in time is not treated as a
+    lost connection: reads re-raise the timeout and commands fail with an
+    error reply. channels opened on the client are re-opened on every reconnect
+
+    Args:
+        connect: typing.Callable
+            function returning a new client connected to the pi
+        buffer_size: int (optional)
+            maximum number of commands to buffer while disconnected
+        backoff: float (optional)
+            time to wait before the first reconnection attempt in seconds.
+            the wait doubles after every failed attempt
+        max_backoff: float (optional)
+            maximum time to wait between reconnection attempts in seconds
+        probe: str (optional)
+            attribute read to check that a new connection works
+
+    ...
+    PyQt Signals
+
+    disconnected(str)
+        error which caused the connection to be lost
+    reconnected(float, int)
+        duration of the outage in seconds and the number of
+        buffered commands replayed
+    """
+
+    disconnected = pyqtSignal(str)
+    reconnected = pyqtSignal(float, int)
+
+    def __init__(self, connect:typing.Callable, buffer_size:int = 64, backoff:float = 0.5,
+                 max_backoff:float = 30., probe:str = 'data_path'):
+        super(SupervisedClient, self).__init__()
+        self.connect = connect
+        self.buffer_size = buffer_size
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.probe = probe
+        self.client = connect()
+        self.channels = []
+        self.outages = []
+        self._buffer = OrderedDict()
+        self._lock = threading.Lock()
+        self._down_since = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __getattr__(self, name):
+        if 'client' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.__dict__['client'], name)
+
+    @property
+    def connected(self) -> bool:
+        return self._down_since is None
+
+    def new_channel(self, name:str) -> None:
+        if name not in self.channels:
+            self.channels.append(name)
+        if self.connected:
+            try:
+                self.client.new_channel(name)
+            except CONNECTION_ERRORS as e:
+                self._lost(e)
+
+    def get(self, req:str, channel:str = None):
+        if not self.connected:
+            raise ConnectionError("not connected to the rpi")
+        try:
+            return self.client.get(req, channel = channel)
+        except TIMEOUT_ERRORS:
+            raise
+        except CONNECTION_ERRORS as e:
+            self._lost(e)
+            raise ConnectionError(f"lost connection to the rpi: {e}") from e
+
+    def get_many(self, reqs:typing.List[str], channel:str = None) -> list:
+        if not getattr(self.client, 'batched', False):
+            raise AttributeError("the wrapped client cannot read attributes in batches")
+        if not self.connected:
+            raise ConnectionError("not connected to the rpi")
+        try:
+            return self.client.get_many(reqs, channel = channel)
+        except TIMEOUT_ERRORS:
+            raise
+        except CONNECTION_ERRORS as e:
+            self._lost(e)
+            raise ConnectionError(f"lost connection to the rpi: {e}") from e
+
+    def run_command(self, command:str, args:dict = None, channel:str = None) -> str:
+        args = args if args is not None else {}
+        if self.connected:
+            try:
+                status = self.client.run_command(command, args, channel = channel)
+                if status.strip():
+                    return status
+                # replies are never empty unless the connection was closed
+                raise EOFError("connection closed by the rpi")
+            except TIMEOUT_ERRORS:
+                # the command may still be running on the pi
+                return f"ERROR: no reply to '{command}' from the rpi\n"
+            except CONNECTION_ERRORS as e:
+                self._lost(e)
+        return self._buffer_command(command, args, channel)
+
+    def _buffer_command(self, command:str, args:dict, channel:str) -> str:
+        if command not in IDEMPOTENT:
+            return f"ERROR: not connected, '{command}' was not sent\n"
+        key = (command, IDEMPOTENT[command](args))
+        with self._lock:
+            self._buffer.pop(key, None)
+            if len(self._buffer) >= self.buffer_size:
+                return f"ERROR: command buffer full, '{command}' was not sent\n"
+            self._buffer[key] = (command, args, channel)
+        return wire.BUFFERED
+
+    def _lost(self, err:Exception) -> None:
+        with self._lock:
+            if self._down_since is not None or self._stop_event.is_set():
+                return
+            self._down_since = time.monotonic()
+        self.disconnected.emit(f"{err}")
+        self._thread = threading.Thread(target = self._reconnect, daemon = True)
+        self._thread.start()
+
+    @staticmethod
+    def _close(client) -> None:
+        if client is not None and hasattr(client, 'close'):
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def _reconnect(self) -> None:
+        wait = self.backoff
+        self._close(self.client)
+        n = 0
+        while not self._stop_event.wait(wait):
+            wait = min(wait * 2, self.max_backoff)
+            client = None
+            try:
+                client = self.connect()
+                for name in self.channels:
+                    client.new_channel(name)
+                client.get(self.probe)
+                self.client = client
+                while True:
+                    n += self._replay()
+                    with self._lock:
+                        # only resume once nothing was buffered while replaying
+                        if not self._buffer:
+                            start, self._down_since = self._down_since, None
+                            break
+            except CONNECTION_ERRORS + (ValueError,):
+                self._close(client)
+                continue
+            outage = time.monotonic() - start
+            self.outages.append((start, outage))
+            self.reconnected.emit(outage, n)
+            return
+
+    def _replay(self) -> int:
+        n = 0
+        while True:
+            with self._lock:
+                if not self._buffer:
+                    return n
+                key, (command, args, channel) = next(iter(self._buffer.items()))
+            status = self.client.run_command(command, args, channel = channel)
+            with self._lock:
+                # leave the command buffered if it was superseded while being sent
+                if self._buffer.get(key) == (command, args, channel):
+                    del self._buffer[key]
+            if status != wire.SUCCESS:
+                logger.error(f"buffered command '{command}' failed on replay: {status.strip()}")
+            n += 1
+
+    def close(self) -> None:
+        """
+        stop reconnecting and close the wrapped client
+        """
+
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        if hasattr(self.client, 'close'):
+            self.client.close()
@@ -0,0 +1,356 @@
+"""
+tools for pulling data recorded on a ratBerryPi into the local session directory
+"""
+
+from PyQt5.QtCore import QThread, pyqtSignal
+from pathlib import Path, PurePosixPath
+from datetime import datetime
+import hashlib
+import json
+import os
+import shlex
+import stat
+import threading
+import time
+import typing
+
+
+CHUNK_SIZE = 1 << 20
+MANIFEST = "rpi_transfer.json"
+
+
+def _sha256(f) -> str:
+    h = hashlib.sha256()
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def copy_tail(source, rel:str, local:Path, size:int, on_chunk:typing.Callable = None) -> int:
+    """
+    make a local file match the first size bytes of a file on a source. only
+    the bytes past the end of the local file are copied unless the local file
+    is larger than size, in which case it is copied again from the start
+
+    Args:
+        source: LocalSource or SFTPSource
+            source to copy from
+        rel: str
+            path to the file relative to the source
+        local: Path
+            local copy of the file
+        size: int
+            size of the file on the source in bytes
+        on_chunk: typing.Callable (optional)
+            function called with the number of bytes in each chunk copied
+
+    Returns:
+        n: int
+            number of bytes copied
+    """
+
+    local_size = local.stat().st_size if local.exists() else 0
+    if local_size == size:
+        return 0
+    if local_size > size:
+        local_size = 0
+    local.parent.mkdir(parents = True, exist_ok = True)
+    n = 0
+    with source.open(rel, local_size) as src, open(local, 'r+b' if local_size > 0 else 'wb') as dst:
+        dst.seek(local_size)
+        dst.truncate()
+        remaining = size - local_size
+        while remaining > 0:
+            chunk = src.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise EOFError(f"unexpected end of '{rel}'")
+            dst.write(chunk)
+            remaining -= len(chunk)
+            n += len(chunk)
+            if on_chunk is not None:
+                on_chunk(len(chunk))
+    return n
+
+
+class LocalSource:
+    """
+    source of recorded files on the local filesystem. this is mostly useful
+    for testing or when the recording directory is mounted locally
+
+    Args:
+        path: str
+            path to the recorded file or directory of recorded files
+    """
+
+    def __init__(self, path:str):
+        self.path = Path(path)
+
+    def walk(self) -> typing.List[typing.Tuple[str, int]]:
+        """
+        list the relative path and size of every recorded file. paths are
+        relative to the parent of the recording path so they include its name
+        """
+
+        if self.path.is_file():
+            return [(self.path.name, self.path.stat().st_size)]
+        files = []
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                p = Path(root)/name
+                files.append((p.relative_to(self.path.parent).as_posix(), p.stat().st_size))
+        return files
+
+    def open(self, rel:str, offset:int = 0):
+        f = open(self.path.parent/rel, 'rb')
+        f.seek(offset)
+        return f
+
+    def checksum(self, rel:str) -> str:
+        """
+        sha256 hex digest of a file
+        """
+        with open(self.path.parent/rel, 'rb') as f:
+            return _sha256(f)
+
+
+class SFTPSource:
+    """
+    source of recorded files on a ratBerryPi accessed over sftp
+
+    Args:
+        sftp: paramiko.SFTPClient
+            sftp session on the pi
+        path: str
+            path on the pi to the recorded file or directory of recorded files
+        ssh: paramiko.SSHClient (optional)
+            ssh connection used to compute checksums on the pi. if not
+            provided checksums are computed by reading the file over sftp
+    """
+
+    def __init__(self, sftp, path:str, ssh = None):
+        self.sftp = sftp
+        self.path = PurePosixPath(path)
+        self.ssh = ssh
+
+    def walk(self) -> typing.List[typing.Tuple[str, int]]:
+        """
+        list the relative path and size of every recorded file. paths are
+        relative to the parent of the recording path so they include its name
+        """
+
+        root = self.sftp.stat(self.path.as_posix())
+        if not stat.S_ISDIR(root.st_mode):
+            return [(self.path.name, root.st_size)]
+        files = []
+        dirs = [self.path]
+        while dirs:
+            d = dirs.pop()
+            for attr in self.sftp.listdir_attr(d.as_posix()):
+                p = d/attr.filename
+                if stat.S_ISDIR(attr.st_mode):
+                    dirs.append(p)
+                else:
+                    files.append((p.relative_to(self.path.parent).as_posix(), attr.st_size))
+        return files
+
+    def open(self, rel:str, offset:int = 0):
+        f = self.sftp.open((self.path.parent/rel).as_posix(), 'rb')
+        f.seek(offset)
+        f.prefetch()
+        return f
+
+    def checksum(self, rel:str) -> str:
+        """
+        sha256 hex digest of a file
+        """
+
+        path = (self.path.parent/rel).as_posix()
+        if self.ssh is not None:
+            _, stdout, _ = self.ssh.exec_command(f"sha256sum {shlex.quote(path)}")
+            out = stdout.read().decode().split()
+            if stdout.channel.recv_exit_status() == 0 and out:
+                return out[0]
+        with self.sftp.open(path, 'rb') as f:
+            return _sha256(f)
+
+
+class SessionDataStreamer(QThread):
+    """
+    thread which incrementally mirrors files recorded on a ratBerryPi into a
+    local directory while a session is running. recordings on the pi only
+    ever grow, so on each pass only the bytes appended to each file since
+    the last pass are transferred. files that shrink are copied again in full
+
+    Args:
+        source: LocalSource or SFTPSource
+            where to read the recorded files from
+        dest: str
+            local directory to mirror the files into
+        interval: float (optional)
+            time between passes in seconds
+
+    ...
+    PyQt Signals
+
+    synced(int)
+        number of bytes transferred by a pass
+    failed(str)
+        error raised during a pass
+    """
+
+    synced = pyqtSignal(int)
+    failed = pyqtSignal(str)
+
+    def __init__(self, source, dest:str, interval:float = 5.):
+        super(SessionDataStreamer, self).__init__()
+        self.source = source
+        self.dest = Path(dest)
+        self.interval = interval
+        self.bytes_transferred = 0
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def sync(self) -> int:
+        """
+        bring the local copy up to date with the source
+
+        Returns:
+            n: int
+                number of bytes transferred
+        """
+
+        with self._lock:
+            n = 0
+            for rel, size in self.source.walk():
+                n += copy_tail(self.source, rel, self.dest/rel, size)
+            self.bytes_transferred += n
+            return n
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                n = self.sync()
+                if n > 0:
+                    self.synced.emit(n)
+            except (OSError, EOFError) as e:
+                self.failed.emit(f"{e}")
+
+    def stop(self, final_sync:bool = True) -> int:
+        """
+        stop streaming
+
+        Args:
+            final_sync: bool (optional)
+                whether to transfer anything recorded since the last pass
+
+        Returns:
+            n: int
+                number of bytes transferred by the final pass
+        """
+
+        self._stop_event.set()
+        self.wait()
+        return self.sync() if final_sync else 0
+
+
+class SessionTransfer(QThread):
+    """
+    thread which copies the data recorded on a ratBerryPi into the local
+    session directory once a session has ended. files already present
+    locally with a matching size and checksum are skipped and partially
+    copied files are resumed from where they left off. failed transfers
+    are retried with exponential backoff. a manifest recording the outcome
+    and the checksum of every file is written to the destination
+
+    Args:
+        source: LocalSource or SFTPSource
+            where to read the recorded files from
+        dest: str
+            local directory to copy the files into
+        retries: int (optional)
+            number of times to retry a failed transfer
+        on_finish: typing.Callable (optional)
+            function to call from the transfer thread once it is done
+            (e.g. to close the connection the source reads from)
+
+    ...
+    PyQt Signals
+
+    progress(int, int, str)
+        bytes copied or verified so far, total bytes and the current file
+    completed(str, str)
+        status ('success' or 'failed') and a message
+    """
+
+    progress = pyqtSignal(int, int, str)
+    completed = pyqtSignal(str, str)
+
+    def __init__(self, source, dest:str, retries:int = 3, on_finish:typing.Callable = None):
+        super(SessionTransfer, self).__init__()
+        self.source = source
+        self.dest = Path(dest)
+        self.retries = retries
+        self.on_finish = on_finish
+        self.status = None
+        self.checksums = {}
+
+    def _transfer(self) -> None:
+        files = self.source.walk()
+        total = sum(size for _, size in files)
+        done = 0
+        for rel, size in files:
+            local = self.dest/rel
+            self.progress.emit(done, total, rel)
+
+            def on_chunk(n):
+                nonlocal done
+                done += n
+                self.progress.emit(done, total, rel)
+
+            base = done
+            copy_tail(self.source, rel, local, size, on_chunk)
+            remote_sum = self.source.checksum(rel)
+            with open(local, 'rb') as f:
+                local_sum = _sha256(f)
+            if local_sum != remote_sum:
+                # the local copy diverged from the pi, copy it again from scratch
+                local.unlink()
+                copy_tail(self.source, rel, local, size)
+                with open(local, 'rb') as f:
+                    local_sum = _sha256(f)
+                if local_sum != remote_sum:
+                    raise IOError(f"checksum mismatch for '{rel}'")
+            self.checksums[rel] = local_sum
+            done = base + size
+            self.progress.emit(done, total, rel)
+
+    def _write_manifest(self, msg:str) -> None:
+        manifest = {'source': str(self.source.path),
+                    'status': self.status,
+                    'message': msg,
+                    'time': datetime.now().isoformat(),
+                    'sha256': self.checksums}
+        self.dest.mkdir(parents = True, exist_ok = True)
+        with open(self.dest/MANIFEST, 'w') as f:
+            json.dump(manifest, f, indent = 2)
+
+    def run(self):
+        msg = ""
+        for attempt in range(self.retries + 1):
+            try:
+                self._transfer()
+                self.status = 'success'
+                msg = f"copied {len(self.checksums)} files"
+                break
+            except Exception as e:
+                self.status = 'failed'
+                msg = f"{e}"
+                if attempt < self.retries:
+                    time.sleep(2 ** attempt)
+        self._write_manifest(msg)
+        if self.on_finish is not None:
+            try:
+                self.on_finish()
+            except Exception:
+                pass
+        self.completed.emit(self.status, msg)
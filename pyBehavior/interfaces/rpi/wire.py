@@ -0,0 +1,120 @@
+"""
+helpers for encoding and decoding messages exchanged with a ratBerryPi server
+
+requests are utf-8 encoded json objects terminated by a newline. the command
+name is stored at the 'command' key and all arguments are stored alongside it.
+GET requests carry the attribute path to read at the 'req' key. replies are
+single newline terminated lines of text (e.g. 'SUCCESS\\n' or the string
+representation of the requested attribute).
+
+to allow several requests to be in flight on one connection, a request may
+carry an integer 'id'. servers which understand ids wrap their reply in a json
+envelope of the form {"id": <id>, "reply": <text>}. servers which do not
+simply reply in order, in which case replies are matched to requests first
+in first out.
+"""
+
+import ast
+import json
+import typing
+
+TERMINATOR = b"\n"
+SUCCESS = "SUCCESS\n"
+# reply given locally for commands held back until the pi can be reached
+BUFFERED = "BUFFERED\n"
+# commands which only reply once the pump has finished moving. these may
+# take minutes so clients wait for their reply without a timeout
+JOB_COMMANDS = {'calibrate', 'fill_lines', 'empty_lines', 'push_to_reservoir', 'fill_syringe'}
+
+
+def encode_request(command:str, args:dict = None, req_id:int = None) -> bytes:
+    """
+    serialize a request
+
+    Args:
+        command: str
+            name of the command to run
+        args: dict (optional)
+            arguments to the command
+        req_id: int (optional)
+            id used to match the reply to this request
+    """
+
+    msg = dict(args) if args else {}
+    msg['command'] = command
+    if req_id is not None:
+        msg['id'] = req_id
+    return json.dumps(msg).encode('utf-8') + TERMINATOR
+
+
+def prepare_request(command:str, args:dict = None) -> bytes:
+    """
+    serialize a request ahead of time so it can be sent repeatedly with
+    finish_request, which only needs to append the request id
+    """
+
+    # drop the closing brace so the id can be appended without re-encoding
+    return encode_request(command, args)[:-len(TERMINATOR) - 1]
+
+
+def finish_request(prepared:bytes, req_id:int = None) -> bytes:
+    """
+    complete a request serialized with prepare_request
+    """
+
+    if req_id is None:
+        return prepared + b"}" + TERMINATOR
+    return prepared + b', "id": %d}' % req_id + TERMINATOR
+
+
+def decode_request(line:bytes) -> typing.Tuple[str, dict, typing.Optional[int]]:
+    """
+    deserialize a request into the command, its arguments and the request id
+    """
+
+    msg = json.loads(line.decode('utf-8'))
+    command = msg.pop('command')
+    req_id = msg.pop('id', None)
+    return command, msg, req_id
+
+
+def encode_reply(reply:str, req_id:int = None) -> bytes:
+    """
+    serialize a reply. replies to requests with an id are wrapped
+    in an envelope carrying that id
+    """
+
+    reply = reply if reply.endswith("\n") else reply + "\n"
+    if req_id is None:
+        return reply.encode('utf-8')
+    return json.dumps({'id': req_id, 'reply': reply}).encode('utf-8') + TERMINATOR
+
+
+def decode_reply(line:bytes) -> typing.Tuple[typing.Optional[int], str]:
+    """
+    deserialize a reply into the id of the request it answers (None if
+    the server did not send one) and the reply text
+    """
+
+    text = line.decode('utf-8')
+    if text.startswith('{'):
+        try:
+            msg = json.loads(text)
+            if isinstance(msg, dict) and 'id' in msg and 'reply' in msg:
+                return msg['id'], msg['reply']
+        except ValueError:
+            pass
+    return None, text if text.endswith("\n") else text + "\n"
+
+
+def parse_value(text:str):
+    """
+    convert the text of a GET reply to a python value. replies that are
+    not python literals (e.g. a syringe type) are returned as stripped strings
+    """
+
+    text = text.strip()
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
@@ -1,9 +1,175 @@
 from PyQt5.QtCore import QThread, pyqtSignal, QObject
+import logging
 import numpy as np
+import select
 import socket
-from PyQt5.QtWidgets import QVBoxLayout, QHBoxLayout, QLineEdit, QLabel, QGroupBox
+import statistics
+import struct
+import sys
+import threading
+import time
+import typing
+from collections import deque
+from PyQt5.QtWidgets import QApplication, QVBoxLayout, QHBoxLayout, QLineEdit, QLabel, QGroupBox
 from PyQt5.QtGui import  QDoubleValidator
 import ast
+from pyBehavior.interfaces.kalman import ConstantVelocityKalman
+from pyBehavior.interfaces.zones import ZoneEngine
+
+
+logger = logging.getLogger(__name__)
+
+# binary position packets start with a fixed little-endian header: the magic
+# bytes, format version, flags (reserved), number of keypoints, sequence
+# number and the time the packet was sent in seconds since the epoch. the
+# header is followed by float32 arrays of the x coordinates, y coordinates
+# and confidences of the keypoints
+PACKET_MAGIC = b"PYBP"
+PACKET_VERSION = 1
+PACKET_HEADER = struct.Struct("<4sBBHId")
+# largest payload of a UDP datagram
+MAX_PACKET_SIZE = 65507
+# socket option for kernel receive timestamps with nanosecond resolution.
+# python does not expose it so fall back to its value on linux
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35 if sys.platform.startswith('linux') else None)
+_TIMESPEC = struct.Struct("@ll")
+
+
+def encode_packet(xy:np.ndarray, conf:np.ndarray, seq:int = 0, timestamp:float = None) -> bytes:
+    """
+    serialize keypoints as a binary position packet
+
+    Args:
+        xy: np.ndarray
+            (n_keypoints, 2) array of keypoint coordinates
+        conf: np.ndarray
+            (n_keypoints,) array of keypoint confidences
+        seq: int (optional)
+            sequence number of the packet
+        timestamp: float (optional)
+            time the packet was sent. defaults to now
+    """
+
+    xy = np.asarray(xy, dtype = '<f4')
+    conf = np.asarray(conf, dtype = '<f4')
+    timestamp = timestamp if timestamp is not None else time.time()
+    header = PACKET_HEADER.pack(PACKET_MAGIC, PACKET_VERSION, 0, conf.size, seq & 0xFFFFFFFF, timestamp)
+    return header + xy[:, 0].tobytes() + xy[:, 1].tobytes() + conf.tobytes()
+
+
+def decode_packet(data:typing.Union[bytes, memoryview]) -> typing.Tuple[np.ndarray, np.ndarray, typing.Optional[int], typing.Optional[float]]:
+    """
+    deserialize a position packet. binary packets are read without copying,
+    so the arrays returned are views into data. packets that do not start
+    with PACKET_MAGIC are parsed as the legacy text format, a python literal
+    whose first element is a list of ((x, y), confidence) pairs
+
+    Returns:
+        xy: np.ndarray
+            (n_keypoints, 2) array of keypoint coordinates
+        conf: np.ndarray
+            (n_keypoints,) array of keypoint confidences
+        seq: int
+            sequence number of the packet (None for text packets)
+        timestamp: float
+            time the packet was sent (None for text packets)
+    """
+
+    if bytes(data[:len(PACKET_MAGIC)]) == PACKET_MAGIC:
+        _, version, _, n, seq, timestamp = PACKET_HEADER.unpack_from(data)
+        if version != PACKET_VERSION:
+            raise ValueError(f"unsupported position packet version {version}")
+        arr = np.frombuffer(data, dtype = '<f4', count = 3 * n, offset = PACKET_HEADER.size).reshape(3, n)
+        return arr[:2].T, arr[2], seq, timestamp
+    pos = ast.literal_eval(bytes(data).decode())
+    xy = np.array([i[0] for i in pos[0]], dtype = float)
+    conf = np.array([i[1] for i in pos[0]], dtype = float)
+    return xy, conf, None, None
+
+
+class PositionSmoother:
+    """
+    confidence weighted moving average of keypoint positions over the last
+    window packets, combined into a single position with per-keypoint
+    weights. the packets in the window are kept in a preallocated ring buffer
+    and the weighted sums are updated incrementally, so each update takes
+    time proportional to the number of keypoints regardless of the window
+    length and allocates no arrays
+
+    Args:
+        window: int (optional)
+            number of packets to average over
+        weights: typing.Sequence[float] (optional)
+            weight of each keypoint when combining them into one position.
+            by default all keypoints are weighted equally
+    """
+
+    # the running sums are recomputed from the buffer every so many
+    # updates so floating point error can not accumulate
+    RESYNC_INTERVAL = 1024
+
+    def __init__(self, window:int = 5, weights:typing.Sequence[float] = None):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.window = int(window)
+        self.weights = None if weights is None else np.asarray(weights, dtype = float)
+        self.reset(0)
+
+    @property
+    def n_keypoints(self) -> int:
+        return self._conf.shape[1]
+
+    def reset(self, n_keypoints:int) -> None:
+        """
+        clear the buffer and allocate it for a number of keypoints
+        """
+
+        if self.weights is not None and n_keypoints > 0 and self.weights.size != n_keypoints:
+            raise ValueError(f"got {n_keypoints} keypoints but {self.weights.size} keypoint weights")
+        self._wpos = np.zeros((self.window, n_keypoints, 2))
+        self._conf = np.zeros((self.window, n_keypoints))
+        self._wpos_sum = np.zeros((n_keypoints, 2))
+        self._conf_sum = np.zeros(n_keypoints)
+        self._keypoints = np.zeros((n_keypoints, 2))
+        self._pos = np.zeros(2)
+        w = self.weights if self.weights is not None else np.ones(n_keypoints)
+        self._w = w / w.sum() if n_keypoints > 0 else w
+        self._idx = 0
+        self._count = 0
+
+    def update(self, xy:np.ndarray, conf:np.ndarray) -> np.ndarray:
+        """
+        add the keypoints of a packet to the window
+
+        Args:
+            xy: np.ndarray
+                (n_keypoints, 2) array of keypoint coordinates
+            conf: np.ndarray
+                (n_keypoints,) array of keypoint confidences
+
+        Returns:
+            pos: np.ndarray
+                the smoothed position. this array is overwritten by the next update
+        """
+
+        if conf.shape[0] != self.n_keypoints:
+            self.reset(conf.shape[0])
+        i = self._idx
+        # drop the oldest packet from the sums and add the new one in its place
+        self._wpos_sum -= self._wpos[i]
+        self._conf_sum -= self._conf[i]
+        np.multiply(xy, conf[:, None], out = self._wpos[i])
+        self._conf[i] = conf
+        self._wpos_sum += self._wpos[i]
+        self._conf_sum += self._conf[i]
+        self._idx = (i + 1) % self.window
+        self._count += 1
+        if self._count % self.RESYNC_INTERVAL == 0:
+            self._wpos.sum(axis = 0, out = self._wpos_sum)
+            self._conf.sum(axis = 0, out = self._conf_sum)
+        np.divide(self._wpos_sum, self._conf_sum[:, None], out = self._keypoints)
+        np.dot(self._w, self._keypoints, out = self._pos)
+        return self._pos
 
 
 class Position(QGroupBox):
@@ -15,18 +181,39 @@ class Position(QGroupBox):
 
     (This widget is still under construction)
 
+    zones added to zones (a ZoneEngine) are tested against every position
+    as it arrives, and entering or leaving a zone emits zone_enter or
+    zone_exit with the name of the zone. zones are defined in the
+    coordinates of the positions emitted by new_position
+
+    if a ConstantVelocityKalman is passed as kalman it replaces the moving
+    average, and the filtered position, velocity and heading are emitted
+    through new_motion along with every position
+
     PyQt Signals:
     new_position(list)
+    new_motion(list, list, float)
+    zone_enter(str)
+    zone_exit(str)
     
     """
 
     new_position = pyqtSignal(list, name = 'newPosition')
+    new_motion = pyqtSignal(list, list, float, name = 'newMotion')
+    zone_enter = pyqtSignal(str, name = 'zoneEnter')
+    zone_exit = pyqtSignal(str, name = 'zoneExit')
 
-    def __init__(self, port:int = 1234):
+    def __init__(self, port:int = 1234, window:int = 5, weights:typing.Sequence[float] = None,
+                 zone_margin:float = 0., kalman:ConstantVelocityKalman = None):
 
         super(Position, self).__init__()
-        self.pos_thread = PositionThread(port)
+        self.pos_thread = PositionThread(port, window = window, weights = weights, zone_margin = zone_margin,
+                                         kalman = kalman)
+        self.zones = self.pos_thread.zones
         self.pos_thread.new_position.connect(lambda x: self.new_position.emit(x))
+        self.pos_thread.new_motion.connect(lambda p, v, h: self.new_motion.emit(p, v, h))
+        self.pos_thread.zone_enter.connect(self._zone_entered)
+        self.pos_thread.zone_exit.connect(self._zone_exited)
 
         layout = QVBoxLayout()
         port_layout = QHBoxLayout()
@@ -34,7 +221,7 @@ class Position(QGroupBox):
         self.port = QLineEdit()
         self.port.setValidator(QDoubleValidator())
         self.port.setText(f"{port}")
-        self.port.textChanged.connect(lambda x: self.pos_thread.bind_port(x))
+        self.port.editingFinished.connect(lambda: self.pos_thread.bind_port(self.port.text()))
         port_layout.addWidget(ip)
         port_layout.addWidget(self.port)
         layout.addLayout(port_layout)
@@ -46,38 +233,289 @@ class Position(QGroupBox):
         pos_layout.addWidget(self.pos)
         layout.addLayout(pos_layout)
 
+        zone_layout = QHBoxLayout()
+        zone_layout.addWidget(QLabel("Zones"))
+        self.zone_label = QLabel("")
+        zone_layout.addWidget(self.zone_label)
+        layout.addLayout(zone_layout)
+
         self.setLayout(layout)
 
+    def _zone_entered(self, name:str) -> None:
+        self.zone_label.setText(", ".join(self.zones.inside))
+        self.zone_enter.emit(name)
+
+    def _zone_exited(self, name:str) -> None:
+        self.zone_label.setText(", ".join(self.zones.inside))
+        self.zone_exit.emit(name)
+
     def start(self):
         self.pos_thread.start()
+        app = QApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.stop)
+
+    def stop(self):
+        """
+        stop receiving positions
+        """
+        self.pos_thread.stop()
 
 class PositionThread(QThread):
+    """
+    thread which receives position packets over UDP and emits the
+    confidence weighted average position of the keypoints over the last
+    few packets (see PositionSmoother). packets may be binary (see
+    encode_packet) or in the legacy text format; the format of each
+    packet is detected from its first bytes
+
+    whenever the socket is readable every pending packet is drained without
+    blocking and only the newest packet from each sender is processed, so
+    positions never queue up behind a slow parse or a busy GUI. superseded
+    packets are counted in dropped. where the kernel supports it packets are
+    stamped with their kernel receive time (SO_TIMESTAMPNS), which is used to
+    keep track of the time from sending a packet to emitting its position
+    (see latency)
+
+    if kalman is set, the keypoints are filtered by it instead of being
+    averaged over the last few packets. the filtered keypoints are combined
+    with the keypoint weights, and the position, velocity and heading are
+    emitted through new_motion. packets are timed by the time they were sent
+    when they carry it (binary packets) or else by the time they arrived. the
+    filter may be swapped or removed while running by setting kalman
+
+    Args:
+        port: int
+            port to receive packets on
+        window: int (optional)
+            number of packets to average over
+        weights: typing.Sequence[float] (optional)
+            weight of each keypoint when combining them into one position
+        zone_margin: float (optional)
+            distance outside of a zone the position must reach to leave it
+        kalman: ConstantVelocityKalman (optional)
+            filter to estimate the position and velocity with
+
+    ...
+    PyQt Signals
+
+    new_position(list)
+    new_motion(list, list, float)
+        position, velocity in units/s and heading in radians
+        (the direction of the velocity) estimated by the kalman filter
+    zone_enter(str)
+        name of a zone in zones the position entered
+    zone_exit(str)
+        name of a zone in zones the position left
+    """
     
     new_position = pyqtSignal(list, name = 'newPosition')
+    new_motion = pyqtSignal(list, list, float)
+    zone_enter = pyqtSignal(str)
+    zone_exit = pyqtSignal(str)
 
-    def __init__(self, port, buff_size = 10):
+    def __init__(self, port, buff_size = 10, window:int = 5, weights:typing.Sequence[float] = None,
+                 zone_margin:float = 0., kalman:ConstantVelocityKalman = None):
         super(PositionThread, self).__init__()
         self.sock = None
-        self.bind_port(port)
-        self.pos_buffer = []
-        self.conf_buffer = []
+        self.kernel_timestamps = False
+        self.poll_interval = 0.1
+        self.dropped = 0
+        self.latencies = deque(maxlen = 1000)
+        self.last_receive_time = None
+        self._stop_event = threading.Event()
+        self._port_lock = threading.Lock()
+        self._port_request = None
+        self._pending = {}
+        self._anc_size = socket.CMSG_SPACE(_TIMESPEC.size) if hasattr(socket, 'CMSG_SPACE') else 0
+        self._bind(port)
+        self.smoother = PositionSmoother(window, weights)
+        self.zones = ZoneEngine(zone_margin)
+        self.kalman = kalman
+        self.packet_format = None
+        self.last_seq = None
+        self.last_timestamp = None
+        self._recv_buf = bytearray(MAX_PACKET_SIZE)
+        self._xy = np.zeros((0, 2))
+        self._conf = np.zeros(0)
 
     def bind_port(self, port):
+        """
+        receive packets on a different port. while the thread is running
+        the socket is swapped by the thread itself between reads
+        """
+
+        if self.isRunning():
+            with self._port_lock:
+                self._port_request = int(port)
+        else:
+            self._bind(port)
+
+    def _bind(self, port) -> None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", int(port)))
+        sock.setblocking(False)
+        self.kernel_timestamps = False
+        if SO_TIMESTAMPNS is not None and hasattr(sock, 'recvmsg_into'):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+                self.kernel_timestamps = True
+            except OSError:
+                pass
         if self.sock:
             self.sock.close()
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind(("", int(port)))
+        self.sock = sock
+        self._pending = {}
+
+    def stop(self) -> None:
+        """
+        stop the thread and close the socket
+        """
+
+        self._stop_event.set()
+        self.wait()
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def latency(self) -> dict:
+        """
+        median time in ms from a packet being sent to arriving (transit,
+        only for binary packets and only meaningful if the clocks of the
+        sender and this machine are synchronized) and from a packet arriving
+        to its position being emitted (processing) over the last 1000 packets
+        """
+
+        transit = [t for t, _ in self.latencies if t == t]
+        processing = [p for _, p in self.latencies]
+        return {'transit': statistics.median(transit) * 1000 if transit else float('nan'),
+                'processing': statistics.median(processing) * 1000 if processing else float('nan'),
+                'dropped': self.dropped}
     
-    def run(self):
+    def set_smoothing(self, window:int = None, weights:typing.Sequence[float] = None) -> None:
+        """
+        change the number of packets averaged over and the keypoint weights.
+        the smoothing starts over from the next packet
+        """
+
+        window = window if window is not None else self.smoother.window
+        weights = weights if weights is not None else self.smoother.weights
+        self.smoother = PositionSmoother(window, weights)
+
+    def parse(self, data:typing.Union[bytes, memoryview]) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        parse a packet into preallocated arrays of the keypoint coordinates
+        and confidences, which are overwritten by the next packet
+        """
+
+        xy, conf, self.last_seq, self.last_timestamp = decode_packet(data)
+        self.packet_format = 'text' if self.last_seq is None else 'binary'
+        if self._conf.shape != conf.shape:
+            self._xy = np.empty(xy.shape)
+            self._conf = np.empty(conf.shape)
+        np.copyto(self._xy, xy)
+        np.copyto(self._conf, conf)
+        return self._xy, self._conf
+
+    def process(self, data:typing.Union[bytes, memoryview], t_recv:float = None) -> None:
+        """
+        parse a packet, update the smoothed position and emit it
+
+        Args:
+            data: typing.Union[bytes, memoryview]
+                the packet
+            t_recv: float (optional)
+                time the packet was received in seconds since the epoch
+        """
+
+        xy, conf = self.parse(data)
+        kalman = self.kalman
+        if kalman is None:
+            # the smoother starts over if the number of keypoints changes
+            pos = self.smoother.update(xy, conf)
+            x, y = float(pos[1]), float(pos[0])
+            self.new_position.emit([x, y])
+        else:
+            t = self.last_timestamp if self.last_timestamp is not None else \
+                (t_recv if t_recv is not None else time.time())
+            kp_pos, kp_vel = kalman.update(t, xy, conf)
+            pos, vel = self._combine(kp_pos), self._combine(kp_vel)
+            x, y = float(pos[1]), float(pos[0])
+            vx, vy = float(vel[1]), float(vel[0])
+            self.new_position.emit([x, y])
+            self.new_motion.emit([x, y], [vx, vy], float(np.arctan2(vy, vx)))
+        entered, exited = self.zones.update(x, y)
+        for name in exited:
+            self.zone_exit.emit(name)
+        for name in entered:
+            self.zone_enter.emit(name)
+        if t_recv is not None:
+            transit = t_recv - self.last_timestamp if self.last_timestamp is not None else float('nan')
+            self.latencies.append((transit, time.time() - t_recv))
+            self.last_receive_time = t_recv
+
+    def _combine(self, a:np.ndarray) -> np.ndarray:
+        # weighted mean of the keypoints the filter has seen
+        w = self.smoother.weights if self.smoother.weights is not None else np.ones(a.shape[0])
+        seen = np.isfinite(a).all(axis = 1)
+        if not seen.any():
+            return np.full(2, np.nan)
+        return w[seen] @ a[seen] / w[seen].sum()
+
+    def _recv(self) -> typing.Tuple[int, typing.Any, float]:
+        # receive one datagram into the receive buffer without blocking
+        if self.kernel_timestamps:
+            n, ancdata, _, addr = self.sock.recvmsg_into([self._recv_buf], self._anc_size)
+            for level, kind, data in ancdata:
+                if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(data) >= _TIMESPEC.size:
+                    sec, nsec = _TIMESPEC.unpack_from(data)
+                    return n, addr, sec + nsec * 1e-9
+            return n, addr, time.time()
+        n, addr = self.sock.recvfrom_into(self._recv_buf)
+        return n, addr, time.time()
+
+    def _drain(self) -> None:
+        # read every pending datagram keeping only the newest from each sender
+        view = memoryview(self._recv_buf)
         while True:
-            if self.sock:
-                pos = ast.literal_eval(self.sock.recv(1024).decode())
-                self.pos_buffer.append(np.array([i[0] for i in pos[0]]))
-                self.conf_buffer.append(np.array([i[1] for i in pos[0]]))
-                self.pos_buffer = self.pos_buffer[-5:]
-                self.conf_buffer = self.conf_buffer[-5:]
-                weighted_pos = np.array(self.pos_buffer) * np.array(self.conf_buffer)[:,:,None]
-                pos = weighted_pos.sum(axis=0)/np.array(self.conf_buffer).sum(axis=0)[:,None]
-                pos = pos.mean(axis=0).tolist()
-                self.new_position.emit(pos[::-1])
+            try:
+                n, addr, t_recv = self._recv()
+            except (BlockingIOError, InterruptedError):
+                return
+            pending = self._pending.get(addr)
+            if pending is None:
+                pending = self._pending[addr] = [bytearray(MAX_PACKET_SIZE), 0, 0.]
+            elif pending[1] > 0:
+                self.dropped += 1
+            pending[0][:n] = view[:n]
+            pending[1], pending[2] = n, t_recv
+
+    def run(self):
+        self._stop_event.clear()
+        while not self._stop_event.is_set():
+            with self._port_lock:
+                port, self._port_request = self._port_request, None
+            if port is not None:
+                try:
+                    self._bind(port)
+                except OSError as e:
+                    logger.error(f"failed to bind position socket to port {port}: {e}")
+            try:
+                readable, _, _ = select.select([self.sock], [], [], self.poll_interval)
+                if not readable:
+                    continue
+                self._drain()
+            except OSError as e:
+                logger.warning(f"failed to receive position packets: {e}")
+                self._stop_event.wait(self.poll_interval)
+                continue
+            # process the newest packets in the order they arrived
+            for pending in sorted(self._pending.values(), key = lambda p: p[2]):
+                n, pending[1] = pending[1], 0
+                if n == 0:
+                    continue
+                try:
+                    self.process(memoryview(pending[0])[:n], pending[2])
+                except (ValueError, SyntaxError, IndexError, TypeError, struct.error) as e:
+                    logger.warning(f"failed to parse position packet: {e}")
@@ -0,0 +1,180 @@
+"""
+detection of entries to and exits from spatial zones
+"""
+
+import threading
+import typing
+import numpy as np
+
+
+class ZoneEngine:
+    """
+    tests a position against a set of named rectangles, circles and polygons
+    and reports when the position enters or leaves each of them. all zones
+    of a kind are tested at once with vectorized signed distances, so the
+    cost of an update grows slowly with the number of zones. to keep noise
+    in the position from producing bursts of entries and exits at the edge
+    of a zone, a zone is entered once the position is inside it but only
+    left once the position is further than margin outside of it
+
+    zones are defined in the same coordinates as the positions they are
+    tested against. zones may be added and removed from any thread
+
+    Args:
+        margin: float (optional)
+            distance outside of a zone the position must reach to leave it
+    """
+
+    def __init__(self, margin:float = 0.):
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._zones = {}
+        self._inside = {}
+        self._build()
+
+    @property
+    def names(self) -> typing.List[str]:
+        return list(self._names)
+
+    @property
+    def inside(self) -> typing.List[str]:
+        """
+        names of the zones the position is currently in
+        """
+        with self._lock:
+            return [name for name, inside in zip(self._names, self._state) if inside]
+
+    def add_rect(self, name:str, x0:float, y0:float, x1:float, y1:float) -> None:
+        """
+        add an axis aligned rectangle with corners (x0, y0) and (x1, y1)
+        """
+        self._add(name, 'rect', np.array([min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)], dtype = float))
+
+    def add_circle(self, name:str, x:float, y:float, r:float) -> None:
+        """
+        add a circle of radius r centered on (x, y)
+        """
+        self._add(name, 'circle', np.array([x, y, r], dtype = float))
+
+    def add_polygon(self, name:str, vertices:typing.Sequence[typing.Tuple[float, float]]) -> None:
+        """
+        add a simple polygon with vertices listed in order
+        """
+
+        vertices = np.asarray(vertices, dtype = float)
+        if vertices.ndim != 2 or vertices.shape[1] != 2 or vertices.shape[0] < 3:
+            raise ValueError("a polygon needs at least 3 (x, y) vertices")
+        self._add(name, 'polygon', vertices)
+
+    def remove(self, name:str) -> None:
+        """
+        remove a zone
+        """
+
+        with self._lock:
+            self._zones.pop(name)
+            self._inside.pop(name, None)
+            self._build()
+
+    def clear(self) -> None:
+        """
+        remove all zones
+        """
+
+        with self._lock:
+            self._zones = {}
+            self._inside = {}
+            self._build()
+
+    def _add(self, name:str, kind:str, params:np.ndarray) -> None:
+        with self._lock:
+            self._zones[name] = (kind, params)
+            self._inside.setdefault(name, False)
+            self._build()
+
+    def _build(self) -> None:
+        # pack the zones of each kind into arrays. the zones are ordered
+        # rectangles, then circles, then polygons
+        rects = [(n, p) for n, (k, p) in self._zones.items() if k == 'rect']
+        circles = [(n, p) for n, (k, p) in self._zones.items() if k == 'circle']
+        polygons = [(n, p) for n, (k, p) in self._zones.items() if k == 'polygon']
+        self._names = [n for n, _ in rects + circles + polygons]
+        self._rects = np.array([p for _, p in rects]).reshape(-1, 4)
+        self._circles = np.array([p for _, p in circles]).reshape(-1, 3)
+        # the edges of all polygons are stored together, with the index of
+        # the first edge of each polygon so per polygon results can be reduced
+        if polygons:
+            self._edge_a = np.concatenate([p for _, p in polygons])
+            self._edge_b = np.concatenate([np.roll(p, -1, axis = 0) for _, p in polygons])
+            self._edge_start = np.cumsum([0] + [len(p) for _, p in polygons[:-1]])
+        else:
+            self._edge_a = self._edge_b = np.zeros((0, 2))
+            self._edge_start = np.zeros(0, dtype = int)
+        self._state = np.array([self._inside[n] for n in self._names], dtype = bool)
+
+    def distance(self, x:float, y:float) -> np.ndarray:
+        """
+        signed distance from a point to the edge of each zone, negative
+        inside the zone, in the order of names
+        """
+
+        with self._lock:
+            return self._distance(x, y)
+
+    def _distance(self, x:float, y:float) -> np.ndarray:
+        p = np.array([x, y])
+
+        # rectangles
+        r = self._rects
+        dx = np.maximum(np.maximum(r[:, 0] - x, x - r[:, 2]), 0)
+        dy = np.maximum(np.maximum(r[:, 1] - y, y - r[:, 3]), 0)
+        depth = np.minimum(np.minimum(x - r[:, 0], r[:, 2] - x), np.minimum(y - r[:, 1], r[:, 3] - y))
+        d_rect = np.where((dx > 0) | (dy > 0), np.hypot(dx, dy), -depth)
+
+        # circles
+        c = self._circles
+        d_circle = np.hypot(c[:, 0] - x, c[:, 1] - y) - c[:, 2]
+
+        # polygons: distance to the nearest edge, negative if an odd
+        # number of edges cross a ray cast from the point
+        if self._edge_start.size:
+            a, b = self._edge_a, self._edge_b
+            ab = b - a
+            t = np.clip(((p - a) * ab).sum(axis = 1) / np.maximum((ab * ab).sum(axis = 1), 1e-12), 0, 1)
+            d_edge = np.hypot(*(a + t[:, None] * ab - p).T)
+            crosses = ((a[:, 1] > y) != (b[:, 1] > y)) & \
+                      (x < a[:, 0] + (y - a[:, 1]) * ab[:, 0] / np.where(ab[:, 1] == 0, 1, ab[:, 1]))
+            d_poly = np.minimum.reduceat(d_edge, self._edge_start)
+            inside = np.add.reduceat(crosses.astype(int), self._edge_start) % 2 == 1
+            d_poly = np.where(inside, -d_poly, d_poly)
+        else:
+            d_poly = np.zeros(0)
+
+        return np.concatenate([d_rect, d_circle, d_poly])
+
+    def update(self, x:float, y:float) -> typing.Tuple[typing.List[str], typing.List[str]]:
+        """
+        test a new position against every zone
+
+        Returns:
+            entered: typing.List[str]
+                names of the zones the position entered
+            exited: typing.List[str]
+                names of the zones the position left
+        """
+
+        if not (np.isfinite(x) and np.isfinite(y)):
+            return [], []
+        with self._lock:
+            if not self._names:
+                return [], []
+            d = self._distance(x, y)
+            state = np.where(self._state, d <= self.margin, d <= 0)
+            changed = np.flatnonzero(state != self._state)
+            self._state = state
+            entered, exited = [], []
+            for i in changed:
+                name = self._names[i]
+                self._inside[name] = bool(state[i])
+                (entered if state[i] else exited).append(name)
+            return entered, exited
@@ -12,6 +12,11 @@ class Protocol(StateMachine, metaclass = ProtocolMeta):
     
     
     """
+
+    # ids of states during which housekeeping (e.g. refilling syringes)
+    # may run without delaying anything the animal is waiting for
+    safe_states = ()
+
     def __init__(self, parent):
         super(Protocol, self).__init__()
         self.parent = parent
@@ -27,6 +32,14 @@ class Protocol(StateMachine, metaclass = ProtocolMeta):
     def handle_input(self, _input):
         ...
 
+    def in_safe_window(self) -> bool:
+        """
+        whether the protocol is currently in a window where housekeeping
+        may run. by default this is true while in one of safe_states.
+        protocols may override this for finer control
+        """
+        return self.current_state.id in self.safe_states
+
     def _call_timeout(self):
         while not self.parent._running:
             time.sleep(0.5)
@@ -36,6 +49,7 @@ class Protocol(StateMachine, metaclass = ProtocolMeta):
                 self.parent.log('coundown finished')
                 self.timeout()
                 self.parent.log(f"STATE MACHINE ENTERED STATE: {self.current_state.id}")
+                self.parent.state_entered.emit(self.current_state.id)
             time.sleep(.5)
 
     def start_countdown(self, timeout):
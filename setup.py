@@ -9,13 +9,14 @@ setup(
     packages = find_packages(),
     scripts = ['pyBehavior/main.py'],
     package_data = {"": ["*.csv", "*.mat"]},
-    entry_points = {'console_scripts': ['pyBehavior = pyBehavior.main:main']},
+    entry_points = {'console_scripts': ['pyBehavior = pyBehavior.main:main',
+                                        'pyBehavior-bench = pyBehavior.bench:main',
+                                        'pyBehavior-rpi-server = pyBehavior.interfaces.rpi.server:main']},
     install_requires = [
         'numpy',
         'pyyaml',
         'python-statemachine',
-        'paramiko',
-        'scp'
+        'paramiko'
     ],
     extras_require = {'ni': ['nidaqmx']}
 )
\ No newline at end of file
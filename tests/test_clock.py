@@ -0,0 +1,47 @@
+import time
+import numpy as np
+from pyBehavior.bench import BlockingClient
+from pyBehavior.interfaces.rpi.clock import ClockModel, ClockSync
+from pyBehavior.interfaces.rpi.server import StandInServer
+
+
+def test_fit_recovers_offset_and_drift():
+    t = np.linspace(1000., 1600., 50)
+    offset = 2.5 + 1e-4 * (t - t[-1])
+    # a few probes delayed by queueing read the pi clock late
+    delay = np.full(t.size, 1e-3)
+    delay[::7] = 0.05
+    offset[::7] += 0.02
+    model = ClockModel.fit(list(zip(t, offset, delay)))
+    # the delayed probes are left out of the fit
+    assert model.n_samples == t.size - len(t[::7])
+    assert abs(model.to_pi(t[-1]) - t[-1] - 2.5) < 1e-9
+    assert abs(model.drift - 1e-4) < 1e-9
+    assert model.uncertainty == 5e-4
+    np.testing.assert_allclose(model.to_host(model.to_pi(t)), t)
+
+
+def test_fit_without_samples():
+    model = ClockModel.fit([])
+    assert model.n_samples == 0
+    assert model.to_pi(10.) == 10.
+
+
+def test_estimates_stand_in_clock_skew():
+    server = StandInServer(clock_offset = 3.2)
+    server.start()
+    client = BlockingClient(server.host, server.port)
+    try:
+        sync = ClockSync(client)
+        probes = []
+        for _ in range(20):
+            probes.append(sync.probe())
+            time.sleep(0.005)
+        model = ClockModel.fit(probes)
+        assert abs(model.offset - 3.2) < 5e-3
+        assert model.uncertainty < 5e-3
+        now = time.time()
+        assert abs(model.to_host(server.pi_time()) - now) < 5e-3
+    finally:
+        client.close()
+        server.stop()
@@ -0,0 +1,38 @@
+import numpy as np
+from pyBehavior.interfaces.kalman import ConstantVelocityKalman
+
+
+def test_first_update_starts_at_measurement():
+    kf = ConstantVelocityKalman()
+    xy = np.array([[1., 2.], [3., 4.]])
+    pos, vel = kf.update(0., xy, np.ones(2))
+    np.testing.assert_allclose(pos, xy)
+    np.testing.assert_allclose(vel, 0)
+
+
+def test_tracks_constant_velocity():
+    rng = np.random.default_rng(0)
+    kf = ConstantVelocityKalman(process_noise = 10., measurement_noise = 0.01)
+    v = np.array([30., -10.])
+    for i in range(200):
+        t = i / 100
+        pos, vel = kf.update(t, (v * t + rng.normal(0, 0.1, 2))[None], np.ones(1))
+    np.testing.assert_allclose(vel[0], v, atol = 2.)
+    np.testing.assert_allclose(pos[0], v * t, atol = 0.2)
+
+
+def test_zero_confidence_only_predicts():
+    kf = ConstantVelocityKalman()
+    kf.update(0., np.array([[0., 0.]]), np.ones(1))
+    kf.update(0.1, np.array([[1., 0.]]), np.ones(1))
+    before = kf.pos.copy() + kf.vel * 0.1
+    pos, _ = kf.update(0.2, np.array([[100., 100.]]), np.zeros(1))
+    np.testing.assert_allclose(pos, before)
+
+
+def test_gate_rejects_outliers():
+    kf = ConstantVelocityKalman(measurement_noise = 1., gate = 9.)
+    for i in range(10):
+        kf.update(i / 10, np.array([[0., 0.]]), np.ones(1))
+    pos, _ = kf.update(1., np.array([[50., 50.]]), np.ones(1))
+    assert np.abs(pos).max() < 1.
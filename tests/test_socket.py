@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from pyBehavior.interfaces.socket import PositionSmoother, decode_packet, encode_packet
+
+
+def test_decode_binary_packet():
+    xy = np.array([[1., 2.], [3., 4.], [5., 6.]])
+    conf = np.array([0.9, 0.5, 0.])
+    dec_xy, dec_conf, seq, timestamp = decode_packet(encode_packet(xy, conf, seq = 42, timestamp = 1234.5))
+    np.testing.assert_allclose(dec_xy, xy)
+    np.testing.assert_allclose(dec_conf, conf)
+    assert seq == 42
+    assert timestamp == 1234.5
+
+
+def test_decode_text_packet():
+    data = str(([((1., 2.), 0.9), ((3., 4.), 0.5)], 0)).encode()
+    xy, conf, seq, timestamp = decode_packet(data)
+    np.testing.assert_allclose(xy, [[1., 2.], [3., 4.]])
+    np.testing.assert_allclose(conf, [0.9, 0.5])
+    assert seq is None and timestamp is None
+
+
+def test_decode_rejects_unknown_version():
+    data = bytearray(encode_packet(np.zeros((1, 2)), np.ones(1)))
+    data[4] = 99
+    with pytest.raises(ValueError):
+        decode_packet(bytes(data))
+
+
+def _baseline(packets, window, weights):
+    # confidence weighted mean of each keypoint over the window, then weighted over keypoints
+    xy = np.array([p[0] for p in packets[-window:]])
+    conf = np.array([p[1] for p in packets[-window:]])
+    keypoints = (xy * conf[..., None]).sum(axis = 0) / conf.sum(axis = 0)[:, None]
+    return weights @ keypoints / weights.sum()
+
+
+@pytest.mark.parametrize('window', [1, 5, 16])
+def test_smoother_matches_baseline_mean(window):
+    rng = np.random.default_rng(window)
+    weights = np.array([2., 1., 1., 0.5])
+    smoother = PositionSmoother(window = window, weights = weights)
+    packets = []
+    for _ in range(3 * window + 2):
+        packets.append((rng.normal(0, 10, (4, 2)), rng.uniform(0.1, 1, 4)))
+        pos = smoother.update(*packets[-1])
+        np.testing.assert_allclose(pos, _baseline(packets, window, weights))
+
+
+def test_smoother_resyncs_running_sums():
+    rng = np.random.default_rng(0)
+    smoother = PositionSmoother(window = 3)
+    packets = []
+    for _ in range(PositionSmoother.RESYNC_INTERVAL + 5):
+        packets.append((rng.normal(0, 1e3, (2, 2)), rng.uniform(0.1, 1, 2)))
+        pos = smoother.update(*packets[-1])
+    np.testing.assert_allclose(pos, _baseline(packets, 3, np.ones(2)))
+
+
+def test_smoother_rejects_mismatched_weights():
+    smoother = PositionSmoother(weights = [1., 1.])
+    with pytest.raises(ValueError):
+        smoother.update(np.zeros((3, 2)), np.ones(3))
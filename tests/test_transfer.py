@@ -0,0 +1,33 @@
+import os
+from pyBehavior.interfaces.rpi.transfer import LocalSource, copy_tail
+
+
+def test_copy_tail_resumes(tmp_path):
+    remote = tmp_path/"pi"/"session"
+    remote.mkdir(parents = True)
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    (remote/"events.csv").write_bytes(data[:1000])
+    source = LocalSource(remote)
+    local = tmp_path/"local"/"session"/"events.csv"
+
+    assert copy_tail(source, "session/events.csv", local, 1000) == 1000
+    assert local.read_bytes() == data[:1000]
+    # the file grew on the pi, only the new bytes are copied
+    (remote/"events.csv").write_bytes(data)
+    chunks = []
+    assert copy_tail(source, "session/events.csv", local, len(data), chunks.append) == len(data) - 1000
+    assert sum(chunks) == len(data) - 1000
+    assert local.read_bytes() == data
+    # nothing left to copy
+    assert copy_tail(source, "session/events.csv", local, len(data)) == 0
+
+
+def test_copy_tail_restarts_larger_local_file(tmp_path):
+    remote = tmp_path/"pi"
+    remote.mkdir()
+    (remote/"log.txt").write_bytes(b"new contents")
+    local = tmp_path/"local"/"log.txt"
+    local.parent.mkdir()
+    local.write_bytes(b"much longer stale contents")
+    assert copy_tail(LocalSource(remote), "pi/log.txt", local, 12) == 12
+    assert local.read_bytes() == b"new contents"
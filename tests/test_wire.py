@@ -0,0 +1,33 @@
+from pyBehavior.interfaces.rpi import wire
+
+
+def test_request_round_trip():
+    args = {'module': 'module1', 'amount': 0.2}
+    line = wire.encode_request('trigger_reward', args, 5)
+    assert line.endswith(wire.TERMINATOR)
+    assert wire.decode_request(line) == ('trigger_reward', args, 5)
+    assert wire.decode_request(wire.encode_request('GET', {'req': 'data_path'})) == ('GET', {'req': 'data_path'}, None)
+
+
+def test_reply_round_trip():
+    assert wire.decode_reply(wire.encode_reply("SUCCESS", 4)) == (4, wire.SUCCESS)
+    # servers which do not echo ids reply with the bare text
+    assert wire.decode_reply(wire.encode_reply("0.5")) == (None, "0.5\n")
+
+
+def test_parse_value():
+    assert wire.parse_value("12\n") == 12
+    assert wire.parse_value("True\n") is True
+    assert wire.parse_value("BD5mL\n") == "BD5mL"
+
+
+def test_finish_request_matches_encode_request():
+    args = {'module': 'module1', 'amount': 0.2, 'force': True, 'enqueue': False}
+    prepared = wire.prepare_request('trigger_reward', args)
+    for req_id in (None, 0, 7, 123456):
+        assert wire.finish_request(prepared, req_id) == wire.encode_request('trigger_reward', args, req_id)
+
+
+def test_finish_request_without_args():
+    prepared = wire.prepare_request('get_time')
+    assert wire.decode_request(wire.finish_request(prepared, 3)) == ('get_time', {}, 3)
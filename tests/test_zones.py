@@ -0,0 +1,36 @@
+import math
+from pyBehavior.interfaces.zones import ZoneEngine
+
+
+def test_rect_hysteresis():
+    zones = ZoneEngine(margin = 1.)
+    zones.add_rect('box', 0, 0, 10, 10)
+    assert zones.update(-0.5, 5) == ([], [])
+    assert zones.update(0.5, 5) == (['box'], [])
+    # leaving by less than the margin does not count as an exit
+    assert zones.update(-0.5, 5) == ([], [])
+    assert zones.inside == ['box']
+    assert zones.update(-1.5, 5) == ([], ['box'])
+    assert zones.inside == []
+    # and re-entering needs the position to be inside again
+    assert zones.update(-0.5, 5) == ([], [])
+    assert zones.update(0.5, 5) == (['box'], [])
+
+
+def test_circle_and_polygon():
+    zones = ZoneEngine(margin = 0.5)
+    zones.add_circle('port', 0, 0, 2)
+    zones.add_polygon('tri', [(10, 0), (14, 0), (12, 4)])
+    assert zones.update(1, 1) == (['port'], [])
+    assert zones.update(2.3, 0) == ([], [])
+    assert zones.update(12, 1) == (['tri'], ['port'])
+    assert zones.update(12, 4.4) == ([], [])
+    assert zones.update(12, 4.6) == ([], ['tri'])
+
+
+def test_nan_positions_are_ignored():
+    zones = ZoneEngine()
+    zones.add_rect('box', 0, 0, 1, 1)
+    zones.update(0.5, 0.5)
+    assert zones.update(math.nan, 0.5) == ([], [])
+    assert zones.inside == ['box']